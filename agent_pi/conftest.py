@@ -0,0 +1,2 @@
+import sys
+sys.path.append('./socket_client/')
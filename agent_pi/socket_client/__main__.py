@@ -1,24 +1,45 @@
-import argparse
+import argparse, os, queue
 
 from client import Client
-from menu_items import menu
+from offline_queue import OfflineQueue
+from tls import create_client_context
+from menu_items import menu, show_event
 from text_helper import *
 
 def main():
     """Main method to run necessary methods.\n
     This method reads the command line arguments for the IP of the master pi and
     the ID of the car, creates a client object that creates a connection to the
-    Master Pi based on the IP and starts the main menu.
+    Master Pi based on the IP and starts the main menu. If the Master Pi can't
+    be reached the client keeps trying to connect in the background. Events
+    that the Master Pi pushes to the car are shown as soon as they arrive and
+    acted on by the menu.
     """
-    ip, car_id = parse_arguments()
+    args = parse_arguments()
+    car_id = args.car_id
     print(COLOUR_GREEN + LOGO + COLOUR_END)
-    client = Client(ip, car_id)
+
+    events = queue.Queue()
+    def on_event(event):
+        show_event(event)
+        events.put(event)
+
+    client = Client(
+        args.master_pi_ip,
+        car_id,
+        image_format=args.image_format,
+        image_quality=args.image_quality,
+        max_image_width=args.max_image_width,
+        heartbeat_interval=args.heartbeat_interval,
+        offline_queue=OfflineQueue(args.offline_queue),
+        ssl_context=create_client_context(args.tls_cert) if args.tls_cert else None,
+        on_event=on_event)
     try:
-        client.connect_to_server()
-        print("Connected to Master Pi")
-        menu(client, car_id)
-    except ConnectionRefusedError:
-        print("Failed to connect to Master Pi\n")
+        if client.connect_to_server():
+            print("Connected to Master Pi")
+        else:
+            print("Failed to connect to Master Pi, retrying in the background\n")
+        menu(client, car_id, events)
     except KeyboardInterrupt:
         pass
     finally:
@@ -28,10 +49,11 @@ def main():
 def parse_arguments():
     """Parses the Master Pi IP and car ID from the command line arguments.\n
     Creates a parse object, specifies what arguments are required and checks to
-    make sure that they are present.
+    make sure that they are present. Optional arguments control how images are
+    compressed before they are sent to the Master Pi.
 
-    :return: A list containing the IP of the master pi and the car ID
-    :rtype: list
+    :return: The parsed arguments
+    :rtype: argparse.Namespace
     """
     parser = argparse.ArgumentParser(
         description='Car interface to connect to RMIT Rideshare Master Pi')
@@ -43,9 +65,38 @@ def parse_arguments():
         'car_id',
         type=str,
         help='The ID of the car this Agent Pi corresponds to')
+    parser.add_argument(
+        '--image-format',
+        choices=['.jpg', '.png'],
+        default='.jpg',
+        help='The format images of faces are sent to the Master Pi in')
+    parser.add_argument(
+        '--image-quality',
+        type=int,
+        default=90,
+        help='The JPEG quality images of faces are sent with, from 0 to 100')
+    parser.add_argument(
+        '--max-image-width',
+        type=int,
+        default=None,
+        help='Scale images of faces down to this width before sending them')
+    parser.add_argument(
+        '--heartbeat-interval',
+        type=float,
+        default=30,
+        help='Seconds without sending anything before a heartbeat is sent to the Master Pi')
+    parser.add_argument(
+        '--offline-queue',
+        type=str,
+        default=os.path.join(os.path.dirname(__file__), 'offline_queue.json'),
+        help='The file that commands are kept in while the Master Pi cannot be reached')
+    parser.add_argument(
+        '--tls-cert',
+        type=str,
+        default=None,
+        help='Connect over TLS, checking the Master Pi against this copy of its certificate')
 
-    args = parser.parse_args()
-    return (args.master_pi_ip, args.car_id)
+    return parser.parse_args()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,73 @@
-import cv2, json, pickle, os, socket, sys
+import cv2, json, os, random, socket, ssl, sys, threading, time
+from concurrent.futures import Future
+from protocol import (ACK, COMMAND, EVENT, FrameError, HEADER, OPCODES,
+    PING, PONG, REGISTER, RESPONSE, TELEMETRY, decode_event, decode_response,
+    encode_ack, encode_command, encode_register, encode_telemetry, recv_frame,
+    send_frame, send_frames, set_keepalive)
 
 
 class Client:
     """A class to represent a TCP socket client that connects to a server and
-    for other code to interface with.
+    for other code to interface with.\n
+    Each command is sent as a single request frame and answered by a response
+    frame that carries the request's id, see the protocol module.\n
+    The methods can be called from several threads at once. Their requests are
+    all sent over the one connection without waiting for earlier ones to be
+    answered, and a thread reading the Master Pi's responses hands each one to
+    the request it answers, so a location update isn't held up by a slow face
+    login.\n
+    While nothing else is being sent a heartbeat is sent to the Master Pi,
+    which would otherwise close the connection as idle. If the Master Pi stops
+    answering, such as when the car goes out of range, the connection is
+    closed and waiting requests fail instead of waiting forever.\n
+    Whenever the connection is lost the client keeps trying to reconnect in
+    the background, waiting longer after each failed attempt. While it is
+    offline, commands that are safe to send more than once (setting the
+    car's location and returning it) are kept in the offline queue, and sent
+    together once it has reconnected. Other commands fail with a
+    ConnectionError until then.\n
+    The connection can be encrypted with TLS. When the client reconnects it
+    resumes its last TLS session, which is much quicker than a full handshake.\n
+    If an event handler is given, the client registers its car with the
+    Master Pi whenever it connects, and events that the Master Pi pushes, such
+    as the car's booking being cancelled, are passed to the handler. The
+    handler is called from the thread reading the Master Pi's messages, so it
+    should return quickly. Each event is acknowledged once the handler has
+    returned, so that the Master Pi knows that a car it has locked remotely
+    has been told.\n
+    The car's position can be sent many times a second with send_position,
+    which doesn't wait for a response.
 
     :param host: The IP address of the Master Pi
     :type host: string
     :param car_id: The ID of the car that this Agent Pi corresponds to
     :type car_id: string
+    :param image_format: The format images are sent to the Master Pi in,
+        either ".jpg" or ".png"
+    :type image_format: string
+    :param image_quality: The JPEG quality images are sent with, from 0 to 100
+    :type image_quality: int
+    :param max_image_width: The width that wider images are scaled down to
+        before they are sent, or None to send them at full size
+    :type max_image_width: int
+    :param heartbeat_interval: Seconds without sending anything before a
+        heartbeat is sent, or None to not send heartbeats
+    :type heartbeat_interval: float
+    :param reconnect: Whether to keep trying to reconnect once the connection
+        is lost
+    :type reconnect: bool
+    :param offline_queue: Where commands are kept while offline, or None to
+        fail them instead
+    :type offline_queue: OfflineQueue
+    :param port: The port that the Master Pi's server listens on
+    :type port: int
+    :param ssl_context: The TLS settings to connect with, see
+        tls.create_client_context, or None to connect over plain TCP
+    :type ssl_context: ssl.SSLContext
+    :param on_event: Function that is called with each event the Master Pi
+        pushes, a dict holding its type and details, or None to not register
+        for events
+    :type on_event: function
     """
     __PORT = 65000
     """The port that the server will listen on"""
@@ -16,28 +75,108 @@ class Client:
     """A socket object for the server"""
     __client = None
     """A socket object for the client"""
-
-
-    def __init__(self, host, car_id):
+    __MISSED_HEARTBEATS = 3
+    """The heartbeat intervals without hearing from the Master Pi before it
+    is taken to have gone"""
+    __KEEPALIVE_IDLE = 30
+    """The seconds without traffic before TCP keepalive probes are sent"""
+    __KEEPALIVE_INTERVAL = 10
+    """The seconds between TCP keepalive probes"""
+    __KEEPALIVE_COUNT = 3
+    """The unanswered TCP keepalive probes before the connection is dropped"""
+    __RECONNECT_DELAY = 0.5
+    """The seconds waited after the first failed attempt to reconnect, which
+    doubles after each failed attempt"""
+    __MAX_RECONNECT_DELAY = 30
+    """The most seconds waited between attempts to reconnect"""
+    __CONNECT_TIMEOUT = 10
+    """The seconds waited to connect to the Master Pi, including the TLS
+    handshake"""
+
+
+    def __init__(self, host, car_id, image_format=".jpg", image_quality=90,
+                 max_image_width=None, heartbeat_interval=30, reconnect=True,
+                 offline_queue=None, port=__PORT, ssl_context=None,
+                 on_event=None):
         """Constructor method
         """
         self.__host = host
+        self.__port = port
         self.__car_id = car_id
+        self.__image_format = image_format
+        self.__image_quality = image_quality
+        self.__max_image_width = max_image_width
+        self.__header = bytearray(HEADER.size)
+        self.__request_id = 0
+        self.__pending = {}
+        self.__pending_lock = threading.Lock()
+        self.__send_lock = threading.Lock()
+        self.__reader = None
+        self.__error = None
+        self.__heartbeat_interval = heartbeat_interval
+        self.__heartbeat = None
+        self.__stopped = threading.Event()
+        self.__last_sent = 0
+        self.__last_received = 0
+        self.__reconnect = reconnect
+        self.__reconnecting = False
+        self.__reconnector = None
+        self.__connected = threading.Event()
+        self.__offline_queue = offline_queue
+        self.__ssl_context = ssl_context
+        self.__tls_session = None
+        self.__on_event = on_event
 
 
     def connect_to_server(self):
-        """Creates and returns a TCP socket connection to the Master Pi
+        """Creates a TCP socket connection to the Master Pi.\n
+        If the Master Pi can't be reached and reconnecting is on, the client
+        keeps trying in the background.
+
+        :raises OSError: If the Master Pi can't be reached and reconnecting is
+            off
+        :return: Whether the client is connected
+        :rtype: bool
         """
-        address = (self.__host, self.__PORT)
-        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__server.connect(address)
+        try:
+            self.__open()
+        except OSError:
+            if not self.__reconnect:
+                raise
+            with self.__pending_lock:
+                self.__start_reconnecting()
+            return False
+        return self.__go_online()
 
 
     def disconnect_from_server(self):
         """Disconnects from the Master Pi server
         """
-        self.__server.close()
-        __server = None
+        self.__stopped.set()
+        if self.__heartbeat is not None:
+            self.__heartbeat.join()
+        if self.__reconnector is not None:
+            self.__reconnector.join()
+        # There is no socket if the Master Pi was never reached
+        if self.__server is not None:
+            try:
+                # Waking up the thread reading responses
+                self.__server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.__server.close()
+            if self.__reader is not None:
+                self.__reader.join()
+            self.__server = None
+
+
+    def is_connected(self):
+        """Returns whether the client is connected to the Master Pi.
+
+        :return: Whether the client is connected
+        :rtype: bool
+        """
+        return self.__connected.is_set()
 
 
     def login(self, username, password):
@@ -53,29 +192,19 @@ class Client:
         :return: A dictionary containing the response from the Master Pi
         :rtype: dict
         """
-        # Indicating to Master Pi to begin login and wait for OK response
-        message = "Login"
-        self.__server.sendall(message.encode())
-        data = self.__server.recv(4096)
-
-        # Sending login credentials to Master Pi
-        message = json.dumps({
+        # Sending login credentials to Master Pi and returning its response
+        data = self.__request("Login", {
             "username": username,
             "password": password
         })
-        self.__server.sendall(message.encode())
-
-        # Returning response from Master Pi
-        data = self.__server.recv(4096)
         response = json.loads(data.decode())
         return response
 
 
     def login_via_face(self, image):
         """Sends an image to the Master Pi to authenticate a user.
-        \nThe image is pickled and sent via the socket. As the data is too large
-        for the buffer size a terminating string is added to the end to indicate
-        that the image has finished being sent.\n
+        \nThe image is compressed as a JPEG or PNG and sent via the socket as a
+        single message.\n
         The client then waits for a response from the Master Pi of whether the
         login was successful.
 
@@ -84,60 +213,37 @@ class Client:
         :return: A dictionary containing the response from the Master Pi
         :rtype: dict
         """
-        # Indicating to Master Pi to begin login with face procedure and wait
-        # for an OK response
-        message = "Login With Face"
-        self.__server.sendall(message.encode())
-        data = self.__server.recv(4096)
-
-        # Sending pickle to Master Pi
-        self.__server.send(pickle.dumps(image))
-        # Since the pickled image is too large for it to be sent in one go, it
-        # has to be received in parts and so a terminating string is added to
-        # indicate that the image has finished being sent
-        self.__server.send(b'\x80\x03X\x08\x00\x00\x00ENDIMAGEq\x00.')
-
-        # Wait for Master Pi to send back which user it has identified
-        data = self.__server.recv(4096)
+        # Sending the compressed image to Master Pi and waiting for it to send
+        # back which user it has identified
+        data = self.__request(
+            "Login With Face", image=self.encode_image(image))
         response = json.loads(data.decode())
         return response
 
 
     def add_face(self, username, image):
         """Sends an image and username to the Master Pi to register a users face.
-        \nThe image and username are pickled and sent via the socket. As the
-        data is too large for the buffer size a terminating string is added to
-        the end to indicate that the image has finished being sent.\n
+        \nThe username and the image, compressed as a JPEG or PNG, are sent in
+        a single message.\n
         The client then waits for an 'ok' response once the Master Pi has
-        finished processing and saving the image.
+        finished processing and saving the image, a 'busy' response if the
+        Master Pi couldn't process it and it should be sent again, or an
+        'invalid' response if the Master Pi couldn't read the image.
 
         :param username: The user's username
         :type username: string
         :param image: The image of the user's face to be sent
         :type image: numpy.ndarray
+        :return: The response from the Master Pi, either "OK", "BUSY" or
+            "INVALID"
+        :rtype: string
         """
-        # Indicating to Master Pi to begin the add face procedure and wait for
-        # an OK repsonse
-        message = "Add Face"
-        self.__server.sendall(message.encode())
-        data = self.__server.recv(4096)
-
-        # Create pickle string of username and image
-        message = pickle.dumps({
-            "username": username,
-            "image": image
-        })
-
-        # Sending pickle to Master Pi
-        self.__server.send(message)
-        # Since the pickled image is too large for it to be sent in one go, it
-        # has to be received in parts and so a terminating string is added to
-        # indicate that the image has finished being sent
-        self.__server.send(b'\x80\x03X\x08\x00\x00\x00ENDIMAGEq\x00.')
-
-        # Wait for Master Pi to indicate that the image has been saved and
-        # encoded
-        data = self.__server.recv(4096)
+        # Sending username and compressed image to Master Pi and waiting for it
+        # to indicate that the image has been saved and encoded
+        data = self.__request("Add Face", {
+            "username": username
+        }, self.encode_image(image))
+        return data.decode()
 
 
     def login_via_bluetooth(self, mac_address):
@@ -153,19 +259,10 @@ class Client:
         :rtype: dict
         """
 
-        # Indicating to Master Pi to begin login and wait for OK response
-        message = "Login With Bluetooth"
-        self.__server.sendall(message.encode())
-        data = self.__server.recv(4096)
-
-        # Sending login credentials to Master Pi
-        message = json.dumps({
+        # Sending login credentials to Master Pi and returning its response
+        data = self.__request("Login With Bluetooth", {
             "mac_address": mac_address
         })
-        self.__server.sendall(message.encode())
-
-        # Returning response from Master Pi
-        data = self.__server.recv(4096)
         response = json.loads(data.decode())
         return response
 
@@ -180,22 +277,39 @@ class Client:
         :param mac_address: The users mac address
         :type mac_address: string
         """
-
-        # Indicate to Master Pi to begin updating users mac address
-        # and wait for OK response
-        message = "Add Bluetooth"
-        self.__server.sendall(message.encode())
-        data = self.__server.recv(4096)
-
-        # Sending user credentials to Master Pi
-        message = json.dumps({
+        # Sending user credentials to Master Pi and waiting for its response
+        self.__request("Add Bluetooth", {
             "username": username,
             "mac_address": mac_address
         })
-        self.__server.sendall(message.encode())
 
-        # Returning response from Master Pi
-        data = self.__server.recv(4096)
+
+    def encode_image(self, image):
+        """Compresses an image to be sent to the Master Pi, scaling it down
+        first if it is wider than the maximum width.
+
+        :param image: The image in OpenCV (BGR) ordering
+        :type image: numpy.ndarray
+        :raises ValueError: If the image can't be encoded
+        :return: The encoded image
+        :rtype: bytes
+        """
+        height, width = image.shape[:2]
+        if self.__max_image_width is not None and width > self.__max_image_width:
+            scale = self.__max_image_width / width
+            image = cv2.resize(
+                image,
+                (self.__max_image_width, max(1, round(height * scale))),
+                interpolation=cv2.INTER_AREA)
+
+        if self.__image_format == ".jpg":
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.__image_quality]
+        else:
+            params = []
+        success, data = cv2.imencode(self.__image_format, image, params)
+        if not success:
+            raise ValueError("Image could not be encoded")
+        return data.tobytes()
 
 
     def get_server(self):
@@ -222,22 +336,15 @@ class Client:
         :return: The message returned from the Master Pi
         :rtype: string
         """
-        # Indicating to Master Pi to begin returning car process and wait for
-        # and OK response
-        message = "Change Lock Status"
-        self.__server.sendall(message.encode())
-        data = self.__server.recv(4096)
-
-        # Sending car ID to Master Pi
-        message = json.dumps({
+        # Sending car ID to Master Pi and getting its response. Returning the
+        # car can be sent again safely and so is queued while offline
+        data = self.__request("Change Lock Status", {
             "username": username,
             "car_id": car_id,
             "method": method
-        })
-        self.__server.sendall(message.encode())
-
-        # Getting response from Master Pi and returning it
-        data = self.__server.recv(4096)
+        }, queueable=(method == "return"))
+        if data is None:
+            return "Car will be returned once the Master Pi can be reached"
         response = json.loads(data.decode())
         return response['message']
 
@@ -255,20 +362,393 @@ class Client:
         :return: The message returned from the Master Pi
         :rtype: string
         """
-        # Indicating to Master Pi to begin setting location process and wait for
-        # and OK response
-        message = "Change Car Location"
-        self.__server.sendall(message.encode())
-        data = self.__server.recv(4096)
-
-        # Sending car ID to Master Pi
-        message = json.dumps({
+        # Sending car ID and location to Master Pi and getting its response,
+        # or queueing it while offline
+        data = self.__request("Change Car Location", {
             "car_id": car_id,
             "location": location
-        })
-        self.__server.sendall(message.encode())
-
-        # Getting response from Master Pi and returning it
-        data = self.__server.recv(4096)
+        }, queueable=True)
+        if data is None:
+            return "Car location will be updated once the Master Pi can be reached"
         response = json.loads(data.decode())
         return response['message']
+
+
+    def send_position(self, latitude, longitude):
+        """Sends the car's position to the Master Pi without waiting for a
+        response, so that it can be called many times a second as the car
+        moves.\n
+        Positions are sent as a few bytes each rather than as a command, and
+        the Master Pi only saves the latest position of each car every so
+        often. A position that can't be sent is dropped rather than queued, as
+        the next one replaces it anyway.
+
+        :param latitude: The car's latitude in degrees
+        :type latitude: float
+        :param longitude: The car's longitude in degrees
+        :type longitude: float
+        :return: Whether the position was sent
+        :rtype: bool
+        """
+        with self.__pending_lock:
+            if not self.__connected.is_set():
+                return False
+            sock = self.__server
+            self.__start_reader(sock)
+
+        try:
+            self.__send(sock, TELEMETRY, encode_telemetry(
+                self.__car_id, latitude, longitude))
+        except OSError as error:
+            self.__connection_lost(sock, error)
+            return False
+        return True
+
+
+    def __request(self, command, message=None, image=b"", queueable=False):
+        """Sends a command and its details to the Master Pi as a single request
+        and waits for the response to it. Other requests may be sent and
+        answered while this one is waiting.\n
+        A queueable command is put in the offline queue instead if the client
+        is offline or the connection is lost before it is answered.
+
+        :param command: The name of the command, such as "Login"
+        :type command: string
+        :param message: The details of the request
+        :type message: dict
+        :param image: An encoded image to send with the request
+        :type image: bytes
+        :param queueable: Whether the command is safe to send more than once
+            and so can be queued while offline
+        :type queueable: bool
+        :raises FrameError: If the Master Pi replies with something other than
+            responses to the requests sent
+        :raises ConnectionError: If the client is offline, or the Master Pi
+            disconnects before answering
+        :return: The body of the response, or None if the command was queued
+        :rtype: bytes
+        """
+        queueable = queueable and self.__offline_queue is not None
+        response = Future()
+        with self.__pending_lock:
+            if not self.__connected.is_set():
+                if queueable:
+                    self.__offline_queue.put(command, message)
+                    return None
+                raise ConnectionError("Not connected to the Master Pi")
+            sock = self.__server
+            self.__request_id += 1
+            request_id = self.__request_id
+            self.__pending[request_id] = response
+            self.__start_reader(sock)
+
+        try:
+            self.__send(sock, COMMAND, encode_command(
+                request_id, OPCODES[command], message, image))
+        except OSError as error:
+            with self.__pending_lock:
+                waiting = self.__pending.pop(request_id, None)
+            self.__connection_lost(sock, error)
+            if waiting is not None:
+                response.set_exception(error)
+
+        try:
+            return response.result()
+        except OSError:
+            if not queueable:
+                raise
+            self.__offline_queue.put(command, message)
+            return None
+
+
+    def __open(self):
+        """Connects a new socket to the Master Pi and starts sending heartbeats
+        over it.
+
+        :raises OSError: If the Master Pi can't be reached
+        """
+        address = (self.__host, self.__port)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.__CONNECT_TIMEOUT)
+            sock.connect(address)
+            set_keepalive(sock, self.__KEEPALIVE_IDLE,
+                          self.__KEEPALIVE_INTERVAL, self.__KEEPALIVE_COUNT)
+            if self.__ssl_context is not None:
+                # Resuming the last session if there was one
+                sock = self.__ssl_context.wrap_socket(
+                    sock, session=self.__tls_session)
+            sock.settimeout(None)
+        except OSError:
+            sock.close()
+            raise
+
+        with self.__pending_lock:
+            self.__server = sock
+            self.__reader = None
+            self.__last_sent = self.__last_received = time.monotonic()
+        if self.__heartbeat_interval is not None:
+            self.__heartbeat = threading.Thread(
+                target=self.__send_heartbeats, args=(sock,), daemon=True)
+            self.__heartbeat.start()
+
+
+    def __go_online(self):
+        """Registers the car for events, sends every command in the offline
+        queue over the new connection and then lets new requests be sent.
+
+        :return: Whether the client is now online, or False if the connection
+            was lost while the queue was being sent
+        :rtype: bool
+        """
+        sock = self.__server
+        if self.__on_event is not None and not self.__register(sock):
+            return False
+        while True:
+            entries = []
+            if self.__offline_queue is not None:
+                entries = self.__offline_queue.peek()
+            if entries and not self.__flush(sock, entries):
+                return False
+
+            with self.__pending_lock:
+                if self.__server is not sock:
+                    return False
+                # Commands may have been queued while the queue was being sent
+                if self.__offline_queue is None or len(self.__offline_queue) == 0:
+                    self.__reconnecting = False
+                    self.__connected.set()
+                    return True
+
+
+    def __register(self, sock):
+        """Tells the Master Pi which car this is, so that it can push events
+        to the car, and starts reading them straight away.
+
+        :param sock: The socket connected to the Master Pi
+        :type sock: socket
+        :return: Whether the car was registered, or False if the connection
+            was lost
+        :rtype: bool
+        """
+        with self.__pending_lock:
+            self.__start_reader(sock)
+        try:
+            self.__send(sock, REGISTER, encode_register(self.__car_id))
+        except OSError as error:
+            self.__connection_lost(sock, error)
+            return False
+        return True
+
+
+    def __flush(self, sock, entries):
+        """Sends queued commands to the Master Pi as one batch and waits for
+        them all to be answered, removing them from the queue once they are.
+
+        :param sock: The socket connected to the Master Pi
+        :type sock: socket
+        :param entries: The queued commands
+        :type entries: list
+        :return: Whether every command was answered
+        :rtype: bool
+        """
+        frames, responses = [], []
+        with self.__pending_lock:
+            for entry in entries:
+                self.__request_id += 1
+                response = Future()
+                self.__pending[self.__request_id] = response
+                responses.append(response)
+                frames.append((COMMAND, encode_command(
+                    self.__request_id, OPCODES[entry["command"]],
+                    entry["message"])))
+            self.__start_reader(sock)
+
+        try:
+            with self.__send_lock:
+                send_frames(sock, frames)
+                self.__last_sent = time.monotonic()
+        except OSError as error:
+            self.__connection_lost(sock, error)
+            return False
+
+        try:
+            for response in responses:
+                response.result()
+        except (OSError, FrameError):
+            return False
+        self.__offline_queue.remove([entry["id"] for entry in entries])
+        return True
+
+
+    def __connection_lost(self, sock, error):
+        """Fails every request waiting on a connection that has been lost and
+        starts reconnecting, unless the client is disconnecting.
+
+        :param sock: The socket whose connection was lost
+        :type sock: socket
+        :param error: The error that the connection was lost with
+        :type error: Exception
+        """
+        with self.__pending_lock:
+            if self.__server is not sock or self.__error is error:
+                return
+            self.__error = error
+            self.__connected.clear()
+            pending, self.__pending = self.__pending, {}
+            if self.__reconnect and not self.__stopped.is_set():
+                self.__start_reconnecting()
+        for response in pending.values():
+            response.set_exception(error)
+        try:
+            # Waking up the thread reading responses, which closes the socket
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+    def __start_reconnecting(self):
+        """Starts the thread that reconnects to the Master Pi if it isn't
+        already running. Must be called while holding the pending lock.
+        """
+        if not self.__reconnecting:
+            self.__reconnecting = True
+            self.__reconnector = threading.Thread(
+                target=self.__reconnect_with_backoff, daemon=True)
+            self.__reconnector.start()
+
+
+    def __reconnect_with_backoff(self):
+        """Keeps trying to reconnect to the Master Pi until it succeeds or the
+        client disconnects.\n
+        The wait between attempts doubles after each failure, up to a limit,
+        and is partly random so that every car that lost its connection at the
+        same time doesn't reconnect at the same moment.
+        """
+        delay = self.__RECONNECT_DELAY
+        while not self.__stopped.wait(delay / 2 + random.uniform(0, delay / 2)):
+            try:
+                self.__open()
+            except OSError:
+                delay = min(delay * 2, self.__MAX_RECONNECT_DELAY)
+                continue
+            if self.__go_online():
+                return
+            delay = min(delay * 2, self.__MAX_RECONNECT_DELAY)
+
+
+    def __receive_responses(self, sock):
+        """Receives responses from the Master Pi and passes each one to the
+        request that it answers, and each event to the event handler, until
+        the connection closes.\n
+        Once the connection closes or the Master Pi sends something unexpected,
+        every request still waiting fails with the error.
+
+        :param sock: The socket connected to the Master Pi
+        :type sock: socket
+        """
+        save_session = isinstance(sock, ssl.SSLSocket)
+        try:
+            while True:
+                message_type, payload = recv_frame(sock, self.__header)
+                self.__last_received = time.monotonic()
+                if save_session:
+                    # Keeping the TLS session, whose ticket has been read by
+                    # now, so that it can be resumed when reconnecting. It
+                    # can't be resumed once the connection has been dropped
+                    self.__tls_session = sock.session
+                    save_session = False
+                if message_type == PONG:
+                    continue
+                if message_type == EVENT and self.__on_event is not None:
+                    event_id, event = decode_event(payload)
+                    self.__handle_event(event_id, event)
+                    self.__send(sock, ACK, encode_ack(event_id))
+                    continue
+                if message_type != RESPONSE:
+                    raise FrameError("Expected a response but got type {}".format(
+                        message_type))
+                request_id, body = decode_response(payload)
+                with self.__pending_lock:
+                    response = self.__pending.pop(request_id, None)
+                if response is None:
+                    raise FrameError("Got a response to unknown request {}".format(
+                        request_id))
+                response.set_result(body)
+        except (OSError, FrameError) as error:
+            self.__connection_lost(sock, error)
+        finally:
+            sock.close()
+
+
+    def __handle_event(self, event_id, event):
+        """Passes an event that the Master Pi has pushed to the event handler.
+        An error from the handler is printed rather than dropping the
+        connection.
+
+        :param event_id: The id of the event
+        :type event_id: int
+        :param event: The event, holding its type and details
+        :type event: dict
+        """
+        try:
+            self.__on_event(event)
+        except Exception as error:
+            print("Error handling event {} ({}): {}".format(
+                event_id, event.get("type"), error), file=sys.stderr)
+
+
+    def __send_heartbeats(self, sock):
+        """Sends a heartbeat whenever nothing has been sent for the heartbeat
+        interval, until the client disconnects or the connection is replaced.\n
+        If nothing has been heard from the Master Pi for several intervals the
+        connection is shut down, which fails every waiting request.
+
+        :param sock: The socket connected to the Master Pi
+        :type sock: socket
+        """
+        interval = self.__heartbeat_interval
+        while not self.__stopped.wait(interval / 2) and self.__server is sock:
+            now = time.monotonic()
+            if now - self.__last_received > interval * self.__MISSED_HEARTBEATS:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+            if now - self.__last_sent >= interval:
+                try:
+                    with self.__pending_lock:
+                        self.__start_reader(sock)
+                    self.__send(sock, PING, b"")
+                except OSError:
+                    return
+
+
+    def __start_reader(self, sock):
+        """Starts the thread that reads from the Master Pi if it isn't already
+        running. Must be called while holding the pending lock.
+
+        :param sock: The socket connected to the Master Pi
+        :type sock: socket
+        """
+        if self.__reader is None:
+            self.__reader = threading.Thread(
+                target=self.__receive_responses, args=(sock,), daemon=True)
+            self.__reader.start()
+
+
+    def __send(self, sock, message_type, payload):
+        """Sends a whole message at once, so that messages from different
+        threads aren't mixed together.
+
+        :param sock: The socket connected to the Master Pi
+        :type sock: socket
+        :param message_type: The type of the message
+        :type message_type: int
+        :param payload: The message's payload
+        :type payload: bytes
+        """
+        with self.__send_lock:
+            send_frame(sock, message_type, payload)
+            self.__last_sent = time.monotonic()
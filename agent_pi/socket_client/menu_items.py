@@ -3,48 +3,94 @@ import bluetooth, cv2, getpass, os, re
 from qr_code_util import QrCodeUtil
 
 
-def menu(client, car_id):
+def menu(client, car_id, events=None):
     """Displays a menu that users can select from that calls other methods
 
     :param client: The socket connection to the Master Pi
     :type client: Client
     :param car_id: The ID of the car that this Agent Pi corresponds to
     :type car_id: string
+    :param events: The events pushed by the Master Pi that the menu hasn't
+        acted on yet
+    :type events: queue.Queue
     """
 
     user = None
     role = None
 
     while True:
-        if user is None:
-            print("\nYou will need to log in to continue")
-            user, role = login_menu(client)
-        else:
-            print("\nLogged in as {} with {} privileges".format(user, role))
-            print("1. Unlock Car"
-                  + "\n2. Return Car"
-                  + "\n3. Set Location"
-                  + "\n4. Setup facial recognition login"
-                  + "\n5. Setup bluetooth login"
-                  + "\n6. Setup QR code login"
-                  + "\n7. Logout")
-            selection = input("Make selection [1-7]: ")
-            if selection == "1":
-                change_lock_status(client, user, car_id, "unlock")
-            elif selection == "2":
-                change_lock_status(client, user, car_id, "return")
-            elif selection == "3":
-                set_location(client, car_id)
-            elif selection == "4":
-                add_face(client, user)
-            elif selection == "5":
-                add_bluetooth(client, user, role)
-            elif selection == "6":
-                generate_qr_code(client, user, role)
-            elif selection == "7":
+        # Logging the user out if their booking has been cancelled or the car
+        # has been locked since the last selection
+        while events is not None and not events.empty():
+            event = events.get()
+            if user is not None and (
+                    event["type"] == "remote_lock"
+                    or (event["type"] == "booking_cancelled"
+                        and event.get("username") == user)):
+                print("\n{} has been logged out".format(user))
                 user = None
+                role = None
+
+        # Commands other than setting the location or returning the car can't
+        # be run until the client has reconnected to the Master Pi
+        try:
+            if user is None:
+                print("\nYou will need to log in to continue")
+                user, role = login_menu(client)
             else:
-                print("Invalid selection")
+                print("\nLogged in as {} with {} privileges".format(user, role))
+                print("1. Unlock Car"
+                      + "\n2. Return Car"
+                      + "\n3. Set Location"
+                      + "\n4. Setup facial recognition login"
+                      + "\n5. Setup bluetooth login"
+                      + "\n6. Setup QR code login"
+                      + "\n7. Logout")
+                selection = input("Make selection [1-7]: ")
+                if selection == "1":
+                    change_lock_status(client, user, car_id, "unlock")
+                elif selection == "2":
+                    change_lock_status(client, user, car_id, "return")
+                elif selection == "3":
+                    set_location(client, car_id)
+                elif selection == "4":
+                    add_face(client, user)
+                elif selection == "5":
+                    add_bluetooth(client, user, role)
+                elif selection == "6":
+                    generate_qr_code(client, user, role)
+                elif selection == "7":
+                    user = None
+                else:
+                    print("Invalid selection")
+        except ConnectionError:
+            print("Not connected to the Master Pi, reconnecting. Please try again shortly")
+
+
+def show_event(event):
+    """Prints an event that the Master Pi has pushed to the car, such as its
+    booking being cancelled
+
+    :param event: The event, holding its type and details
+    :type event: dict
+    """
+
+    if event["type"] == "booking_started":
+        message = "This car has been booked by {} until {}".format(
+            event.get("username"), event.get("end_time"))
+    elif event["type"] == "booking_cancelled":
+        message = "The booking of this car by {} has been cancelled".format(
+            event.get("username"))
+    elif event["type"] == "remote_lock":
+        message = "This car has been locked by an admin"
+    elif event["type"] == "remote_unlock":
+        message = "This car has been unlocked by an admin"
+    elif event["type"] == "issue_reported":
+        message = "An issue has been reported with this car: {}".format(
+            event.get("details"))
+    else:
+        message = "Update from the Master Pi: {}".format(event["type"])
+    print("\n" + message)
 
 
 def login_menu(client):
@@ -138,7 +184,9 @@ def login_via_face(client):
         print("Processing...")
         # Checking for successful login
         response = client.login_via_face(image)
-        if response['username'] is None:
+        if response.get('message'):
+            print(response['message'])
+        elif response['username'] is None:
             print("Unsuccessful Login.")
         else:
             user = response['username']
@@ -169,8 +217,13 @@ def add_face(client, username):
         print("ERROR: Image does not exist")
     else:
         print("Processing image and adding to dataset...")
-        client.add_face(username, image)
-        print("Finished!")
+        response = client.add_face(username, image)
+        if response == "BUSY":
+            print("The server is busy, please try again.")
+        elif response == "INVALID":
+            print("ERROR: The image could not be read")
+        else:
+            print("Finished!")
 
 
 def login_via_bluetooth(client):
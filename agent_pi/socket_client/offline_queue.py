@@ -0,0 +1,140 @@
+import json, os, threading
+
+CHANGE_CAR_LOCATION = "Change Car Location"
+"""The name of the command that sets the car's location"""
+
+
+class OfflineQueue:
+    """A bounded queue of commands, kept on disk, that are waiting to be sent
+    to the Master Pi once the Agent Pi can reach it again.\n
+    Only commands that are safe to send more than once, such as setting the
+    car's location, should be queued, as a command that was sent just before
+    the connection dropped may be sent again. The queue is rewritten to a
+    temporary file that then replaces the old one, so that it isn't left half
+    written if the Agent Pi loses power.\n
+    Only the latest location of each car is kept, as an older one would be
+    replaced as soon as it was sent. Once the queue is full the oldest
+    location is dropped to make room, but returning a car is never dropped,
+    as the car would otherwise be left booked.
+
+    :param path: The file the queue is kept in
+    :type path: string
+    :param max_size: The most commands that are kept
+    :type max_size: int
+    """
+
+    def __init__(self, path, max_size=100):
+        """Constructor method
+        """
+        self.__path = path
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        self.__entries = self.__load()
+        self.__next_id = max(
+            [entry["id"] for entry in self.__entries], default=0) + 1
+
+
+    def put(self, command, message):
+        """Adds a command to the end of the queue.
+
+        :param command: The name of the command, such as "Change Car Location"
+        :type command: string
+        :param message: The details of the command
+        :type message: dict
+        """
+        with self.__lock:
+            if command == CHANGE_CAR_LOCATION:
+                # Replacing the location that was queued for the car before
+                self.__entries = [
+                    entry for entry in self.__entries
+                    if not (entry["command"] == CHANGE_CAR_LOCATION
+                            and str(entry["message"].get("car_id"))
+                                == str(message.get("car_id")))]
+            self.__entries.append({
+                "id": self.__next_id,
+                "command": command,
+                "message": message
+            })
+            self.__next_id += 1
+            self.__entries = self.__trim(self.__entries)
+            self.__save()
+
+
+    def peek(self):
+        """Returns every command in the queue, oldest first, without removing
+        them.
+
+        :return: The queued commands, each a dict of its id, command and
+            message
+        :rtype: list
+        """
+        with self.__lock:
+            return list(self.__entries)
+
+
+    def remove(self, ids):
+        """Removes commands that have been sent from the queue.
+
+        :param ids: The ids of the commands to remove
+        :type ids: list
+        """
+        ids = set(ids)
+        with self.__lock:
+            self.__entries = [entry for entry in self.__entries
+                              if entry["id"] not in ids]
+            self.__save()
+
+
+    def __len__(self):
+        """Returns the number of commands in the queue.
+
+        :return: The number of commands
+        :rtype: int
+        """
+        with self.__lock:
+            return len(self.__entries)
+
+
+    def __load(self):
+        """Reads the queue from its file, if there is one.
+
+        :return: The queued commands
+        :rtype: list
+        """
+        try:
+            with open(self.__path) as file:
+                return self.__trim(json.load(file))
+        except (OSError, ValueError):
+            return []
+
+
+    def __trim(self, entries):
+        """Drops the oldest locations while the queue is over its size,
+        keeping every return.
+
+        :param entries: The queued commands, oldest first
+        :type entries: list
+        :return: The commands that are kept
+        :rtype: list
+        """
+        excess = len(entries) - self.__max_size
+        if excess <= 0:
+            return entries
+        dropped = set()
+        for entry in entries:
+            if len(dropped) == excess:
+                break
+            if entry["command"] == CHANGE_CAR_LOCATION:
+                dropped.add(entry["id"])
+        return [entry for entry in entries if entry["id"] not in dropped]
+
+
+    def __save(self):
+        """Writes the queue to its file.
+        """
+        temporary_path = self.__path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.__entries, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.__path)
@@ -0,0 +1,312 @@
+import json, socket, struct, time
+
+HEADER = struct.Struct("!BI")
+"""The header sent before every message: its type and the length of its
+payload in bytes. This must match the Master Pi's socket_server/protocol.py"""
+MAX_PAYLOAD = 16 * 1024 * 1024
+"""The largest payload that is sent or accepted"""
+
+TEXT = 1
+"""A utf-8 string, such as an instruction or an acknowledgement"""
+JSON = 2
+"""A utf-8 JSON document"""
+IMAGE = 3
+"""An image encoded as a JPEG or PNG"""
+REQUEST = 4
+"""A command along with its request id, details and any image, see
+encode_request"""
+RESPONSE = 5
+"""The reply to a request, starting with the request's id"""
+PING = 6
+"""A heartbeat sent while idle to show that the Agent Pi is still there"""
+PONG = 7
+"""The Master Pi's reply to a heartbeat"""
+COMMAND = 8
+"""A command given by its opcode along with its request id, details and any
+image, see encode_command"""
+REGISTER = 9
+"""Sent once connected, giving the id of the car so that the Master Pi can
+push events to it"""
+EVENT = 10
+"""An event pushed by the Master Pi, such as the car's booking being
+cancelled, see decode_event"""
+ACK = 11
+"""Sent once an event has been handled, holding the event's id"""
+TELEMETRY = 12
+"""The position of the car, sent often and without a response, see
+encode_telemetry"""
+
+OPCODES = {
+    "Login": 1,
+    "Login With Face": 2,
+    "Login With Bluetooth": 3,
+    "Change Lock Status": 4,
+    "Change Car Location": 5,
+    "Add Face": 6,
+    "Add Bluetooth": 7
+}
+"""The opcode of each command by its name. This must match the Master Pi's
+socket_server/protocol.py"""
+
+REQUEST_HEADER = struct.Struct("!IHI")
+"""The start of a request's payload: its id, the length of the command's name
+and the length of its JSON details. The name, the details and then any image
+follow"""
+COMMAND_HEADER = struct.Struct("!IBI")
+"""The start of a command's payload: its request id, its opcode and the length
+of its JSON details. The details and then any image follow"""
+RESPONSE_HEADER = struct.Struct("!I")
+"""The start of a response's payload: the id of the request it answers. The
+body of the response follows"""
+REGISTER_PAYLOAD = struct.Struct("!I")
+"""The payload of a registration: the id of the car"""
+EVENT_HEADER = struct.Struct("!I")
+"""The start of an event's payload: its id. The event follows as a JSON
+document"""
+ACK_PAYLOAD = struct.Struct("!I")
+"""The payload of an acknowledgement: the id of the event that was handled"""
+TELEMETRY_PAYLOAD = struct.Struct("!IiiI")
+"""The payload of a position: the id of the car, its latitude and longitude in
+millionths of a degree and the Unix time in seconds that it was there"""
+LOCATION_SCALE = 1000000
+"""The number of units of a position's latitude and longitude in a degree"""
+
+
+class FrameError(Exception):
+    """Raised when a message doesn't follow the framing protocol"""
+
+
+def set_keepalive(sock, idle, interval, count):
+    """Turns on TCP keepalive for a socket, so that a peer that has gone away
+    without closing the connection is noticed by the operating system even
+    while nothing is being sent.
+
+    :param sock: The socket
+    :type sock: socket
+    :param idle: Seconds without any traffic before the first probe is sent
+    :type idle: int
+    :param interval: Seconds between probes
+    :type interval: int
+    :param count: The number of unanswered probes before the connection is
+        dropped
+    :type count: int
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # These options aren't available on every platform, in which case the
+    # operating system's defaults are used
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, "TCP_KEEPCNT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+
+
+def encode_request(request_id, command, message=None, image=b""):
+    """Creates the payload of a request, so that a command is sent in a single
+    message.
+
+    :param request_id: The id that the response will carry
+    :type request_id: int
+    :param command: The name of the command, such as "Login"
+    :type command: string
+    :param message: The details of the request
+    :type message: dict
+    :param image: An image encoded as a JPEG or PNG to send with the request
+    :type image: bytes
+    :return: The payload
+    :rtype: bytes
+    """
+    command = command.encode()
+    document = json.dumps(message).encode() if message is not None else b""
+    return b"".join([
+        REQUEST_HEADER.pack(request_id, len(command), len(document)),
+        command,
+        document,
+        image])
+
+
+def encode_command(request_id, opcode, message=None, image=b""):
+    """Creates the payload of a command, which is a request that names its
+    command by opcode so that the Master Pi doesn't have to look it up by name.
+
+    :param request_id: The id that the response will carry
+    :type request_id: int
+    :param opcode: The opcode of the command, see OPCODES
+    :type opcode: int
+    :param message: The details of the request
+    :type message: dict
+    :param image: An image encoded as a JPEG or PNG to send with the request
+    :type image: bytes
+    :return: The payload
+    :rtype: bytes
+    """
+    document = json.dumps(message).encode() if message is not None else b""
+    return b"".join([
+        COMMAND_HEADER.pack(request_id, opcode, len(document)),
+        document,
+        image])
+
+
+def decode_response(payload):
+    """Splits the payload of a response into the id of the request it answers
+    and its body.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload is too short
+    :return: The request id and body
+    :rtype: tuple
+    """
+    if len(payload) < RESPONSE_HEADER.size:
+        raise FrameError("Response is too short")
+    return (RESPONSE_HEADER.unpack_from(payload)[0],
+            bytes(payload[RESPONSE_HEADER.size:]))
+
+
+def encode_register(car_id):
+    """Creates the payload of a registration.
+
+    :param car_id: The id of the car that this Agent Pi corresponds to
+    :type car_id: int
+    :return: The payload
+    :rtype: bytes
+    """
+    return REGISTER_PAYLOAD.pack(int(car_id))
+
+
+def decode_event(payload):
+    """Splits the payload of an event into its id and the event.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload is too short or the event can't be
+        decoded
+    :return: The event id and the event, holding its type and details
+    :rtype: tuple
+    """
+    if len(payload) < EVENT_HEADER.size:
+        raise FrameError("Event is too short")
+    try:
+        event = json.loads(bytes(payload[EVENT_HEADER.size:]))
+    except ValueError as error:
+        raise FrameError("Event could not be decoded: {}".format(error))
+    return EVENT_HEADER.unpack_from(payload)[0], event
+
+
+def encode_ack(event_id):
+    """Creates the payload of an acknowledgement that an event has been
+    handled.
+
+    :param event_id: The id of the event
+    :type event_id: int
+    :return: The payload
+    :rtype: bytes
+    """
+    return ACK_PAYLOAD.pack(event_id)
+
+
+def encode_telemetry(car_id, latitude, longitude, timestamp=None):
+    """Creates the payload of a position, which is much smaller than a
+    command to change the car's location.
+
+    :param car_id: The id of the car that this Agent Pi corresponds to
+    :type car_id: int
+    :param latitude: The car's latitude in degrees
+    :type latitude: float
+    :param longitude: The car's longitude in degrees
+    :type longitude: float
+    :param timestamp: The Unix time that the car was there, or None for now
+    :type timestamp: float
+    :return: The payload
+    :rtype: bytes
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    return TELEMETRY_PAYLOAD.pack(
+        int(car_id),
+        round(latitude * LOCATION_SCALE),
+        round(longitude * LOCATION_SCALE),
+        int(timestamp))
+
+
+def send_frame(sock, message_type, payload):
+    """Sends a message to the Master Pi as a header followed by its payload.
+
+    :param sock: The socket connected to the Master Pi
+    :type sock: socket
+    :param message_type: The type of the message
+    :type message_type: int
+    :param payload: The message's payload
+    :type payload: bytes
+    :raises FrameError: If the payload is too large to send
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise FrameError("Payload of {} bytes is too large".format(len(payload)))
+    # Sending the header and payload together so that a small message isn't
+    # split into two packets
+    sock.sendall(HEADER.pack(message_type, len(payload)) + payload)
+
+
+def send_frames(sock, frames):
+    """Sends several messages to the Master Pi in a single call, so that a
+    batch of small messages shares packets.
+
+    :param sock: The socket connected to the Master Pi
+    :type sock: socket
+    :param frames: The message type and payload of each message
+    :type frames: list
+    :raises FrameError: If a payload is too large to send
+    """
+    data = []
+    for message_type, payload in frames:
+        if len(payload) > MAX_PAYLOAD:
+            raise FrameError("Payload of {} bytes is too large".format(
+                len(payload)))
+        data.append(HEADER.pack(message_type, len(payload)))
+        data.append(payload)
+    sock.sendall(b"".join(data))
+
+
+def recv_frame(sock, header):
+    """Receives a message from the Master Pi.\n
+    The header is received into the given buffer and the payload straight
+    into a buffer of exactly its size, however many packets they arrive in.
+
+    :param sock: The socket connected to the Master Pi
+    :type sock: socket
+    :param header: A buffer of HEADER.size bytes that is reused for every
+        message
+    :type header: bytearray
+    :raises FrameError: If the payload is too large to accept
+    :raises ConnectionError: If the Master Pi disconnects part of the way
+        through a message
+    :return: The message type and payload
+    :rtype: tuple
+    """
+    recv_exactly(sock, memoryview(header))
+    message_type, length = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise FrameError("Payload of {} bytes is too large".format(length))
+
+    payload = bytearray(length)
+    recv_exactly(sock, memoryview(payload))
+    return message_type, payload
+
+
+def recv_exactly(sock, view):
+    """Fills a buffer with bytes received from a socket.
+
+    :param sock: The socket to receive from
+    :type sock: socket
+    :param view: The buffer to fill
+    :type view: memoryview
+    :raises ConnectionError: If the socket closes before the buffer is full
+    """
+    received = 0
+    while received < len(view):
+        nbytes = sock.recv_into(view[received:])
+        if nbytes == 0:
+            raise ConnectionResetError("Master Pi disconnected")
+        received += nbytes
+
@@ -0,0 +1,34 @@
+import ssl
+
+TLS_CIPHERS = ":".join([
+    "ECDHE-ECDSA-CHACHA20-POLY1305",
+    "ECDHE-RSA-CHACHA20-POLY1305",
+    "ECDHE-ECDSA-AES128-GCM-SHA256",
+    "ECDHE-RSA-AES128-GCM-SHA256"
+])
+"""The TLS 1.2 cipher suites that are allowed, cheapest first on a Raspberry
+Pi, whose CPU has no AES instructions. Every one uses an ephemeral ECDH key
+exchange. This must match the Master Pi's socket_server/tls.py"""
+
+
+def create_client_context(cafile):
+    """Creates the TLS settings for connecting to the Master Pi.\n
+    The Master Pi's certificate is checked against the given certificate
+    rather than its host name, as the Master Pi is connected to by IP address
+    and its certificate is usually self-signed.
+
+    :param cafile: The path of the Master Pi's certificate, or of the
+        certificate authority that signed it
+    :type cafile: string
+    :return: The TLS settings
+    :rtype: ssl.SSLContext
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    # Resuming a TLS 1.2 session skips the key exchange, while resuming a
+    # TLS 1.3 one still does it and so is hardly quicker than a full handshake
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.maximum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS_CIPHERS)
+    context.check_hostname = False
+    context.load_verify_locations(cafile)
+    return context
@@ -0,0 +1,59 @@
+import json
+from socket_client.offline_queue import OfflineQueue
+
+
+class TestOfflineQueue:
+
+
+    def test_bounded(self, tmp_path):
+        """Tests that the oldest locations are dropped once the queue is full
+        """
+        queue = OfflineQueue(str(tmp_path / "queue.json"), max_size=3)
+
+        # Code to be tested
+        for i in range(5):
+            queue.put("Change Car Location", { "car_id": str(i), "location": str(i) })
+
+        entries = queue.peek()
+        assert(len(queue) == 3)
+        assert([entry["message"]["location"] for entry in entries] == ["2", "3", "4"])
+
+
+    def test_latest_location_kept(self, tmp_path):
+        """Tests that only the latest location of a car is queued and that a
+        return is never dropped, however many locations are queued after it
+        """
+        queue = OfflineQueue(str(tmp_path / "queue.json"))
+        queue.put("Change Lock Status", { "username": "test", "car_id": "1", "method": "return" })
+
+        # Code to be tested
+        for i in range(150):
+            queue.put("Change Car Location", { "car_id": "1", "location": str(i) })
+
+        entries = queue.peek()
+        assert([entry["command"] for entry in entries] ==
+            ["Change Lock Status", "Change Car Location"])
+        assert(entries[0]["message"]["method"] == "return")
+        assert(entries[1]["message"]["location"] == "149")
+
+
+    def test_persisted(self, tmp_path):
+        """Tests that queued commands are still there after the Agent Pi
+        restarts, and that removed ones aren't
+        """
+        path = str(tmp_path / "queue.json")
+        queue = OfflineQueue(path)
+        queue.put("Change Car Location", { "car_id": "1", "location": "-37.80,144.96" })
+        queue.put("Change Lock Status", { "username": "test", "car_id": "1", "method": "return" })
+        queue.remove([queue.peek()[0]["id"]])
+
+        # Code to be tested
+        queue = OfflineQueue(path)
+        queue.put("Change Car Location", { "car_id": "1", "location": "-37.81,144.96" })
+
+        entries = queue.peek()
+        assert([entry["command"] for entry in entries] ==
+            ["Change Lock Status", "Change Car Location"])
+        assert(entries[0]["id"] < entries[1]["id"])
+        with open(path) as file:
+            assert(json.load(file) == entries)
@@ -1,10 +1,69 @@
-import json, pytest, mock, pyqrcode, png, os, cv2
+import json, pytest, mock, pyqrcode, png, os, cv2, socket, threading, time
+import numpy as np
 from socket_client.client import Client
+from socket_client.offline_queue import OfflineQueue
+from socket_client.protocol import (ACK, ACK_PAYLOAD, COMMAND,
+    COMMAND_HEADER, EVENT, EVENT_HEADER, HEADER, OPCODES, PING, PONG, REGISTER,
+    REGISTER_PAYLOAD, RESPONSE_HEADER, RESPONSE, TELEMETRY, TELEMETRY_PAYLOAD,
+    recv_frame, send_frame)
+# The client raises the error from the protocol module on the path
+from protocol import FrameError
+
+
+def receive_frames(mock_connection, *frames):
+    """Makes the mocked socket receive the given messages from the Master Pi
+    """
+    receive_bytes(mock_connection, b"".join(
+        HEADER.pack(message_type, len(payload)) + payload
+        for message_type, payload in frames))
+
+
+def response_frame(request_id, body):
+    """Creates the Master Pi's response to a request
+    """
+    return (RESPONSE, RESPONSE_HEADER.pack(request_id) + json.dumps(body).encode())
+
+
+def split_request(payload):
+    """Splits a command sent to the Master Pi into the name of its command,
+    its details and its image
+    """
+    request_id, opcode, document_length = COMMAND_HEADER.unpack_from(payload)
+    command = {value: name for name, value in OPCODES.items()}[opcode]
+    start = COMMAND_HEADER.size
+    document = payload[start:start + document_length]
+    message = json.loads(document) if document else {}
+    return command, message, payload[start + document_length:]
+
+
+def receive_bytes(mock_connection, data):
+    """Makes the mocked socket receive the given bytes a few at a time and then
+    see the Master Pi disconnect
+    """
+    data = bytearray(data)
+
+    def recv_into(view):
+        nbytes = min(len(view), len(data), 3)
+        view[:nbytes] = data[:nbytes]
+        del data[:nbytes]
+        return nbytes
+    mock_connection.recv_into.side_effect = recv_into
+
+
+def tcp_pair():
+    """Creates a pair of connected TCP sockets, one for the client and one
+    standing in for the Master Pi
+    """
+    listener = socket.create_server(("127.0.0.1", 0))
+    agent = socket.create_connection(listener.getsockname())
+    master, address = listener.accept()
+    listener.close()
+    return agent, master
 
 
 @pytest.fixture
 def socket_client():
-    socket_client = Client("127.0.0.1", "1")
+    socket_client = Client("127.0.0.1", "1", reconnect=False)
     return socket_client
 
 
@@ -33,7 +92,7 @@ class TestSocketClient:
         }
         # Setting up mock object
         mock_connection.return_value = mock_connection
-        mock_connection.recv.return_value = json.dumps(server_response).encode()
+        receive_frames(mock_connection, response_frame(1, server_response))
 
         # Code to be tested
         socket_client.connect_to_server()
@@ -54,7 +113,7 @@ class TestSocketClient:
 
         # Setting up mock object
         mock_connection.return_value = mock_connection
-        mock_connection.recv.return_value = json.dumps(server_response).encode()
+        receive_frames(mock_connection, response_frame(1, server_response))
 
         # Code to be tested
         socket_client.connect_to_server()
@@ -77,6 +136,20 @@ class TestSocketClient:
         mock_connection.close.assert_called()
 
 
+    @mock.patch('socket_client.client.socket.socket')
+    def test_disconnect_never_connected(self, mock_connection):
+        # Setting up mock object so the Master Pi can't be reached
+        mock_connection.return_value.connect.side_effect = ConnectionRefusedError
+        socket_client = Client("127.0.0.1", "1", heartbeat_interval=None)
+
+        # Code to be tested
+        assert(socket_client.connect_to_server() == False)
+        socket_client.disconnect_from_server()
+
+        # Checking the client is still offline
+        assert(socket_client.is_connected() == False)
+
+
     @mock.patch('socket_client.client.socket.socket')
     def test_change_lock_status(self, mock_connection, socket_client):
         server_response = {
@@ -84,7 +157,7 @@ class TestSocketClient:
         }
         # Setting up mock object
         mock_connection.return_value = mock_connection
-        mock_connection.recv.return_value = json.dumps(server_response).encode()
+        receive_frames(mock_connection, response_frame(1, server_response))
 
         # Code to be tested
         socket_client.connect_to_server()
@@ -101,7 +174,7 @@ class TestSocketClient:
         }
         # Setting up mock object
         mock_connection.return_value = mock_connection
-        mock_connection.recv.return_value = json.dumps(server_response).encode()
+        receive_frames(mock_connection, response_frame(1, server_response))
 
         # Code to be tested
         socket_client.connect_to_server()
@@ -109,3 +182,357 @@ class TestSocketClient:
 
         # Checking values are as expected
         assert(response == server_response['message'])
+
+
+    @mock.patch('socket_client.client.socket.socket')
+    def test_login_via_face(self, mock_connection, socket_client):
+        server_response = {
+            'username': 'test',
+            'distance': 0.25
+        }
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        # Setting up mock object
+        mock_connection.return_value = mock_connection
+        receive_frames(mock_connection, response_frame(1, server_response))
+
+        # Code to be tested
+        socket_client.connect_to_server()
+        response = socket_client.login_via_face(image)
+
+        # Checking the command and compressed image were sent as one request
+        mock_connection.sendall.assert_called_once()
+        sent = mock_connection.sendall.call_args[0][0]
+        message_type, length = HEADER.unpack(sent[:HEADER.size])
+        assert(message_type == COMMAND)
+        assert(length == len(sent) - HEADER.size)
+        assert(length < image.nbytes)
+        command, message, data = split_request(sent[HEADER.size:])
+        assert(command == "Login With Face")
+        decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert(decoded.shape == image.shape)
+        assert(response == server_response)
+
+
+    def test_encode_image_resized(self):
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        socket_client = Client("127.0.0.1", "1", max_image_width=320)
+
+        # Code to be tested
+        data = socket_client.encode_image(image)
+
+        # Checking the image was scaled down keeping its aspect ratio
+        decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert(decoded.shape == (240, 320, 3))
+
+
+    def test_encode_image_png(self):
+        image = np.random.randint(0, 256, (48, 64, 3), dtype=np.uint8)
+        socket_client = Client("127.0.0.1", "1", image_format=".png")
+
+        # Code to be tested
+        data = socket_client.encode_image(image)
+
+        # Checking the image is sent without losing any detail
+        decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert((decoded == image).all())
+
+
+    @mock.patch('socket_client.client.socket.socket')
+    def test_disconnected_mid_message(self, mock_connection, socket_client):
+        # Setting up mock object so the Master Pi goes away part of the way
+        # through its response
+        mock_connection.return_value = mock_connection
+        receive_bytes(
+            mock_connection,
+            HEADER.pack(RESPONSE, 100) + RESPONSE_HEADER.pack(1) + b"{}")
+
+        # Code to be tested
+        socket_client.connect_to_server()
+        with pytest.raises(ConnectionResetError):
+            socket_client.set_location(1, "32.426998,-81.754753")
+
+
+    @mock.patch('socket_client.client.socket.socket')
+    def test_add_face(self, mock_connection, socket_client):
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        # Setting up mock object
+        mock_connection.return_value = mock_connection
+        receive_frames(
+            mock_connection, (RESPONSE, RESPONSE_HEADER.pack(1) + b"OK"))
+
+        # Code to be tested
+        socket_client.connect_to_server()
+        response = socket_client.add_face("test", image)
+
+        # Checking the username and image were sent in a single request
+        mock_connection.sendall.assert_called_once()
+        sent = mock_connection.sendall.call_args[0][0]
+        command, message, data = split_request(sent[HEADER.size:])
+        assert(command == "Add Face")
+        assert(message == { "username": "test" })
+        assert(data[:2] == b"\xff\xd8")
+        assert(response == "OK")
+
+
+    @mock.patch('socket_client.client.socket.socket')
+    def test_response_to_another_request(self, mock_connection, socket_client):
+        # Setting up mock object to answer a request that wasn't sent
+        mock_connection.return_value = mock_connection
+        receive_frames(mock_connection, response_frame(5, { 'message': 'Done' }))
+
+        # Code to be tested
+        socket_client.connect_to_server()
+        with pytest.raises(FrameError):
+            socket_client.set_location(1, "32.426998,-81.754753")
+
+
+    def test_requests_in_flight_together(self, socket_client):
+        agent, master = tcp_pair()
+        master.settimeout(5)
+        header = bytearray(HEADER.size)
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        with mock.patch('socket_client.client.socket.socket') as mock_connection:
+            mock_connection.return_value = mock.Mock(wraps=agent)
+            mock_connection.return_value.connect = mock.Mock()
+            socket_client.connect_to_server()
+
+        # Code to be tested
+        face_login = {}
+        thread = threading.Thread(target=lambda: face_login.update(
+            socket_client.login_via_face(image)))
+        thread.start()
+        try:
+            message_type, face_request = recv_frame(master, header)
+
+            # Sending a location update while the face login is still waiting
+            # and answering it first
+            location = {}
+            location_thread = threading.Thread(target=lambda: location.update(
+                message=socket_client.set_location(1, "32.426998,-81.754753")))
+            location_thread.start()
+            message_type, location_request = recv_frame(master, header)
+            send_frame(master, RESPONSE, RESPONSE_HEADER.pack(2) + json.dumps(
+                { 'message': 'Location updated' }).encode())
+            location_thread.join(timeout=5)
+
+            # Checking the location was updated before the face login finished
+            assert(location == { 'message': 'Location updated' })
+            assert(thread.is_alive())
+            assert(split_request(location_request)[0] == "Change Car Location")
+
+            send_frame(master, RESPONSE, RESPONSE_HEADER.pack(1) + json.dumps(
+                { 'username': 'test' }).encode())
+            thread.join(timeout=5)
+            assert(face_login == { 'username': 'test' })
+            assert(split_request(face_request)[0] == "Login With Face")
+        finally:
+            socket_client.disconnect_from_server()
+            master.close()
+
+
+    def test_heartbeat(self):
+        # Setting up a client that sends heartbeats often
+        socket_client = Client("127.0.0.1", "1", heartbeat_interval=0.1,
+                               reconnect=False)
+        agent, master = tcp_pair()
+        master.settimeout(5)
+        header = bytearray(HEADER.size)
+        with mock.patch('socket_client.client.socket.socket') as mock_connection:
+            mock_connection.return_value = mock.Mock(wraps=agent)
+            mock_connection.return_value.connect = mock.Mock()
+            socket_client.connect_to_server()
+
+        # Code to be tested
+        try:
+            # Checking heartbeats are sent and answers to them keep the
+            # connection open
+            for i in range(3):
+                message_type, payload = recv_frame(master, header)
+                assert(message_type == PING)
+                send_frame(master, PONG, b"")
+
+            # Checking requests are still answered between heartbeats
+            location = {}
+            thread = threading.Thread(target=lambda: location.update(
+                message=socket_client.set_location(1, "32.426998,-81.754753")))
+            thread.start()
+            message_type, payload = recv_frame(master, header)
+            while message_type == PING:
+                send_frame(master, PONG, b"")
+                message_type, payload = recv_frame(master, header)
+            send_frame(master, RESPONSE, RESPONSE_HEADER.pack(1) + json.dumps(
+                { 'message': 'Car location updated' }).encode())
+            thread.join(timeout=5)
+            assert(location == { 'message': 'Car location updated' })
+        finally:
+            socket_client.disconnect_from_server()
+            master.close()
+
+    def test_master_pi_gone_silent(self):
+        # Setting up a client that sends heartbeats often to a Master Pi that
+        # never answers
+        socket_client = Client("127.0.0.1", "1", heartbeat_interval=0.05,
+                               reconnect=False)
+        agent, master = tcp_pair()
+        with mock.patch('socket_client.client.socket.socket') as mock_connection:
+            mock_connection.return_value = mock.Mock(wraps=agent)
+            mock_connection.return_value.connect = mock.Mock()
+            socket_client.connect_to_server()
+
+        # Code to be tested
+        try:
+            with pytest.raises(ConnectionError):
+                socket_client.set_location(1, "32.426998,-81.754753")
+        finally:
+            socket_client.disconnect_from_server()
+            master.close()
+
+    @mock.patch.object(Client, '_Client__RECONNECT_DELAY', 0.05)
+    def test_queued_while_offline(self, tmp_path):
+        # Setting up a Master Pi that can't be reached yet, as its socket
+        # isn't listening
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        socket_client = Client("127.0.0.1", "1", heartbeat_interval=None,
+                               offline_queue=OfflineQueue(str(tmp_path / "queue.json")),
+                               port=listener.getsockname()[1])
+        header = bytearray(HEADER.size)
+
+        # Code to be tested
+        try:
+            assert(not socket_client.connect_to_server())
+            message = socket_client.set_location(1, "32.426998,-81.754753")
+            assert("once the Master Pi can be reached" in message)
+            socket_client.change_lock_status("test", 1, "return")
+            with pytest.raises(ConnectionError):
+                socket_client.login("test", "dummy")
+
+            # Checking the queued commands are sent once the client reconnects
+            listener.listen()
+            listener.settimeout(5)
+            master, address = listener.accept()
+            master.settimeout(5)
+            commands = []
+            for i in range(2):
+                message_type, payload = recv_frame(master, header)
+                assert(message_type == COMMAND)
+                commands.append(split_request(payload)[:2])
+                send_frame(master, *response_frame(
+                    RESPONSE_HEADER.unpack_from(payload)[0], { 'message': 'OK' }))
+            assert(commands == [
+                ('Change Car Location', { 'car_id': 1, 'location': '32.426998,-81.754753' }),
+                ('Change Lock Status', { 'username': 'test', 'car_id': 1, 'method': 'return' })
+            ])
+            for i in range(50):
+                if socket_client.is_connected():
+                    break
+                threading.Event().wait(0.05)
+            assert(socket_client.is_connected())
+            assert(len(OfflineQueue(str(tmp_path / "queue.json"))) == 0)
+        finally:
+            socket_client.disconnect_from_server()
+            listener.close()
+
+    @mock.patch.object(Client, '_Client__RECONNECT_DELAY', 0.05)
+    def test_reconnect(self):
+        # Setting up a Master Pi that drops the client's first connection
+        listener = socket.create_server(("127.0.0.1", 0))
+        listener.settimeout(5)
+        socket_client = Client("127.0.0.1", "1", heartbeat_interval=None,
+                               port=listener.getsockname()[1])
+        header = bytearray(HEADER.size)
+        assert(socket_client.connect_to_server())
+        master, address = listener.accept()
+
+        # Code to be tested
+        try:
+            master.close()
+            with pytest.raises(ConnectionError):
+                socket_client.set_location(1, "32.426998,-81.754753")
+            master, address = listener.accept()
+            master.settimeout(5)
+            for i in range(50):
+                if socket_client.is_connected():
+                    break
+                threading.Event().wait(0.05)
+
+            # Checking requests are sent over the new connection
+            location = {}
+            thread = threading.Thread(target=lambda: location.update(
+                message=socket_client.set_location(1, "32.426998,-81.754753")))
+            thread.start()
+            message_type, payload = recv_frame(master, header)
+            send_frame(master, *response_frame(
+                RESPONSE_HEADER.unpack_from(payload)[0],
+                { 'message': 'Car location updated' }))
+            thread.join(timeout=5)
+            assert(location == { 'message': 'Car location updated' })
+        finally:
+            socket_client.disconnect_from_server()
+            master.close()
+            listener.close()
+
+    def test_events(self):
+        # Setting up a client that wants the events pushed to its car
+        events = []
+        received = threading.Event()
+        def on_event(event):
+            events.append(event)
+            received.set()
+        socket_client = Client("127.0.0.1", "3", heartbeat_interval=None,
+                               reconnect=False, on_event=on_event)
+        agent, master = tcp_pair()
+        master.settimeout(5)
+        header = bytearray(HEADER.size)
+        with mock.patch('socket_client.client.socket.socket') as mock_connection:
+            mock_connection.return_value = mock.Mock(wraps=agent)
+            mock_connection.return_value.connect = mock.Mock()
+            socket_client.connect_to_server()
+
+        # Code to be tested
+        try:
+            # Checking the car registers once it has connected
+            message_type, payload = recv_frame(master, header)
+            assert(message_type == REGISTER)
+            assert(REGISTER_PAYLOAD.unpack(payload) == (3,))
+
+            # Checking an event is passed to the handler without a request
+            # having been sent, and then acknowledged
+            send_frame(master, EVENT, EVENT_HEADER.pack(4) + json.dumps(
+                { 'type': 'booking_cancelled', 'username': 'test' }).encode())
+            assert(received.wait(5))
+            assert(events == [{ 'type': 'booking_cancelled', 'username': 'test' }])
+            message_type, payload = recv_frame(master, header)
+            assert(message_type == ACK)
+            assert(ACK_PAYLOAD.unpack(payload) == (4,))
+        finally:
+            socket_client.disconnect_from_server()
+            master.close()
+
+    def test_send_position(self):
+        socket_client = Client("127.0.0.1", "3", heartbeat_interval=None,
+                               reconnect=False)
+        agent, master = tcp_pair()
+        master.settimeout(5)
+        header = bytearray(HEADER.size)
+
+        # Checking a position isn't sent while offline
+        assert(socket_client.send_position(-37.80888, 144.965179) == False)
+
+        with mock.patch('socket_client.client.socket.socket') as mock_connection:
+            mock_connection.return_value = mock.Mock(wraps=agent)
+            mock_connection.return_value.connect = mock.Mock()
+            socket_client.connect_to_server()
+
+        # Code to be tested
+        try:
+            # Checking the position is sent as fixed point without a request
+            assert(socket_client.send_position(-37.80888, 144.965179) == True)
+            message_type, payload = recv_frame(master, header)
+            car_id, latitude, longitude, timestamp = TELEMETRY_PAYLOAD.unpack(payload)
+            assert(message_type == TELEMETRY)
+            assert((car_id, latitude, longitude) == (3, -37808880, 144965179))
+            assert(abs(timestamp - time.time()) < 5)
+        finally:
+            socket_client.disconnect_from_server()
+            master.close()
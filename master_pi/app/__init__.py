@@ -4,6 +4,7 @@ import click, configparser
 from flask import Flask
 
 from app.extensions import db, ma, bcrypt
+from app.events import EVENTS_FOLDER
 from app.blueprints.api_user import user
 from app.blueprints.api_car import car
 from app.blueprints.api_booking import booking
@@ -39,6 +40,10 @@ def create_app(test_config = None):
         user_config[config_state]['DATABASE'])
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = True
 
+    # Setting where events for cars are sent to the socket server
+    app.config["CAR_EVENTS_FOLDER"] = user_config.get(
+        "SOCKET_SERVER", "EVENTS_FOLDER", fallback=EVENTS_FOLDER)
+
     db.init_app(app)
     ma.init_app(app)
     bcrypt.init_app(app)
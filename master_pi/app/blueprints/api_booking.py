@@ -4,6 +4,7 @@ from flask import Blueprint, request
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 
+from app.events import BOOKING_CANCELLED, BOOKING_STARTED, push_event
 from app.extensions import db
 from app.models.user import User, user_schema
 from app.models.car import Car, car_schema
@@ -205,6 +206,12 @@ def make_booking():
             db.session.commit()
             response['message'] = "Success"
 
+            # Letting the car know it has been booked
+            push_event(car_id, BOOKING_STARTED,
+                       booking_id=booking.id,
+                       username=username,
+                       end_time=booking.get_end_time())
+
     return response, status
 
 @booking.route('/booking', methods=['DELETE'])
@@ -247,7 +254,14 @@ def delete_booking():
         service = build('calendar', 'v3', credentials=user.google_credentials)
         service.events().delete(calendarId='primary', eventId=booking.gcal_id).execute()
 
+    # Keeping the booking's details to send to the car once it is deleted
+    car_id, username = booking.car_id, booking.username
     db.session.delete(booking)
     db.session.commit()
 
+    # Letting the car know its booking has been cancelled
+    push_event(car_id, BOOKING_CANCELLED,
+               booking_id=int(id),
+               username=username)
+
     return response, 200
@@ -1,14 +1,19 @@
+from collections import Counter
 from flask import Blueprint, request
-from datetime import datetime
 
+from app.events import REMOTE_LOCK, REMOTE_UNLOCK, push_event_to_cars
 from app.extensions import db
 from app.models.user import User, Role
 from app.models.car import Car, car_schema
-from app.models.booking import Booking
-from app.forms import EditCarFormSchema
+from app.services import car as car_service
+from app.forms import EditCarFormSchema, LockCarsFormSchema
 
 car = Blueprint("car", __name__, url_prefix='/api')
 
+LOCK_TIMEOUT = 5
+"""The seconds that cars are given to acknowledge being locked or unlocked by
+an admin, unless the request gives a timeout"""
+
 @car.route('/car', methods=["POST"])
 def new_car():
     """Registers a new car if the user making the request is an admin
@@ -361,6 +366,166 @@ def get_cars():
     return response, 200
 
 
+@car.route('/cars/lock', methods=["POST"])
+def lock_cars():
+    """Locks or unlocks a group of cars, chosen by their ids or by the area
+    they are in, only if the user making the request is an admin. Every car is
+    told over its connection to the socket server at the same time, and the
+    response says which of them acknowledged it before the timeout. Cars that
+    aren't connected are still locked or unlocked in the database
+
+    .. :quickref: Car; Lock or unlock a group of cars.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        POST /api/cars/lock HTTP/1.1
+        Host: localhost
+        Accept: application/json
+        Content-Type: application/json
+
+        {
+            "username": "admin",
+            "lock": true,
+            "region": {
+                "min_latitude": -37.82,
+                "min_longitude": 144.95,
+                "max_latitude": -37.80,
+                "max_longitude": 144.97
+            },
+            "timeout": 5
+        }
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+
+        {
+            "message": "Success",
+            "cars": {
+                "1": "acknowledged",
+                "2": "not_connected"
+            },
+            "summary": {
+                "cars": 2,
+                "acknowledged": 1,
+                "not_connected": 1
+            }
+        }
+
+    .. sourcecode:: http
+
+        HTTP/1.1 401 UNAUTHORIZED
+        Content-Type: application/json
+
+        {
+            "message": {
+                "user": ["User is not an admin."]
+            }
+        }
+
+    :<json string username: the username of the person locking the cars
+    :<json boolean lock: true to lock the cars or false to unlock them
+    :<json list car_ids: the ids of the cars, if they aren't chosen by region
+    :<json object region: the smallest and largest latitude and longitude of
+        the area the cars are in, if they aren't chosen by id
+    :<json float timeout: the most seconds to wait for the cars to acknowledge
+        it, 5 if not given
+    :>json message: repsonse information such as error information
+    :>json object cars: for each car, "acknowledged", "no_ack" if it didn't
+        answer in time, "disconnected" if it disconnected first or
+        "not_connected" if it isn't connected
+    :>json object summary: the number of cars and the number with each result
+    :>json list not_found: the ids given that aren't cars
+    :resheader Content-Type: application/json
+    :status 200: the cars were locked or unlocked
+    :status 400: missing or invalid fields
+    :status 401: user is not an admin
+    :status 404: user does not exist
+    """
+
+    response = {
+        'message': '',
+    }
+    status = 200
+
+    form_schema = LockCarsFormSchema()
+    form_errors = form_schema.validate(request.json)
+    if form_errors:
+        response['message'] = form_errors
+        status = 400
+    else:
+        # Checking if user making the request is an admin
+        user = User.query.get(request.json["username"])
+        if user is None:
+            response['message'] = {
+                'user': ['User does not exist.']
+            }
+            status = 404
+        elif user.role is not Role.admin:
+            response['message'] = {
+                'user': ['User is not an admin.']
+            }
+            status = 401
+        else:
+            lock = request.json["lock"]
+            if "car_ids" in request.json:
+                car_ids = [id for (id,) in (db.session.query(Car.id)
+                    .filter(Car.id.in_(request.json["car_ids"]))
+                    .all())]
+                response['not_found'] = sorted(
+                    set(request.json["car_ids"]) - set(car_ids))
+            else:
+                region = request.json["region"]
+                car_ids = [id for (id, location)
+                           in db.session.query(Car.id, Car.location).all()
+                           if in_region(location, region)]
+
+            # Changing every car in a single update
+            (Car.query
+                .filter(Car.id.in_(car_ids))
+                .update({ Car.is_locked: lock }, synchronize_session=False))
+            db.session.commit()
+
+            # Telling the cars and waiting for them to acknowledge it
+            results = push_event_to_cars(
+                car_ids,
+                REMOTE_LOCK if lock else REMOTE_UNLOCK,
+                request.json.get("timeout", LOCK_TIMEOUT))
+            response['message'] = "Success"
+            response['cars'] = {
+                str(car_id): result for car_id, result in results.items()
+            }
+            response['summary'] = dict(Counter(results.values()),
+                                       cars=len(results))
+
+    return response, status
+
+
+def in_region(location, region):
+    """Checks whether a car's location is inside an area
+
+    :param location: The car's latitude and longitude, such as
+        "-37.808880,144.965179", or None if it isn't known
+    :type location: string
+    :param region: The smallest and largest latitude and longitude of the area
+    :type region: dict
+    :return: Whether the car is inside the area
+    :rtype: boolean
+    """
+
+    try:
+        latitude, longitude = (float(value) for value in location.split(","))
+    except (AttributeError, ValueError):
+        return False
+    return (region["min_latitude"] <= latitude <= region["max_latitude"]
+            and region["min_longitude"] <= longitude <= region["max_longitude"])
+
+
 @car.route('/return', methods=["POST"])
 def return_car():
     """Return a car by changing the locked status of a car that has been unlocked
@@ -410,41 +575,7 @@ def return_car():
     :status 409: car is already returned
     """
 
-    response = {
-        'message': ''
-    }
-    status = 200
-
-    username = request.json["username"]
-    car_id = request.json["car_id"]
-    car = Car.query.get(car_id)
-
-    # Getting the most recent booking for this car
-    booking = (Booking.query
-               .filter_by(car_id=car_id)
-               .order_by(Booking.book_time.desc())
-               .first())
-
-    if (booking is not None):
-        # Checking if the user requesting to return the car is the last person
-        # to ride in it
-        if booking.username == username:
-            # Checking if already locked
-            if car.is_locked:
-                response['message'] = "ERROR: The car has already been returned"
-                status = 409
-            else:
-                car.is_locked = True
-                db.session.commit()
-                response['message'] = "Car has been returned"
-        else:
-            response['message'] = "ERROR: You have not booked this car"
-            status = 403
-    else:
-        response['message'] = "ERROR: You have not booked this car"
-        status = 403
-
-    return response, status
+    return car_service.return_car(request.json)
 
 
 @car.route('/unlock', methods=["POST"])
@@ -496,42 +627,7 @@ def unlock_car():
     :status 409: car is already unlocked
     """
 
-    response = {
-        'message': ''
-    }
-    status = 200
-
-    username = request.json["username"]
-    car_id = request.json["car_id"]
-    car = Car.query.get(car_id)
-
-    # Getting the most recent booking for this car
-    booking = (Booking.query
-               .filter_by(car_id=car_id)
-               .order_by(Booking.book_time.desc())
-               .first())
-
-    if booking is not None:
-        # Checking if the user requesting to unlock the car is currently booked
-        # to ride in it.
-        current_time = datetime.utcnow()
-        if (booking.username == username) and (current_time < booking.get_end_time()):
-            # Checking if the car is already unlocked
-            if car.is_locked:
-                car.is_locked = False
-                db.session.commit()
-                response['message'] = "Car has been unlocked"
-            else:
-                response['message'] = "ERROR: The car is already unlocked"
-                status = 409
-        else:
-            response['message'] = "ERROR: You have not booked this car"
-            status = 403
-    else:
-        response['message'] = "ERROR: You have not booked this car"
-        status = 403
-
-    return response, status
+    return car_service.unlock_car(request.json)
 
 
 @car.route('/setlocation', methods=["POST"])
@@ -573,22 +669,54 @@ def change_car_location():
     :status 404: the car does not exist
     """
 
-    response = {
-        'message': ''
-    }
-    status = 200
+    return car_service.change_car_location(request.json)
 
-    car_id = request.json["car_id"]
-    location = request.json["location"]
-    car = Car.query.get(car_id)
 
-    # Check location is valid
-    if car is not None:
-        car.location = location
-        db.session.commit()
-        response['message'] = "Car location updated"
-    else:
-        response['message'] = "ERROR: Car does not exist"
-        status = 404
+@car.route('/setlocations', methods=["POST"])
+def change_car_locations():
+    """Set the locations of many cars at once in a single batched update, used
+    by the socket server to save the positions that cars stream to it
 
-    return response, status
+    .. :quickref: Car; Change the locations of many cars.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        POST /api/setlocations HTTP/1.1
+        Host: localhost
+        Accept: application/json
+        Content-Type: application/json
+
+        {
+            "locations": [
+                {
+                    "car_id": 1,
+                    "location": "-37.808880,144.965179"
+                },
+                {
+                    "car_id": 2,
+                    "location": "-37.810219,144.961395"
+                }
+            ]
+        }
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+
+        {
+            "message": "Car locations updated"
+        }
+
+    :<json list locations: the id and the latitude and longitude of each car,
+        where cars that don't exist are skipped
+    :>json message: response information such as error information
+    :resheader Content-Type: application/json
+    :status 200: updating the locations was successful
+    """
+
+    return car_service.change_car_locations(request.json)
@@ -2,6 +2,7 @@ from flask import Blueprint, request
 from datetime import datetime
 import requests, json
 
+from app.events import ISSUE_REPORTED, push_event
 from app.extensions import db
 from app.models.user import User, Role
 from app.models.car import Car
@@ -92,6 +93,11 @@ def new_issue():
             db.session.commit()
             response['message'] = "Success"
 
+            # Letting the car know an issue has been reported with it
+            push_event(car_id, ISSUE_REPORTED,
+                       issue_id=issue.id,
+                       details=details)
+
     if response['message'] == "Success":
         # Notifying every engineer via Pushbullet if they have a token
         engineers = (User.query
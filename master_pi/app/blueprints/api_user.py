@@ -5,8 +5,8 @@ from googleapiclient.discovery import build
 from app.extensions import db, bcrypt
 from app.models.user import User, Role, user_schema, verbose_user_schema
 from app.models.booking import Booking, booking_schema
+from app.services import user as user_service
 from app.forms import (
-    LoginFormSchema,
     RegisterFormSchema,
     UpdateUserFormSchema,
     AuthenticationFormSchema,
@@ -71,42 +71,7 @@ def login():
     :status 404: user does not exist
     """
 
-    response = {
-        'message': '',
-        'user': None
-    }
-    status = 200
-
-    form_schema = LoginFormSchema()
-    form_errors = form_schema.validate(request.json)
-    if form_errors:
-        response['message'] = form_errors
-        status = 400
-    else:
-        username = request.json["username"]
-        password = request.json["password"]
-
-        # Checking if user is in database
-        user = User.query.get(username)
-        if user is None:
-            response['message'] = {
-                'user': ['User does not exist.']
-            }
-            status = 404
-        else:
-            # Checking wether passwords match
-            passwords_match = bcrypt.check_password_hash(user.password, password)
-            if passwords_match:
-                response['message'] = "Logged in successfully"
-                response['user'] = user_schema.dump(user)
-                status = 200
-            else:
-                response['message'] = {
-                    'user': ['Incorrect password.']
-                }
-                status = 401
-
-    return response, status
+    return user_service.login(request.json)
 
 
 @user.route('/login-bluetooth', methods = ["POST"])
@@ -160,25 +125,7 @@ def login_bluetooth():
     :status 401: invalid mac address
     """
 
-    response = {
-        'message': '',
-        'user': None
-    }
-    status = 200
-
-    mac_address = request.json["mac_address"]
-    # Getting the user that corresponds to this MAC address
-    user = User.query.filter_by(mac_address=mac_address).first()
-
-    if user is None:
-        response['message'] = "ERROR: Bluetooth device is not registered to a user"
-        status = 401
-    else:
-        response['message'] = "Logged in successfully"
-        response['user'] = user_schema.dump(user)
-        status = 200
-
-    return response, status
+    return user_service.login_bluetooth(request.json)
 
 
 @user.route('/user', methods=["POST"])
@@ -334,24 +281,7 @@ def register_bluetooth():
     :status 404: invalid user
     """
 
-    response = {
-        'message': ''
-    }
-    status = 200
-
-    username = request.json["username"]
-    mac_address = request.json["mac_address"]
-    user = User.query.get(username)
-
-    if user is not None:
-        user.mac_address = mac_address
-        db.session.commit()
-        response['message'] = "User MAC Address updated"
-    else:
-        response['message'] = "ERROR: User does not exist"
-        status = 404
-
-    return response, status
+    return user_service.register_bluetooth(request.json)
 
 
 @user.route('/user', methods=["GET"])
@@ -0,0 +1,171 @@
+"""Pushes events, such as a booking being cancelled, to the Agent Pis of the
+cars they are about.\n
+Each event is sent to the socket server, which pushes it to the car over the
+car's connection, so the car finds out straight away instead of having to
+ask. The socket server's processes each listen on a Unix datagram socket in
+the folder set by EVENTS_FOLDER in the [SOCKET_SERVER] section of config.ini,
+see socket_server/event_bus.py, and every event is sent to all of them as the
+Flask app doesn't know which one the car is connected to.
+"""
+import json, os, socket, tempfile, time, uuid
+
+from flask import current_app
+
+EVENTS_FOLDER = os.path.join(tempfile.gettempdir(), "rmit-rideshare-events")
+"""The folder that the socket server listens for events in by default. This
+must match socket_server/event_bus.py"""
+
+BOOKING_STARTED = "booking_started"
+"""The type of event sent when a car is booked"""
+BOOKING_CANCELLED = "booking_cancelled"
+"""The type of event sent when a car's booking is cancelled"""
+REMOTE_LOCK = "remote_lock"
+"""The type of event sent when a car is locked by an admin"""
+REMOTE_UNLOCK = "remote_unlock"
+"""The type of event sent when a car is unlocked by an admin"""
+ISSUE_REPORTED = "issue_reported"
+"""The type of event sent when an issue is reported with a car"""
+
+ACKNOWLEDGED = "acknowledged"
+"""The result for a car that acknowledged an event it was pushed"""
+NO_ACK = "no_ack"
+"""The result for a car that didn't acknowledge an event in time"""
+DISCONNECTED = "disconnected"
+"""The result for a car whose connection was lost before it acknowledged an
+event"""
+NOT_CONNECTED = "not_connected"
+"""The result for a car that isn't connected to the socket server"""
+REPLY_GRACE = 1
+"""The seconds waited past the timeout for the socket server to answer"""
+MAX_REPLY = 1024 * 1024
+"""The largest answer from the socket server that is read"""
+
+
+def push_event(car_id, event_type, **details):
+    """Sends an event to the socket server to push to a car's Agent Pi.\n
+    This doesn't wait for the event to reach the car. An event that can't be
+    sent, such as when the socket server isn't running, is only logged so that
+    the request that caused it still succeeds.
+
+    :param car_id: The id of the car
+    :type car_id: int
+    :param event_type: The type of event, such as BOOKING_CANCELLED
+    :type event_type: string
+    :param details: The details of the event, which must be JSON serialisable
+        apart from dates and times, which are sent as strings
+    :return: The number of socket server processes the event was sent to
+    :rtype: int
+    """
+    datagram = json.dumps({
+        "car_id": int(car_id),
+        "event": dict(details, type=event_type)
+    }, default=str).encode()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        return _send_to_servers(sock, datagram, event_type)
+
+
+def push_event_to_cars(car_ids, event_type, timeout, **details):
+    """Sends an event to the socket server to push to several cars at once,
+    and waits for each car to acknowledge it, such as when an admin locks a
+    group of cars.\n
+    Every socket server process pushes the event to the cars that are
+    connected to it at the same time, and sends back whether each one
+    acknowledged it before the timeout. This returns once every process has
+    answered, or shortly after the timeout if one hasn't.
+
+    :param car_ids: The ids of the cars
+    :type car_ids: list
+    :param event_type: The type of event, such as REMOTE_LOCK
+    :type event_type: string
+    :param timeout: The most seconds to wait for the cars to acknowledge the
+        event
+    :type timeout: float
+    :param details: The details of the event, which must be JSON serialisable
+        apart from dates and times, which are sent as strings
+    :return: For the id of each car, ACKNOWLEDGED, NO_ACK if it didn't
+        acknowledge the event in time, DISCONNECTED if its connection was lost
+        first or NOT_CONNECTED if it isn't connected to the socket server
+    :rtype: dict
+    """
+    results = {int(car_id): NOT_CONNECTED for car_id in car_ids}
+    datagram = json.dumps({
+        "car_ids": list(results),
+        "event": dict(details, type=event_type),
+        "timeout": timeout
+    }, default=str).encode()
+
+    folder = current_app.config.get("CAR_EVENTS_FOLDER", EVENTS_FOLDER)
+    # Binding a socket of its own for the socket server to answer to
+    reply_path = os.path.join(folder, "{}.reply".format(uuid.uuid4().hex))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.bind(reply_path)
+        except FileNotFoundError:
+            current_app.logger.warning(
+                "Socket server isn't running, {} not sent to {} cars".format(
+                    event_type, len(results)))
+            return results
+
+        try:
+            servers = _send_to_servers(sock, datagram, event_type)
+            deadline = time.monotonic() + timeout + REPLY_GRACE
+            while servers > 0:
+                # Reading the clock once, as it may pass the deadline between
+                # a check and setting the timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    reply = json.loads(sock.recv(MAX_REPLY))
+                except socket.timeout:
+                    break
+                servers -= 1
+                for car_id, result in reply["results"].items():
+                    results[int(car_id)] = result
+        finally:
+            os.unlink(reply_path)
+    return results
+
+
+def _send_to_servers(sock, datagram, event_type):
+    """Sends an event to every socket server process.
+
+    :param sock: The socket to send from
+    :type sock: socket
+    :param datagram: The event, as a JSON document
+    :type datagram: bytes
+    :param event_type: The type of event, which is logged if it can't be sent
+    :type event_type: string
+    :return: The number of socket server processes the event was sent to
+    :rtype: int
+    """
+    folder = current_app.config.get("CAR_EVENTS_FOLDER", EVENTS_FOLDER)
+    try:
+        names = [name for name in os.listdir(folder) if name.endswith(".sock")]
+    except FileNotFoundError:
+        names = []
+    if not names:
+        current_app.logger.warning(
+            "Socket server isn't running, {} not sent".format(event_type))
+        return 0
+
+    sent = 0
+    # Not waiting on a socket server process that is too busy to read
+    sock.setblocking(False)
+    for name in names:
+        path = os.path.join(folder, name)
+        try:
+            sock.sendto(datagram, path)
+            sent += 1
+        except ConnectionRefusedError:
+            # Left behind by a socket server process that has exited
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        except OSError as error:
+            current_app.logger.warning("{} not sent through {}: {}".format(
+                event_type, path, error))
+    return sent
@@ -199,3 +199,28 @@ class ReportIssueFormSchema(Schema):
     def validate_details(self, value):
         if value == "":
             raise ValidationError("Missing details.")
+
+
+class RegionSchema(Schema):
+    min_latitude = fields.Float(required=True)
+    min_longitude = fields.Float(required=True)
+    max_latitude = fields.Float(required=True)
+    max_longitude = fields.Float(required=True)
+
+
+class LockCarsFormSchema(Schema):
+    username = fields.Str(required=True)
+    lock = fields.Bool(required=True)
+    car_ids = fields.List(fields.Int(), required=False)
+    region = fields.Nested(RegionSchema, required=False)
+    timeout = fields.Float(required=False)
+
+    @validates('timeout')
+    def validate_timeout(self, value):
+        if value <= 0 or value > 30:
+            raise ValidationError("Timeout must be between 0 and 30 seconds.")
+
+    @validates_schema
+    def validate_cars(self, data, **kwargs):
+        if ("car_ids" in data) == ("region" in data):
+            raise ValidationError("Either car ids or a region must be given.")
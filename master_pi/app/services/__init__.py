@@ -0,0 +1,7 @@
+"""The logic behind the API endpoints that Agent Pis use.\n
+Both the Flask blueprints and the TCP socket server call these functions, so
+that the socket server can run a car's command in the same process under an
+app context instead of sending it to the API over HTTP. Each function takes the
+request's JSON body as a dictionary and returns the response body and its
+status code.
+"""
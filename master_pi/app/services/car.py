@@ -0,0 +1,163 @@
+from datetime import datetime
+from sqlalchemy import bindparam
+
+from app.extensions import db
+from app.models.car import Car
+from app.models.booking import Booking
+
+
+def return_car(data):
+    """Returns a car by locking it, if the user was the last to book it
+
+    :param data: The username and the car's id
+    :type data: dict
+    :return: The response body and the status code
+    :rtype: tuple
+    """
+
+    response = {
+        'message': ''
+    }
+    status = 200
+
+    username = data["username"]
+    car_id = data["car_id"]
+    car = Car.query.get(car_id)
+
+    # Getting the most recent booking for this car
+    booking = (Booking.query
+               .filter_by(car_id=car_id)
+               .order_by(Booking.book_time.desc())
+               .first())
+
+    if (booking is not None):
+        # Checking if the user requesting to return the car is the last person
+        # to ride in it
+        if booking.username == username:
+            # Checking if already locked
+            if car.is_locked:
+                response['message'] = "ERROR: The car has already been returned"
+                status = 409
+            else:
+                car.is_locked = True
+                db.session.commit()
+                response['message'] = "Car has been returned"
+        else:
+            response['message'] = "ERROR: You have not booked this car"
+            status = 403
+    else:
+        response['message'] = "ERROR: You have not booked this car"
+        status = 403
+
+    return response, status
+
+
+def unlock_car(data):
+    """Unlocks a car, if the user is currently booked to ride in it
+
+    :param data: The username and the car's id
+    :type data: dict
+    :return: The response body and the status code
+    :rtype: tuple
+    """
+
+    response = {
+        'message': ''
+    }
+    status = 200
+
+    username = data["username"]
+    car_id = data["car_id"]
+    car = Car.query.get(car_id)
+
+    # Getting the most recent booking for this car
+    booking = (Booking.query
+               .filter_by(car_id=car_id)
+               .order_by(Booking.book_time.desc())
+               .first())
+
+    if booking is not None:
+        # Checking if the user requesting to unlock the car is currently booked
+        # to ride in it.
+        current_time = datetime.utcnow()
+        if (booking.username == username) and (current_time < booking.get_end_time()):
+            # Checking if the car is already unlocked
+            if car.is_locked:
+                car.is_locked = False
+                db.session.commit()
+                response['message'] = "Car has been unlocked"
+            else:
+                response['message'] = "ERROR: The car is already unlocked"
+                status = 409
+        else:
+            response['message'] = "ERROR: You have not booked this car"
+            status = 403
+    else:
+        response['message'] = "ERROR: You have not booked this car"
+        status = 403
+
+    return response, status
+
+
+def change_car_location(data):
+    """Sets a car's location
+
+    :param data: The car's id and its latitude and longitude
+    :type data: dict
+    :return: The response body and the status code
+    :rtype: tuple
+    """
+
+    response = {
+        'message': ''
+    }
+    status = 200
+
+    car_id = data["car_id"]
+    location = data["location"]
+    car = Car.query.get(car_id)
+
+    # Check location is valid
+    if car is not None:
+        car.location = location
+        db.session.commit()
+        response['message'] = "Car location updated"
+    else:
+        response['message'] = "ERROR: Car does not exist"
+        status = 404
+
+    return response, status
+
+
+def change_car_locations(data):
+    """Sets the locations of many cars at once, such as the latest positions
+    that the socket server has collected from the cars since it last saved
+    them. Every car is changed in a single batched update, and cars that
+    don't exist are skipped
+
+    :param data: The id and the latitude and longitude of each car
+    :type data: dict
+    :return: The response body and the status code
+    :rtype: tuple
+    """
+
+    response = {
+        'message': ''
+    }
+    status = 200
+
+    rows = [
+        { 'car_id': int(row['car_id']), 'new_location': row['location'] }
+        for row in data['locations']
+    ]
+    if rows:
+        table = Car.__table__
+        db.session.execute(
+            table.update()
+                .where(table.c.id == bindparam('car_id'))
+                .values(location=bindparam('new_location')),
+            rows)
+        db.session.commit()
+    response['message'] = "Car locations updated"
+
+    return response, status
@@ -0,0 +1,109 @@
+from app.extensions import db, bcrypt
+from app.models.user import User, user_schema
+from app.forms import LoginFormSchema
+
+
+def login(data):
+    """Checks a user's credentials in order to log in to their account
+
+    :param data: The username and password
+    :type data: dict
+    :return: The response body and the status code
+    :rtype: tuple
+    """
+
+    response = {
+        'message': '',
+        'user': None
+    }
+    status = 200
+
+    form_schema = LoginFormSchema()
+    form_errors = form_schema.validate(data)
+    if form_errors:
+        response['message'] = form_errors
+        status = 400
+    else:
+        username = data["username"]
+        password = data["password"]
+
+        # Checking if user is in database
+        user = User.query.get(username)
+        if user is None:
+            response['message'] = {
+                'user': ['User does not exist.']
+            }
+            status = 404
+        else:
+            # Checking wether passwords match
+            passwords_match = bcrypt.check_password_hash(user.password, password)
+            if passwords_match:
+                response['message'] = "Logged in successfully"
+                response['user'] = user_schema.dump(user)
+                status = 200
+            else:
+                response['message'] = {
+                    'user': ['Incorrect password.']
+                }
+                status = 401
+
+    return response, status
+
+
+def login_bluetooth(data):
+    """Logs in the user that a Bluetooth device's MAC address is registered to
+
+    :param data: The MAC address
+    :type data: dict
+    :return: The response body and the status code
+    :rtype: tuple
+    """
+
+    response = {
+        'message': '',
+        'user': None
+    }
+    status = 200
+
+    mac_address = data["mac_address"]
+    # Getting the user that corresponds to this MAC address
+    user = User.query.filter_by(mac_address=mac_address).first()
+
+    if user is None:
+        response['message'] = "ERROR: Bluetooth device is not registered to a user"
+        status = 401
+    else:
+        response['message'] = "Logged in successfully"
+        response['user'] = user_schema.dump(user)
+        status = 200
+
+    return response, status
+
+
+def register_bluetooth(data):
+    """Updates a user's Bluetooth MAC address
+
+    :param data: The username and MAC address
+    :type data: dict
+    :return: The response body and the status code
+    :rtype: tuple
+    """
+
+    response = {
+        'message': ''
+    }
+    status = 200
+
+    username = data["username"]
+    mac_address = data["mac_address"]
+    user = User.query.get(username)
+
+    if user is not None:
+        user.mac_address = mac_address
+        db.session.commit()
+        response['message'] = "User MAC Address updated"
+    else:
+        response['message'] = "ERROR: User does not exist"
+        status = 404
+
+    return response, status
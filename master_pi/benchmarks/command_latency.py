@@ -0,0 +1,81 @@
+"""Compares the latency of running a car's commands through the Flask API over
+HTTP with running them through the Flask app's services in the same process,
+as the socket server does by default.
+
+The same location update is run the given number of times each way, one after
+another, and the latency of each is printed.
+
+Start the Flask API against a populated database, then run from the /master_pi
+folder:
+    $ python benchmarks/command_latency.py --car-id 1 --commands 500
+"""
+import argparse, json, statistics, sys, time
+
+sys.path.append('.')
+sys.path.append('./socket_server/')
+from services import HttpServices, LocalServices
+
+
+def measure(services, car_id, commands):
+    """Runs a number of location updates and times each one.
+
+    :return: The latency of each command in seconds
+    :rtype: list
+    """
+    latencies = []
+    for i in range(commands):
+        message = {
+            "car_id": car_id,
+            "location": "-37.80{:04d},144.96".format(i)
+        }
+        start_time = time.perf_counter()
+        response = json.loads(services.change_car_location(message))
+        latencies.append(time.perf_counter() - start_time)
+        if response["message"] != "Car location updated":
+            raise RuntimeError(response["message"])
+    return sorted(latencies)
+
+
+def main():
+    args = parse_arguments()
+
+    for name, services in [("http", HttpServices(args.api_url)),
+                           ("in-process", LocalServices())]:
+        services.open()
+        # Warming up connections and caches before timing
+        measure(services, args.car_id, 10)
+        latencies = measure(services, args.car_id, args.commands)
+        services.close()
+
+        print("{:>10}: mean {:.2f} ms, median {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms".format(
+            name,
+            statistics.mean(latencies) * 1000,
+            statistics.median(latencies) * 1000,
+            latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+            latencies[-1] * 1000))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Compare command latency over HTTP with calling the services in-process')
+    parser.add_argument(
+        '--api-url',
+        type=str,
+        default='http://localhost:5000/api/',
+        help='The URL of the running Flask API')
+    parser.add_argument(
+        '--car-id',
+        type=int,
+        default=1,
+        help='The car whose location is updated')
+    parser.add_argument(
+        '--commands',
+        type=int,
+        default=500,
+        help='The number of commands to time each way')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
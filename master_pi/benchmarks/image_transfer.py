@@ -0,0 +1,155 @@
+"""Compares sending login images to the Master Pi as pickled raw pixels with
+sending them compressed as JPEG or PNG.
+
+For each way of sending an image the mean number of bytes sent, the time taken
+to encode it on the Agent Pi and decode it on the Master Pi, and the time taken
+to send it over a link of the given bandwidth are printed, along with the total
+latency. The bytes are also sent over a local socket to include the time spent
+copying them through the network stack.
+
+Run from the /master_pi folder:
+    $ python benchmarks/image_transfer.py <image_folder> --bandwidth 10
+"""
+import argparse, cv2, pickle, socket, sys, threading, time
+from imutils import paths
+
+sys.path.append('./socket_server/')
+from image_codec import decode_image
+from protocol import HEADER, IMAGE
+
+
+def main():
+    args = parse_arguments()
+    images = [cv2.imread(path) for path in paths.list_images(args.image_folder)]
+    images = [image for image in images if image is not None]
+    print("{} images, {} Mbit/s link".format(len(images), args.bandwidth))
+    print("{:>16} {:>10} {:>11} {:>11} {:>11} {:>11} {:>11}".format(
+        "method", "KiB", "encode ms", "decode ms", "link ms", "socket ms",
+        "total ms"))
+
+    methods = [("pickle", pickle.dumps, pickle.loads)]
+    for quality in args.qualities:
+        methods.append(("jpeg q{}".format(quality),
+                        jpeg_encoder(quality, None), decode_image))
+    methods.append(("png", png_encoder(None), decode_image))
+    if args.max_width:
+        for quality in args.qualities:
+            methods.append(("jpeg q{} w{}".format(quality, args.max_width),
+                            jpeg_encoder(quality, args.max_width), decode_image))
+
+    for name, encode, decode in methods:
+        sizes, encode_times, decode_times, socket_times = [], [], [], []
+        for image in images:
+            start_time = time.perf_counter()
+            data = encode(image)
+            encode_times.append(time.perf_counter() - start_time)
+            sizes.append(len(data))
+
+            socket_times.append(send_over_socket(data))
+
+            start_time = time.perf_counter()
+            decode(data)
+            decode_times.append(time.perf_counter() - start_time)
+
+        size = mean(sizes)
+        link_time = size * 8 / (args.bandwidth * 1000 * 1000)
+        total = mean(encode_times) + link_time + mean(decode_times)
+        print("{:>16} {:>10.1f} {:>11.2f} {:>11.2f} {:>11.1f} {:>11.2f} {:>11.1f}".format(
+            name,
+            size / 1024,
+            mean(encode_times) * 1000,
+            mean(decode_times) * 1000,
+            link_time * 1000,
+            mean(socket_times) * 1000,
+            total * 1000))
+
+
+def jpeg_encoder(quality, max_width):
+    """Returns a function that encodes an image as a JPEG the way the Agent Pi
+    does.
+    """
+    def encode(image):
+        success, data = cv2.imencode(
+            ".jpg", resize(image, max_width), [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return data.tobytes()
+    return encode
+
+
+def png_encoder(max_width):
+    """Returns a function that encodes an image as a PNG the way the Agent Pi
+    does.
+    """
+    def encode(image):
+        success, data = cv2.imencode(".png", resize(image, max_width))
+        return data.tobytes()
+    return encode
+
+
+def resize(image, max_width):
+    height, width = image.shape[:2]
+    if max_width is None or width <= max_width:
+        return image
+    return cv2.resize(image, (max_width, round(height * max_width / width)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def send_over_socket(data):
+    """Sends one framed message over a local socket and times how long it takes
+    for all of it to be received.
+    """
+    sender, receiver = socket.socketpair()
+    payload = bytearray(len(data))
+
+    def receive():
+        header = bytearray(HEADER.size)
+        receiver.recv_into(header, HEADER.size, socket.MSG_WAITALL)
+        view = memoryview(payload)
+        received = 0
+        while received < len(payload):
+            received += receiver.recv_into(view[received:])
+
+    start_time = time.perf_counter()
+    thread = threading.Thread(target=receive)
+    thread.start()
+    sender.sendall(HEADER.pack(IMAGE, len(data)) + data)
+    thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    sender.close()
+    receiver.close()
+    return elapsed
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark sending images as pickles, JPEGs and PNGs')
+    parser.add_argument(
+        'image_folder',
+        type=str,
+        help='A folder of images of faces, such as the dataset')
+    parser.add_argument(
+        '--bandwidth',
+        type=float,
+        default=10,
+        help='The bandwidth of the link between the car and the Master Pi in Mbit/s')
+    parser.add_argument(
+        '--qualities',
+        type=int,
+        nargs='+',
+        default=[70, 90],
+        help='The JPEG qualities to try')
+    parser.add_argument(
+        '--max-width',
+        type=int,
+        default=640,
+        help='Also try JPEGs scaled down to this width, or 0 to skip')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
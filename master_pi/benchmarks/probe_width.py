@@ -0,0 +1,61 @@
+"""Measures how the width that login images are scaled down to for face
+detection affects login latency and accuracy.
+
+The probe images are laid out like the dataset, with each user's images in a
+folder named after their username. Each image is matched against the current
+encodings at every width and the mean latency and the share of images matched
+to the right user are printed.
+
+Run from the /master_pi folder:
+    $ python benchmarks/probe_width.py <probe_folder> --widths 160 240 320 480
+"""
+import argparse, cv2, logging, os, sys, time
+from imutils import paths
+
+sys.path.append('./socket_server/')
+from face_recognition_util import FaceRecognitionUtil
+
+
+def main():
+    args = parse_arguments()
+    probes = [(path.split(os.path.sep)[-2], cv2.imread(path))
+              for path in paths.list_images(args.probe_folder)]
+    print("{} probe images".format(len(probes)))
+    print("{:>8} {:>14} {:>10}".format("width", "latency (ms)", "accuracy"))
+
+    for width in args.widths:
+        fru = FaceRecognitionUtil(detection_width=width or None)
+        fru.load_encodings()
+
+        correct = 0
+        start_time = time.perf_counter()
+        for username, image in probes:
+            correct += fru.recognise_face(image) == username
+        elapsed = time.perf_counter() - start_time
+
+        print("{:>8} {:>14.1f} {:>9.1f}%".format(
+            width or "full",
+            elapsed / len(probes) * 1000,
+            correct / len(probes) * 100))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark face login latency and accuracy at several detection widths')
+    parser.add_argument(
+        'probe_folder',
+        type=str,
+        help='A folder with a subfolder of probe images for each username')
+    parser.add_argument(
+        '--widths',
+        type=int,
+        nargs='+',
+        default=[160, 240, 320, 480, 640, 0],
+        help='The detection widths to try, where 0 is full resolution')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,124 @@
+"""Compares how long it takes an Agent Pi to connect to the socket server over
+plain TCP, over TLS with a full handshake, and over TLS resuming its last
+session, as it does when it reconnects. Agent Pis connect with TLS 1.2, and
+the same is timed with TLS 1.3 for comparison.
+
+A self-signed certificate is created in a temporary folder and the socket
+server is started on a free port. Each connection sends a heartbeat and waits
+for its answer, so that the time includes the first message being served.
+
+Run from the /master_pi folder:
+    $ python benchmarks/tls_handshake.py --connections 200
+"""
+import argparse, asyncio, os, socket, ssl, statistics, sys, tempfile, threading, time
+
+sys.path.append('.')
+sys.path.append('./socket_server/')
+from protocol import HEADER, PING, PONG
+from server import Server
+from services import HttpServices
+from tls import create_client_context, create_self_signed_cert, create_server_context
+
+
+def connect(port, context=None, session=None):
+    """Connects to the server, sends a heartbeat and waits for its answer.
+
+    :return: The time taken in seconds, whether the TLS session was resumed
+        and the TLS session
+    :rtype: tuple
+    """
+    start_time = time.perf_counter()
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if context is not None:
+        sock = context.wrap_socket(sock, session=session)
+    sock.sendall(HEADER.pack(PING, 0))
+    message_type, length = HEADER.unpack(sock.recv(HEADER.size))
+    elapsed = time.perf_counter() - start_time
+    if message_type != PONG:
+        raise RuntimeError("Expected a heartbeat's answer")
+
+    resumed = getattr(sock, "session_reused", False)
+    session = getattr(sock, "session", None)
+    sock.close()
+    return elapsed, resumed, session
+
+
+def measure(port, connections, context=None, resume=False):
+    """Connects to the server a number of times, one after another.
+
+    :return: The time taken by each connection in seconds
+    :rtype: list
+    """
+    session = None
+    if resume:
+        session = connect(port, context)[2]
+
+    times = []
+    for i in range(connections):
+        elapsed, resumed, _ = connect(port, context, session)
+        if resume and not resumed:
+            raise RuntimeError("The TLS session was not resumed")
+        times.append(elapsed)
+    return sorted(times)
+
+
+def start_server(ssl_context):
+    """Starts a socket server in a thread of its own.
+
+    :return: The port that the server listens on
+    :rtype: int
+    """
+    loop = asyncio.new_event_loop()
+    server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                    ssl_context=ssl_context)
+    port = loop.run_until_complete(server.start_socket_server())[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return port
+
+
+def main():
+    args = parse_arguments()
+
+    with tempfile.TemporaryDirectory() as folder:
+        certfile = os.path.join(folder, "cert.pem")
+        keyfile = os.path.join(folder, "key.pem")
+        create_self_signed_cert(certfile, keyfile)
+        plain_port = start_server(None)
+        tls_port = start_server(create_server_context(certfile, keyfile))
+        context = create_client_context(certfile)
+        tls13_context = create_client_context(certfile)
+        tls13_context.maximum_version = ssl.TLSVersion.TLSv1_3
+
+        for name, port, client_context, resume in [
+                ("plain", plain_port, None, False),
+                ("tls", tls_port, context, False),
+                ("tls resumed", tls_port, context, True),
+                ("tls 1.3", tls_port, tls13_context, False),
+                ("tls 1.3 resumed", tls_port, tls13_context, True)]:
+            # Warming up before timing
+            measure(port, 10, client_context, resume)
+            times = measure(port, args.connections, client_context, resume)
+
+            print("{:>15}: mean {:.2f} ms, median {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms".format(
+                name,
+                statistics.mean(times) * 1000,
+                statistics.median(times) * 1000,
+                times[int(0.95 * (len(times) - 1))] * 1000,
+                times[-1] * 1000))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Compare the time to connect over plain TCP, TLS and resumed TLS')
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=200,
+        help='The number of connections to time each way')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
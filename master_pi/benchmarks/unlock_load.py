@@ -0,0 +1,100 @@
+"""Load tests the socket server with many cars unlocking at the same time.
+
+Each simulated Agent Pi opens its own connection to a running socket server and
+asks for its car to be unlocked, all at once. The time taken for every car to
+get its response and the latency each car saw are printed.
+
+Start the socket server and Flask API, then run from the /master_pi folder:
+    $ python benchmarks/unlock_load.py --cars 200 --username <username>
+"""
+import argparse, asyncio, statistics, sys, time
+
+sys.path.append('./socket_server/')
+from protocol import HEADER, REQUEST, decode_response, encode_request
+
+
+async def unlock(host, port, username, car_id):
+    """Unlocks one car the way an Agent Pi does and times how long it takes.
+
+    :return: The server's response and the latency in seconds
+    :rtype: tuple
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    start_time = time.perf_counter()
+
+    await send_frame(writer, REQUEST, encode_request(1, "Change Lock Status", {
+        "username": username,
+        "car_id": str(car_id),
+        "method": "unlock"
+    }))
+    response = decode_response((await read_frame(reader))[1])[1].decode()
+
+    latency = time.perf_counter() - start_time
+    writer.close()
+    await writer.wait_closed()
+    return response, latency
+
+
+async def send_frame(writer, message_type, payload):
+    writer.write(HEADER.pack(message_type, len(payload)) + payload)
+    await writer.drain()
+
+
+async def read_frame(reader):
+    message_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return message_type, await reader.readexactly(length)
+
+
+async def main():
+    args = parse_arguments()
+
+    start_time = time.perf_counter()
+    results = await asyncio.gather(
+        *[unlock(args.host, args.port, args.username, car_id)
+          for car_id in range(1, args.cars + 1)],
+        return_exceptions=True)
+    elapsed = time.perf_counter() - start_time
+
+    latencies = sorted(result[1] for result in results
+                       if not isinstance(result, Exception))
+    failures = len(results) - len(latencies)
+
+    print("{} cars unlocked in {:.2f} s ({} failed)".format(
+        len(latencies), elapsed, failures))
+    if latencies:
+        print("latency (ms): mean {:.1f}, median {:.1f}, p95 {:.1f}, max {:.1f}".format(
+            statistics.mean(latencies) * 1000,
+            statistics.median(latencies) * 1000,
+            latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+            latencies[-1] * 1000))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Load test the socket server with many cars unlocking at once')
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help='The IP address of the socket server')
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=65000,
+        help='The port of the socket server')
+    parser.add_argument(
+        '--cars',
+        type=int,
+        default=200,
+        help='The number of cars that unlock at the same time')
+    parser.add_argument(
+        '--username',
+        type=str,
+        default='test',
+        help='The user that unlocks the cars')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,72 +1,209 @@
-import logging
+import argparse, asyncio, configparser, functools, logging, os, signal, sys
 
+# Making the Flask app in /master_pi importable so that commands can be run
+# through its services in this process
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from event_bus import EVENTS_FOLDER
+from face_recognition_util import FaceRecognitionUtil
 from server import Server
+from services import HttpServices, LocalServices
+from supervisor import Supervisor
+from tls import create_self_signed_cert, create_server_context
 
 
 def main():
     """Main method to run necessary methods.\n
-    This method starts a TCP socket, waits for and establishes a connection, and
-    then starts the menu that awaits for commands.
+    This method starts a TCP socket server that Agent Pis connect to, and
+    serves the commands of every connected Agent Pi at once. If more than one
+    worker is set in config.ini the server is run in that many processes
+    sharing its port. If requested on the command line it instead rebuilds the
+    face encodings from the dataset, or creates a self-signed TLS certificate,
+    and exits.
     """
     # Setting logging level
     logging.basicConfig(level=logging.INFO)
 
-    # Starting TCP socket server
-    server = Server()
-    server_address = server.start_socket_server()
-    logging.info("Listening on {}...".format(server_address))
+    args = parse_arguments()
+    if args.create_tls_cert is not None:
+        create_self_signed_cert(args.tls_cert, args.tls_key, args.create_tls_cert)
+        logging.info("Created {} and {}".format(args.tls_cert, args.tls_key))
+        return
+    if args.encode_faces or args.build_index:
+        # Rebuilding every encoding or the index is an offline task and so the
+        # server is not started
+        fru = FaceRecognitionUtil()
+        if args.encode_faces:
+            fru.encode_faces(args.workers)
+        if args.build_index:
+            fru.build_index()
+        return
 
+    config = load_config()
+    workers = config["SOCKET_SERVER"].getint("WORKERS", fallback=1)
     try:
-        # Wait for Agent Pi to connect to this server
-        while True:
-            logging.info("Waiting for Agent Pi to connect")
-            client_address = server.wait_for_connection()
-            logging.info("Connected to Agent Pi on {}".format(client_address))
-            operations(server)
+        if workers > 1:
+            supervisor = Supervisor(
+                functools.partial(run_worker, args, config),
+                workers,
+                config["SOCKET_SERVER"].getfloat("DRAIN_TIMEOUT", fallback=10) + 5)
+            supervisor.run()
+        else:
+            asyncio.run(serve(args, config))
     except KeyboardInterrupt:
         logging.info("Server shutdown via keyboard interrupt")
+    except asyncio.CancelledError:
+        logging.info("Server shutdown via SIGTERM")
     finally:
         logging.info("Goodbye")
-        server.stop_socket_server()
 
 
-def operations(server):
-    """Menu to indicate to the server what operation the Agent Pi wants to do.
+def run_worker(args, config, number):
+    """Runs the server in one of several worker processes that share its
+    port.
 
-    :param server: The server object that is connected to the Agent Pi
-    :type server: Server
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    :param config: The config from config.ini
+    :type config: configparser.ConfigParser
+    :param number: The number of the worker
+    :type number: int
     """
-    continue_loop = True
-    while continue_loop:
-        logging.info("Waiting for instruction...")
-        instruction = server.wait_for_instruction()
-
-        if instruction == "Login":
-            logging.info("Login called")
-            server.login()
-        elif instruction == "Login With Face":
-            logging.info("Login with face called")
-            server.login_with_face()
-        elif instruction == "Login With Bluetooth":
-            logging.info("Login with bluetooth called")
-            server.login_with_bluetooth()
-        elif instruction == "Change Lock Status":
-            logging.info("Change lock status called")
-            server.change_lock_status()
-        elif instruction == "Change Car Location":
-            logging.info("Change car location called")
-            server.change_car_location()
-        elif instruction == "Add Face":
-            logging.info("Add face called")
-            server.add_face()
-        elif instruction == "Add Bluetooth":
-            logging.info("Add bluetooth called")
-            server.add_bluetooth()
-        elif instruction == "":
-            logging.warning("Agent Pi disconnected")
-            continue_loop = False
-        else:
-            logging.info("Invalid instruction: " + instruction)
+    try:
+        asyncio.run(serve(args, config, reuse_port=True))
+    except asyncio.CancelledError:
+        logging.info("Worker {} shutdown via SIGTERM".format(number))
+
+
+async def serve(args, config, reuse_port=False):
+    """Starts the TCP socket server and serves every Agent Pi that connects
+    until the server is stopped.\n
+    When the process is sent SIGTERM the server stops accepting Agent Pis and
+    gives requests that have started time to finish before it disconnects
+    every Agent Pi.
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    :param config: The config from config.ini
+    :type config: configparser.ConfigParser
+    :param reuse_port: Whether other processes are listening on the same port
+    :type reuse_port: bool
+    """
+    section = config["SOCKET_SERVER"]
+    if args.http_api:
+        services = HttpServices.from_config(config["API"])
+    else:
+        services = LocalServices()
+    options = {}
+    if reuse_port:
+        # Sharing the CPUs between the workers' face recognition processes
+        workers = section.getint("WORKERS", fallback=1)
+        options["reuse_port"] = True
+        options["face_workers"] = section.getint(
+            "FACE_WORKERS", fallback=max(1, (os.cpu_count() or 1) // workers))
+    elif "FACE_WORKERS" in section:
+        options["face_workers"] = section.getint("FACE_WORKERS")
+    if "LOCATION_INTERVAL" in section:
+        options["location_interval"] = section.getfloat("LOCATION_INTERVAL")
+    if args.idle_timeout is not None:
+        options["idle_timeout"] = args.idle_timeout
+    if args.tls:
+        options["ssl_context"] = create_server_context(
+            args.tls_cert, args.tls_key)
+    server = Server(services=services,
+                    events_folder=section.get("EVENTS_FOLDER", EVENTS_FOLDER),
+                    **options)
+    server_address = await server.start_socket_server()
+    logging.info("Listening on {}...".format(server_address))
+
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.stop_socket_server(
+            section.getfloat("DRAIN_TIMEOUT", fallback=10))
+        for command, stats in server.get_handler_stats().items():
+            if stats["calls"]:
+                logging.info(
+                    "{}: {calls} calls, {errors} errors, {mean:.1f} ms mean, {max:.1f} ms max".format(
+                        command,
+                        mean=stats["total_time"] / stats["calls"] * 1000,
+                        max=stats["max_time"] * 1000,
+                        **stats))
+
+
+def load_config():
+    """Loads the config.ini file from the root of the project.
+
+    :return: The config, with empty API and SOCKET_SERVER sections if it
+        doesn't have them
+    :rtype: configparser.ConfigParser
+    """
+    config = configparser.ConfigParser()
+    config.read(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        os.pardir,
+        os.pardir,
+        'config.ini'))
+    for section in ("API", "SOCKET_SERVER"):
+        if not config.has_section(section):
+            config.add_section(section)
+    return config
+
+
+def parse_arguments():
+    """Parses the command line arguments for the socket server.
+
+    :return: The parsed arguments
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description='TCP socket server for RMIT Rideshare Agent Pis to connect to')
+    parser.add_argument(
+        '--encode-faces',
+        action='store_true',
+        help='Rebuild the face encodings from every image in the dataset and exit')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='The number of processes used by --encode-faces (defaults to the number of CPUs)')
+    parser.add_argument(
+        '--build-index',
+        action='store_true',
+        help='Build an approximate nearest neighbour index over the face encodings and exit')
+    parser.add_argument(
+        '--idle-timeout',
+        type=float,
+        default=None,
+        help='Seconds without hearing from an Agent Pi before its connection is closed (defaults to 90)')
+    parser.add_argument(
+        '--http-api',
+        action='store_true',
+        help='Send commands to the Flask API set in config.ini over HTTP instead of running them in this process')
+    parser.add_argument(
+        '--tls',
+        action='store_true',
+        help='Only accept Agent Pis that connect over TLS')
+    parser.add_argument(
+        '--tls-cert',
+        type=str,
+        default='tls_cert.pem',
+        help='The certificate the server uses for TLS')
+    parser.add_argument(
+        '--tls-key',
+        type=str,
+        default='tls_key.pem',
+        help='The private key of the certificate the server uses for TLS')
+    parser.add_argument(
+        '--create-tls-cert',
+        type=str,
+        metavar='HOST',
+        default=None,
+        help='Create a self-signed certificate for the Master Pi\'s IP address at --tls-cert and --tls-key and exit')
+
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+import json
+from protocol import (EVENT, FrameError, IMAGE, JSON, PONG, RESPONSE, TEXT,
+    encode_event, encode_response)
+
+
+class Connection:
+    """A class to hold the state of one Agent Pi's connection to the server, so
+    that many Agent Pis can be served at once.\n
+    Messages are sent and received as frames, see the protocol module.
+
+    :param protocol: The protocol that frames from the Agent Pi are read from
+    :type protocol: FrameProtocol
+    """
+
+    def __init__(self, protocol):
+        """Constructor method
+        """
+        self.__protocol = protocol
+        self.__address = protocol.get_transport().get_extra_info("peername")
+        self.__car_id = None
+
+
+    async def receive(self, message_type):
+        """Waits for a message of a given type from the Agent Pi.
+
+        :param message_type: The type of message that is expected
+        :type message_type: int
+        :raises FrameError: If a message of another type is received
+        :raises ConnectionResetError: If the Agent Pi disconnects first
+        :return: The message's payload
+        :rtype: bytearray
+        """
+        frame = await self.__protocol.read_frame()
+        if frame is None:
+            raise ConnectionResetError("Agent Pi disconnected")
+        if frame[0] != message_type:
+            raise FrameError("Expected a message of type {} but got {}".format(
+                message_type, frame[0]))
+        return frame[1]
+
+
+    async def send(self, message_type, payload):
+        """Sends a message to the Agent Pi, waiting if its buffer is full.
+
+        :param message_type: The type of the message
+        :type message_type: int
+        :param payload: The message's payload
+        :type payload: bytes
+        """
+        await self.__protocol.write_frame(message_type, payload)
+
+
+    async def receive_frame(self):
+        """Waits for the next message from the Agent Pi, whatever its type.
+
+        :return: The message type and payload, or None if the Agent Pi has
+            disconnected
+        :rtype: tuple
+        """
+        return await self.__protocol.read_frame()
+
+
+    async def receive_json(self):
+        """Waits for a JSON message from the Agent Pi.
+
+        :return: The decoded message
+        :rtype: dict
+        """
+        return json.loads(await self.receive(JSON))
+
+
+    async def receive_image(self):
+        """Receive an image from the Agent Pi. It is left encoded as a JPEG or
+        PNG so that it can be cached or passed on before it is decoded.
+
+        :return: The encoded image that has been received
+        :rtype: bytearray
+        """
+        return await self.receive(IMAGE)
+
+
+    async def send_text(self, text):
+        """Sends a string, such as an acknowledgement, to the Agent Pi.
+
+        :param text: The string to send
+        :type text: string
+        """
+        await self.send(TEXT, text.encode())
+
+
+    async def send_json(self, document):
+        """Sends a JSON document to the Agent Pi.
+
+        :param document: The JSON document, already serialised
+        :type document: string
+        """
+        await self.send(JSON, document.encode())
+
+
+    async def send_response(self, request_id, body):
+        """Sends the response to a request to the Agent Pi.
+
+        :param request_id: The id of the request that is answered
+        :type request_id: int
+        :param body: The body of the response
+        :type body: string
+        """
+        await self.send(RESPONSE, encode_response(request_id, body.encode()))
+
+
+    async def send_event(self, event_id, event):
+        """Pushes an event to the Agent Pi.
+
+        :param event_id: The id of the event
+        :type event_id: int
+        :param event: The event, holding its type and details
+        :type event: dict
+        """
+        await self.send(EVENT, encode_event(event_id, event))
+
+
+    async def send_pong(self):
+        """Answers a heartbeat from the Agent Pi.
+        """
+        await self.send(PONG, b"")
+
+
+    async def close(self):
+        """Closes the connection to the Agent Pi.
+        """
+        await self.__protocol.close()
+
+
+    async def abort(self):
+        """Drops the connection to an Agent Pi that has gone away, without
+        waiting for anything still to be sent.
+        """
+        await self.__protocol.abort()
+
+
+    def get_idle_time(self):
+        """Returns how long it has been since anything was received from the
+        Agent Pi.
+
+        :return: The idle time in seconds
+        :rtype: float
+        """
+        return self.__protocol.get_idle_time()
+
+
+    def get_address(self):
+        """Returns the address of the Agent Pi.
+
+        :return: The Agent Pi's IP and port
+        :rtype: tuple
+        """
+        return self.__address
+
+
+    def set_car_id(self, car_id):
+        """Records which car the Agent Pi corresponds to, once it has
+        registered.
+
+        :param car_id: The id of the car
+        :type car_id: int
+        """
+        self.__car_id = car_id
+
+
+    def get_car_id(self):
+        """Returns the id of the car the Agent Pi corresponds to.
+
+        :return: The car's id, or None if the Agent Pi hasn't registered
+        :rtype: int
+        """
+        return self.__car_id
@@ -0,0 +1,119 @@
+import logging, time
+
+
+class UnknownCommandError(Exception):
+    """Raised when an Agent Pi sends a command that has no handler"""
+
+
+class Dispatcher:
+    """A class to look up and run the handler for each command that an Agent Pi
+    can send.\n
+    Each handler is a coroutine function that takes the details of a command
+    and any image sent with it, and returns the response to send back. Handlers
+    are registered under a numeric opcode and a name, so that a command can be
+    found by either in a single dictionary lookup. New commands are added by
+    registering a handler, without changing how connections are served.\n
+    How many times each handler has run, how many of those raised an error and
+    how long they took are kept, see get_stats.
+    """
+
+    def __init__(self):
+        """Constructor method
+        """
+        self.__handlers = {}
+        self.__names = {}
+        self.__opcodes = {}
+        self.__stats = {}
+
+
+    def register(self, opcode, name, handler):
+        """Registers the handler for a command, replacing any handler that was
+        already registered for its opcode.
+
+        :param opcode: The command's opcode, such as LOGIN
+        :type opcode: int
+        :param name: The command's name, such as "Login"
+        :type name: string
+        :param handler: The coroutine function that runs the command
+        :type handler: function
+        """
+        old_name = self.__names.get(opcode)
+        if old_name is not None:
+            del self.__opcodes[old_name]
+        self.__handlers[opcode] = handler
+        self.__names[opcode] = name
+        self.__opcodes[name] = opcode
+        self.__stats[opcode] = {
+            "calls": 0,
+            "errors": 0,
+            "total_time": 0.0,
+            "max_time": 0.0
+        }
+
+
+    def get_opcode(self, command):
+        """Looks up the opcode of a command.
+
+        :param command: The command's name, or its opcode
+        :type command: string
+        :return: The opcode, or None if there is no handler for the command
+        :rtype: int
+        """
+        opcode = self.__opcodes.get(command, command)
+        return opcode if opcode in self.__handlers else None
+
+
+    def get_name(self, opcode):
+        """Looks up the name of a command.
+
+        :param opcode: The command's opcode
+        :type opcode: int
+        :return: The name, or None if there is no handler for the command
+        :rtype: string
+        """
+        return self.__names.get(opcode)
+
+
+    async def dispatch(self, command, message, image=None):
+        """Runs the handler for a command and records how long it took.
+
+        :param command: The command's opcode, or its name
+        :type command: int
+        :param message: The details of the command
+        :type message: dict
+        :param image: An image sent with the command
+        :type image: bytes
+        :raises UnknownCommandError: If there is no handler for the command
+        :return: The response to send to the Agent Pi
+        :rtype: string
+        """
+        opcode = self.__opcodes.get(command, command)
+        handler = self.__handlers.get(opcode)
+        if handler is None:
+            raise UnknownCommandError(command)
+
+        logging.info("{} called".format(self.__names[opcode]))
+        stats = self.__stats[opcode]
+        stats["calls"] += 1
+        start_time = time.perf_counter()
+        try:
+            return await handler(message, image)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start_time
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+
+
+    def get_stats(self):
+        """Returns how each handler has performed.
+
+        :return: For the name of each command, the number of times its handler
+            has run, the number of those that raised an error, and the total
+            and longest time taken in seconds
+        :rtype: dict
+        """
+        return {self.__names[opcode]: dict(stats)
+                for opcode, stats in self.__stats.items()}
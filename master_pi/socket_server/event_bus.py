@@ -0,0 +1,173 @@
+import asyncio, json, logging, os, socket, tempfile
+
+EVENTS_FOLDER = os.path.join(tempfile.gettempdir(), "rmit-rideshare-events")
+"""The folder that the socket server's processes listen for events in by
+default. This must match the Flask app's app/events.py"""
+
+ACKNOWLEDGED = "acknowledged"
+"""The result for a car that acknowledged an event it was pushed"""
+NO_ACK = "no_ack"
+"""The result for a car that didn't acknowledge an event in time"""
+DISCONNECTED = "disconnected"
+"""The result for a car whose connection was lost before it acknowledged an
+event"""
+
+
+class EventBus(asyncio.DatagramProtocol):
+    """A class to receive events for cars from the Flask app, such as a
+    booking being cancelled, so that they can be pushed to the cars' Agent Pis
+    straight away instead of the cars having to ask.\n
+    Every socket server process listens on a Unix datagram socket of its own,
+    named after its process id, in a folder that it shares with the Flask app.
+    The Flask app sends each event to every socket in the folder, and the
+    process that the car is connected to pushes it while the others ignore
+    it, so the Flask app doesn't need to know which worker process a car is
+    connected to. Each event is a JSON document holding the id of the car and
+    the event to push to it.\n
+    An event can instead be for several cars, such as when an admin locks a
+    group of cars, in which case it holds their ids and the seconds to wait
+    for them to acknowledge it. Once they have, or the time is up, the result
+    for each of the cars that are connected to this process is sent back to
+    the socket the event came from, see ACKNOWLEDGED. Every process answers,
+    even if none of the cars are connected to it, so that the Flask app knows
+    when it has heard from them all.
+
+    :param folder: The folder that the socket is created in
+    :type folder: string
+    :param push_event: Coroutine function that is called with the id of a car
+        and an event to push to it, and returns whether it was pushed
+    :type push_event: function
+    :param push_event_to_cars: Coroutine function that is called with a list
+        of car ids, an event and the seconds to wait, and returns the result
+        for each car that is connected
+    :type push_event_to_cars: function
+    """
+
+    def __init__(self, folder, push_event, push_event_to_cars):
+        """Constructor method
+        """
+        self.__folder = folder
+        self.__push_event = push_event
+        self.__push_event_to_cars = push_event_to_cars
+        self.__path = os.path.join(folder, "{}.sock".format(os.getpid()))
+        self.__transport = None
+        self.__tasks = set()
+        self.__received = 0
+        self.__pushed = 0
+
+
+    async def open(self):
+        """Starts listening for events.
+        """
+        # Only letting the user the server runs as send events
+        os.makedirs(self.__folder, mode=0o700, exist_ok=True)
+        # Removing the socket of an earlier process that had the same id
+        try:
+            os.unlink(self.__path)
+        except FileNotFoundError:
+            pass
+        loop = asyncio.get_running_loop()
+        self.__transport, _ = await loop.create_datagram_endpoint(
+            lambda: self, local_addr=self.__path, family=socket.AF_UNIX)
+
+
+    def close(self):
+        """Stops listening for events and removes the socket, so that the
+        Flask app stops sending events to it.
+        """
+        if self.__transport is None:
+            return
+        self.__transport.close()
+        self.__transport = None
+        try:
+            os.unlink(self.__path)
+        except FileNotFoundError:
+            pass
+        for task in self.__tasks:
+            task.cancel()
+
+
+    def datagram_received(self, data, address):
+        """Pushes an event that the Flask app has sent to the cars it is for.
+
+        :param data: The event, as a JSON document
+        :type data: bytes
+        :param address: The address of the socket that sent the event
+        :type address: string
+        """
+        try:
+            message = json.loads(data)
+            event = message["event"]
+            if "car_ids" in message:
+                push = self.__push_to_cars(
+                    [int(car_id) for car_id in message["car_ids"]],
+                    event,
+                    float(message["timeout"]),
+                    address)
+            else:
+                push = self.__push(int(message["car_id"]), event)
+        except (KeyError, TypeError, ValueError) as error:
+            logging.warning("Invalid event from the Flask app: {}".format(
+                error))
+            return
+
+        self.__received += 1
+        task = asyncio.get_running_loop().create_task(push)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+
+    async def __push(self, car_id, event):
+        """Pushes an event to a car, if it is connected to this process.
+
+        :param car_id: The id of the car
+        :type car_id: int
+        :param event: The event, holding its type and details
+        :type event: dict
+        """
+        if await self.__push_event(car_id, event):
+            self.__pushed += 1
+
+
+    async def __push_to_cars(self, car_ids, event, timeout, address):
+        """Pushes an event to the cars it is for that are connected to this
+        process, waits for them to acknowledge it and sends back the result
+        for each of them.
+
+        :param car_ids: The ids of the cars
+        :type car_ids: list
+        :param event: The event, holding its type and details
+        :type event: dict
+        :param timeout: The most seconds to wait for the cars
+        :type timeout: float
+        :param address: The socket to send the results to, or None to not
+            send them
+        :type address: string
+        """
+        results = await self.__push_event_to_cars(car_ids, event, timeout)
+        self.__pushed += len(results)
+        if address and self.__transport is not None:
+            self.__transport.sendto(
+                json.dumps({ "results": results }).encode(), address)
+
+
+    def get_path(self):
+        """Returns the path of the socket that events are received on.
+
+        :return: The socket's path
+        :rtype: string
+        """
+        return self.__path
+
+
+    def get_stats(self):
+        """Returns counts of the events received from the Flask app.
+
+        :return: The number of events received and the number of cars
+            connected to this process that they were pushed to
+        :rtype: dict
+        """
+        return {
+            "received": self.__received,
+            "pushed": self.__pushed
+        }
@@ -0,0 +1,409 @@
+import contextlib, fcntl, logging, os, pickle, shutil, struct, tempfile
+import numpy as np
+
+
+def file_signature(path):
+    """Identifies the current version of a file by its inode, modification time
+    and size.
+
+    :param path: The path to the file
+    :type path: string
+    :return: The signature of the file or None if it does not exist
+    :rtype: tuple
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class FaceEncodingStore:
+    """A class to keep the known face encodings resident in memory.\n
+    The encodings are held as one contiguous (N, 128) float32 matrix alongside
+    a parallel array of the names they belong to and the squared norm of each
+    row, which is used when computing distances. The file they are loaded from
+    is only read again when it has changed on disk.\n
+    The file is made up of a fixed size header, the float32 matrix and a table
+    of null separated names. The matrix is memory-mapped rather than read so
+    that every process using the file shares the same pages.
+
+    :param path: The path to the encodings file
+    :type path: string
+    :param legacy_path: The path to a pickled encodings file to be migrated if
+        the encodings file does not exist yet
+    :type legacy_path: string
+    """
+    ENCODING_SIZE = 128
+    """The number of dimensions in a face encoding"""
+    __MAGIC = b"RMITFACE"
+    """The bytes that every encodings file starts with"""
+    __VERSION = 1
+    """The version of the file format"""
+    __HEADER = struct.Struct("<8sHHII")
+    """The magic bytes, version, encoding size, number of encodings and the
+    length of the names table"""
+    __HEADER_SIZE = 64
+    """The number of bytes reserved for the header, which keeps the matrix
+    aligned"""
+
+
+    def __init__(self, path, legacy_path=None):
+        """Constructor method
+        """
+        self.__path = path
+        self.__legacy_path = legacy_path
+        self.__signature = None
+        self.set_encodings([], [])
+
+
+    def load(self):
+        """Loads the encodings file into memory, replacing whatever was loaded
+        before. If the file does not exist the store is left empty, unless
+        there is a pickled encodings file to migrate.
+        """
+        signature = file_signature(self.__path)
+        if signature is None:
+            if self.__legacy_path is not None and os.path.exists(self.__legacy_path):
+                self.migrate(self.__legacy_path)
+                return
+            logging.info("no encodings found at {}".format(self.__path))
+            self.set_encodings([], [])
+            self.__signature = None
+            return
+
+        logging.info("loading encodings...")
+        with open(self.__path, "rb") as f:
+            magic, version, size, count, names_length = self.__HEADER.unpack(
+                f.read(self.__HEADER.size))
+            if magic != self.__MAGIC:
+                raise ValueError("{} is not a face encodings file".format(self.__path))
+            if version != self.__VERSION or size != self.ENCODING_SIZE:
+                raise ValueError("{} has unsupported version {} with {}-d encodings"
+                                 .format(self.__path, version, size))
+
+            # Reading the names table that comes after the matrix
+            f.seek(self.__HEADER_SIZE + count * size * 4)
+            names_table = f.read(names_length)
+            if len(names_table) != names_length:
+                raise ValueError("{} is truncated".format(self.__path))
+
+        names = names_table.decode().split("\0") if count > 0 else []
+        if count > 0:
+            encodings = np.memmap(self.__path, dtype=np.float32, mode="r",
+                                  offset=self.__HEADER_SIZE, shape=(count, size))
+        else:
+            encodings = []
+
+        self.set_encodings(encodings, names)
+        self.__signature = signature
+        logging.info("loaded {} encodings".format(len(self.__names)))
+
+
+    def save(self):
+        """Writes the encodings held in memory to the encodings file.\n
+        The file is written under a temporary name and then renamed over the
+        old file, so that a reader only ever sees a complete file.
+        """
+        logging.info("serializing encodings...")
+        names_table = "\0".join(self.__names).encode()
+
+        temp_path = "{}.{}.tmp".format(self.__path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(self.__pack_header(len(self.__names), len(names_table)))
+            f.write(self.__encodings.data)
+            f.write(names_table)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.__path)
+
+        # Remembering the version just written so it isn't loaded again
+        self.__signature = file_signature(self.__path)
+
+
+    def write(self, rows):
+        """Replaces the encodings file with encodings that are written as they
+        are produced, and then loads it.\n
+        Unlike save, the encodings don't have to be held in memory first. Each
+        one is appended to the matrix as soon as it is produced, while the
+        names are spooled to a temporary file until the matrix is complete. The
+        file is written under a temporary name and renamed over the old file
+        once it is complete, so the old file is kept if producing the
+        encodings fails.
+
+        :param rows: Pairs of a username and a list of that user's encodings
+        :type rows: iterable
+        """
+        logging.info("writing encodings...")
+        temp_path = "{}.{}.tmp".format(self.__path, os.getpid())
+        count = 0
+        try:
+            with open(temp_path, "wb") as f, tempfile.TemporaryFile() as names:
+                # Leaving space for the header, which needs the final counts
+                f.write(self.__pack_header(0, 0))
+                for name, encodings in rows:
+                    matrix = np.asarray(encodings, dtype=np.float32).reshape(
+                        -1, self.ENCODING_SIZE)
+                    f.write(matrix.tobytes())
+                    for _ in range(len(matrix)):
+                        # Separating each name from the one before it
+                        if count > 0:
+                            names.write(b"\0")
+                        names.write(name.encode())
+                        count += 1
+
+                # Adding the names table after the matrix
+                names_length = names.tell()
+                names.seek(0)
+                shutil.copyfileobj(names, f)
+                f.seek(0)
+                f.write(self.__pack_header(count, names_length))
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        os.replace(temp_path, self.__path)
+        self.load()
+
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Holds an exclusive lock on the encodings file while it is changed,
+        so that servers in other processes can't change it at the same time
+        and lose each other's changes. Readers don't need the lock.
+        """
+        with open(self.__path + ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def migrate(self, legacy_path):
+        """Converts a pickled encodings file, written by older versions of the
+        server, into the encodings file.
+
+        :param legacy_path: The path to the pickled encodings file
+        :type legacy_path: string
+        """
+        logging.info("migrating encodings from {}".format(legacy_path))
+        with open(legacy_path, "rb") as f:
+            data = pickle.loads(f.read())
+        self.set_encodings(data["encodings"], data["names"])
+        self.save()
+
+
+    def get_signature(self):
+        """Identifies the version of the encodings file that is loaded, or was
+        last saved from this store.
+
+        :return: The signature of the file or None if no file has been loaded
+        :rtype: tuple
+        """
+        return self.__signature
+
+
+    def get_file_signature(self):
+        """Identifies the version of the encodings file currently on disk,
+        which may be newer than the version that is loaded.
+
+        :return: The signature of the file or None if it does not exist
+        :rtype: tuple
+        """
+        return file_signature(self.__path)
+
+
+    def get_path(self):
+        """Returns the path to the encodings file.
+
+        :return: The path to the encodings file
+        :rtype: string
+        """
+        return self.__path
+
+
+    def reload_if_changed(self):
+        """Reloads the encodings file only if it has been modified or replaced
+        since it was last loaded.
+
+        :return: Whether the encodings were reloaded
+        :rtype: boolean
+        """
+        if file_signature(self.__path) == self.__signature:
+            return False
+        self.load()
+        return True
+
+
+    def set_encodings(self, encodings, names):
+        """Replaces every encoding in the store.
+
+        :param encodings: The face encodings, one per name
+        :type encodings: list
+        :param names: The usernames that each encoding belongs to
+        :type names: list
+        """
+        self.__set_rows(
+            np.asarray(encodings, dtype=np.float32).reshape(-1, self.ENCODING_SIZE),
+            np.asarray(names, dtype=object))
+
+
+    def replace_user(self, name, encodings):
+        """Replaces the encodings belonging to a single user, leaving the rest
+        of the store untouched.
+
+        :param name: The user's username
+        :type name: string
+        :param encodings: The user's new face encodings
+        :type encodings: list
+        :return: A boolean mask of the rows that were kept, with the new rows
+            added after them
+        :rtype: numpy.ndarray
+        """
+        keep = self.__names != name
+        return self.__keep_and_append(keep, name, encodings)
+
+
+    def add_user_encodings(self, name, encodings, limit):
+        """Adds encodings to a single user, dropping that user's oldest
+        encodings so that they have no more than the limit.
+
+        :param name: The user's username
+        :type name: string
+        :param encodings: The user's new face encodings
+        :type encodings: list
+        :param limit: The most encodings a user can have
+        :type limit: int
+        :return: A boolean mask of the rows that were kept, with the new rows
+            added after them
+        :rtype: numpy.ndarray
+        """
+        # Rows are only ever added to the end and so a user's oldest rows come
+        # first
+        user_rows = np.flatnonzero(self.__names == name)
+        excess = max(0, len(user_rows) + len(encodings) - limit)
+        keep = np.ones(len(self.__names), dtype=bool)
+        keep[user_rows[:excess]] = False
+        return self.__keep_and_append(keep, name, encodings[-limit:])
+
+
+    def get_encodings(self):
+        """Returns the matrix of known encodings.
+
+        :return: An (N, 128) matrix with one encoding per row
+        :rtype: numpy.ndarray
+        """
+        return self.__encodings
+
+
+    def get_names(self):
+        """Returns the names that each row of the encodings matrix belongs to.
+
+        :return: An array of N usernames
+        :rtype: numpy.ndarray
+        """
+        return self.__names
+
+
+    def get_centroids(self):
+        """Returns the mean encoding of each user, which is computed the first
+        time it is needed after the encodings change.
+
+        :return: An array of U usernames, a (U, 128) matrix with the centroid
+            of each user and an array of the squared norm of each centroid
+        :rtype: tuple
+        """
+        if self.__centroids is None:
+            names, inverse, counts = np.unique(
+                self.__names, return_inverse=True, return_counts=True)
+            centroids = np.empty((len(names), self.ENCODING_SIZE), dtype=np.float32)
+            if len(names) > 0:
+                # Summing each user's rows as one contiguous run
+                order = np.argsort(inverse, kind="stable")
+                starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                centroids = (np.add.reduceat(self.__encodings[order], starts)
+                             / counts[:, np.newaxis]).astype(np.float32)
+            self.__centroids = (
+                names, centroids, np.einsum("ij,ij->i", centroids, centroids))
+            self.__centroid_rows = inverse.reshape(-1)
+        return self.__centroids
+
+
+    def get_centroid_rows(self):
+        """Returns which centroid each row of the encodings matrix belongs to,
+        so that the users of a set of rows can be found without comparing
+        names.
+
+        :return: An array of N indexes into the arrays of get_centroids
+        :rtype: numpy.ndarray
+        """
+        self.get_centroids()
+        return self.__centroid_rows
+
+
+    def get_squared_norms(self):
+        """Returns the squared euclidean norm of each row of the encodings
+        matrix.
+
+        :return: An array of N squared norms
+        :rtype: numpy.ndarray
+        """
+        return self.__squared_norms
+
+
+    def __len__(self):
+        return len(self.__names)
+
+
+    def __pack_header(self, count, names_length):
+        """Packs the header of an encodings file, padded to its reserved size.
+
+        :param count: The number of encodings in the file
+        :type count: int
+        :param names_length: The length of the names table in bytes
+        :type names_length: int
+        :return: The header
+        :rtype: bytes
+        """
+        header = self.__HEADER.pack(self.__MAGIC, self.__VERSION,
+                                    self.ENCODING_SIZE, count, names_length)
+        return header.ljust(self.__HEADER_SIZE, b"\0")
+
+
+    def __keep_and_append(self, keep, name, encodings):
+        """Drops the rows that aren't kept and adds new rows for a user.
+
+        :param keep: A boolean mask of the rows that are kept
+        :type keep: numpy.ndarray
+        :param name: The username the new rows belong to
+        :type name: string
+        :param encodings: The new face encodings
+        :type encodings: list
+        :return: The mask of the rows that were kept
+        :rtype: numpy.ndarray
+        """
+        new_rows = np.asarray(encodings, dtype=np.float32).reshape(-1, self.ENCODING_SIZE)
+        self.__set_rows(
+            np.concatenate((self.__encodings[keep], new_rows)),
+            np.concatenate(
+                (self.__names[keep], np.full(len(new_rows), name, dtype=object))))
+        return keep
+
+
+    def __set_rows(self, encodings, names):
+        """Swaps in a new encodings matrix and names array and recomputes the
+        squared norm of each row.
+
+        :param encodings: An (N, 128) float32 matrix of encodings
+        :type encodings: numpy.ndarray
+        :param names: An array of N usernames
+        :type names: numpy.ndarray
+        """
+        self.__encodings = np.ascontiguousarray(encodings)
+        self.__names = names
+        self.__squared_norms = np.einsum(
+            "ij,ij->i", self.__encodings, self.__encodings)
+        self.__centroids = None
+        self.__centroid_rows = None
@@ -0,0 +1,239 @@
+import logging, os
+import numpy as np
+from face_encoding_store import file_signature
+
+
+class FaceIndex:
+    """A class to represent an approximate nearest neighbour index over the
+    known face encodings.\n
+    The encodings are partitioned into lists around centroids found with
+    k-means (an inverted file index). A probe is only compared against the
+    encodings in the lists whose centroids are nearest to it, rather than
+    against every known encoding. Each row of the index lines up with the same
+    row of the encodings store, and the index records which version of the
+    encodings file it was built for so that it isn't used once the file has
+    been rewritten without it.
+
+    :param path: The path that the index is saved to
+    :type path: string
+    :param n_probe: The number of nearest lists to search for each probe
+    :type n_probe: int
+    """
+    __ITERATIONS = 10
+    """The number of k-means iterations used when building the index"""
+    __SAMPLES_PER_LIST = 64
+    """How many encodings per list are sampled to train the centroids"""
+
+
+    def __init__(self, path, n_probe=8):
+        """Constructor method
+        """
+        self.__path = path
+        self.__n_probe = n_probe
+        self.__signature = None
+        self.__store_signature = None
+        self.__centroids = None
+        self.__assignments = np.empty(0, dtype=np.int32)
+        self.__lists = None
+
+
+    def exists(self):
+        """Checks whether an index has been saved to disk.
+
+        :return: Whether the index file exists
+        :rtype: boolean
+        """
+        return os.path.exists(self.__path)
+
+
+    def is_ready(self, size, store_signature):
+        """Checks whether the index is loaded and lines up with the store.\n
+        The number of encodings alone isn't enough, as another process may
+        have rewritten the encodings file with the same number of rows but
+        different faces in them.
+
+        :param size: The number of encodings in the store
+        :type size: int
+        :param store_signature: The signature of the encodings file that the
+            store has loaded, see FaceEncodingStore.get_signature
+        :type store_signature: tuple
+        :return: Whether the index can be searched
+        :rtype: boolean
+        """
+        return (self.__centroids is not None
+                and len(self.__assignments) == size
+                and self.__store_signature == store_signature)
+
+
+    def build(self, encodings, store_signature, n_lists=None):
+        """Partitions the encodings into lists using k-means.
+
+        :param encodings: An (N, 128) matrix of encodings
+        :type encodings: numpy.ndarray
+        :param store_signature: The signature of the encodings file that the
+            encodings were loaded from
+        :type store_signature: tuple
+        :param n_lists: The number of lists, which defaults to roughly the
+            square root of the number of encodings
+        :type n_lists: int
+        """
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(encodings)))
+        n_lists = max(1, min(n_lists, len(encodings)))
+        logging.info("building index with {} lists over {} encodings".format(
+            n_lists, len(encodings)))
+
+        # Training the centroids on a sample of the encodings as k-means over
+        # every encoding is slow for a large gallery
+        rng = np.random.default_rng(0)
+        sample_size = min(len(encodings), n_lists * self.__SAMPLES_PER_LIST)
+        sample = encodings[rng.choice(len(encodings), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(self.__ITERATIONS):
+            # Moving each centroid to the mean of the encodings nearest to it
+            labels = self.__nearest_centroids(sample, centroids, 1)[:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            # Empty lists keep their old centroid
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+
+        self.__centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.__assignments = self.__assign(encodings)
+        self.__store_signature = store_signature
+        self.__lists = None
+
+
+    def add(self, encodings, store_signature):
+        """Adds new encodings to the end of the index by putting each in the
+        list of its nearest centroid. The centroids themselves are not moved.
+
+        :param encodings: An (M, 128) matrix of encodings
+        :type encodings: numpy.ndarray
+        :param store_signature: The signature of the encodings file once the
+            encodings have been saved to it
+        :type store_signature: tuple
+        """
+        self.__assignments = np.concatenate(
+            (self.__assignments, self.__assign(encodings)))
+        self.__store_signature = store_signature
+        self.__lists = None
+
+
+    def keep(self, rows):
+        """Drops every row of the index that is not being kept.
+
+        :param rows: A boolean mask of the rows that are kept
+        :type rows: numpy.ndarray
+        """
+        self.__assignments = self.__assignments[rows]
+        self.__lists = None
+
+
+    def candidates(self, encoding):
+        """Finds the rows that a probe should be compared against.
+
+        :param encoding: The 128-d encoding of the face to be matched
+        :type encoding: numpy.ndarray
+        :return: The rows in the lists nearest to the probe
+        :rtype: numpy.ndarray
+        """
+        if self.__lists is None:
+            # Grouping the rows by list so each list is a contiguous slice
+            order = np.argsort(self.__assignments, kind="stable")
+            bounds = np.searchsorted(
+                self.__assignments[order], np.arange(len(self.__centroids) + 1))
+            self.__lists = (order, bounds)
+        order, bounds = self.__lists
+
+        probe = np.asarray(encoding, dtype=np.float32).reshape(1, -1)
+        nearest = self.__nearest_centroids(probe, self.__centroids, self.__n_probe)[0]
+        return np.concatenate([order[bounds[i]:bounds[i + 1]] for i in nearest])
+
+
+    def load(self):
+        """Loads the index from disk.
+        """
+        signature = file_signature(self.__path)
+        with np.load(self.__path) as data:
+            self.__centroids = data["centroids"]
+            self.__assignments = data["assignments"]
+            # Indexes saved before the signature was recorded are never
+            # ready, and are used again once rebuilt
+            if "store_signature" in data and len(data["store_signature"]):
+                self.__store_signature = tuple(
+                    int(value) for value in data["store_signature"])
+            else:
+                self.__store_signature = None
+        self.__lists = None
+        self.__signature = signature
+        logging.info("loaded index with {} lists".format(len(self.__centroids)))
+
+
+    def reload_if_changed(self):
+        """Reloads the index only if it has been saved to disk since it was
+        last loaded.
+
+        :return: Whether the index was reloaded
+        :rtype: boolean
+        """
+        signature = file_signature(self.__path)
+        if signature is None or signature == self.__signature:
+            return False
+        self.load()
+        return True
+
+
+    def save(self):
+        """Saves the index to disk, replacing the old file in one step so that
+        a partially written index is never read.
+        """
+        # Naming the temporary file after this process so that processes
+        # saving at the same time don't write over each other's
+        temp_path = "{}.{}.tmp".format(self.__path, os.getpid())
+        with open(temp_path, "wb") as f:
+            np.savez(f, centroids=self.__centroids,
+                     assignments=self.__assignments,
+                     store_signature=np.array(
+                         self.__store_signature or (), dtype=np.int64))
+        os.replace(temp_path, self.__path)
+        self.__signature = file_signature(self.__path)
+
+
+    def __assign(self, encodings):
+        """Finds the list that each encoding belongs in.
+
+        :param encodings: An (M, 128) matrix of encodings
+        :type encodings: numpy.ndarray
+        :return: The list of each encoding
+        :rtype: numpy.ndarray
+        """
+        if len(encodings) == 0:
+            return np.empty(0, dtype=np.int32)
+        return self.__nearest_centroids(encodings, self.__centroids, 1)[:, 0].astype(np.int32)
+
+
+    def __nearest_centroids(self, encodings, centroids, count):
+        """Finds the nearest centroids to each encoding.
+
+        :param encodings: An (M, 128) matrix of encodings
+        :type encodings: numpy.ndarray
+        :param centroids: A (K, 128) matrix of centroids
+        :type centroids: numpy.ndarray
+        :param count: How many of the nearest centroids to return
+        :type count: int
+        :return: An (M, count) matrix of centroid indexes, nearest first
+        :rtype: numpy.ndarray
+        """
+        # The |encoding|^2 term is the same for every centroid and so does not
+        # change which centroid is nearest
+        squared = (np.einsum("ij,ij->i", centroids, centroids)
+                   - 2 * (np.asarray(encodings, dtype=np.float32) @ centroids.T))
+        count = min(count, len(centroids))
+        if count == 1:
+            return np.argmin(squared, axis=1).reshape(-1, 1)
+        nearest = np.argpartition(squared, count - 1, axis=1)[:, :count]
+        order = np.take_along_axis(squared, nearest, axis=1).argsort(axis=1)
+        return np.take_along_axis(nearest, order, axis=1)
@@ -0,0 +1,171 @@
+import numpy as np
+
+
+class FaceMatcher:
+    """A class to find which known user a face encoding belongs to.\n
+    The distance from the probe encoding to every known encoding is computed in
+    a single matrix-vector product rather than comparing faces one by one.\n
+    The probe is first compared against the mean encoding (centroid) of each
+    user. Only if that doesn't single out one user is it compared against each
+    user's individual encodings. If an approximate nearest neighbour index is
+    given and lines up with the store, both steps only look at what the index
+    picks out: the centroids of the users that own the candidate encodings,
+    and then the candidate encodings themselves. As most users only have a
+    few images there are nearly as many centroids as encodings, so without
+    the index the centroid step would compare the probe with every user. For
+    a few thousand users looking up the candidates costs more than the
+    comparisons it saves, so the index is only worth building for large
+    galleries.
+
+    :param store: The store of known face encodings
+    :type store: FaceEncodingStore
+    :param index: An optional index used to narrow down the search
+    :type index: FaceIndex
+    :param centroid_margin: How much nearer the nearest centroid has to be
+        than the next nearest for it to be a match without checking individual
+        encodings, or None to never match on centroids
+    :type centroid_margin: float
+    """
+    DEFAULT_TOLERANCE = 0.6
+    """How far apart two encodings can be and still be considered the same face"""
+
+
+    def __init__(self, store, index=None, centroid_margin=0.1):
+        """Constructor method
+        """
+        self.__store = store
+        self.__index = index
+        self.__centroid_margin = centroid_margin
+
+
+    def match(self, encoding, tolerance=DEFAULT_TOLERANCE, top_k=1, exact=False):
+        """Finds the user whose known encodings are closest to an encoding.\n
+        With a top_k of 1 the user with the single nearest encoding is chosen.
+        Otherwise the k nearest encodings within the tolerance vote for the user
+        they belong to and the user with the most votes is chosen, with ties
+        going to the user with the nearest encoding.
+
+        :param encoding: The 128-d encoding of the face to be matched
+        :type encoding: numpy.ndarray
+        :param tolerance: The largest distance that counts as a match
+        :type tolerance: float
+        :param top_k: The number of nearest encodings that vote on the user
+        :type top_k: int
+        :param exact: Whether to compare against every known encoding, skipping
+            the centroids and the index
+        :type exact: boolean
+        :return: The matching username and its distance, or (None, None) if
+            no known encoding is within the tolerance
+        :rtype: tuple
+        """
+        names = self.__store.get_names()
+        rows = None
+        if (not exact
+                and self.__index is not None
+                and self.__index.is_ready(
+                    len(names), self.__store.get_signature())):
+            rows = self.__index.candidates(encoding)
+
+        if not exact and self.__centroid_margin is not None:
+            name, distance = self.__match_centroids(encoding, tolerance, rows)
+            if name is not None:
+                return name, distance
+
+        if rows is not None:
+            names = names[rows]
+        distances = self.distances(encoding, rows)
+        if len(distances) == 0:
+            return None, None
+
+        if top_k <= 1:
+            best = int(np.argmin(distances))
+            if distances[best] > tolerance:
+                return None, None
+            return names[best], float(distances[best])
+
+        # Taking the k nearest encodings and discarding any outside tolerance
+        k = min(top_k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[distances[nearest] <= tolerance]
+        if len(nearest) == 0:
+            return None, None
+
+        # Counting the votes for each user, ordered from nearest to furthest so
+        # that the first user with the most votes is also the nearest
+        nearest = nearest[np.argsort(distances[nearest])]
+        candidates, first, votes = np.unique(
+            names[nearest], return_index=True, return_counts=True)
+        best = np.lexsort((first, -votes))[0]
+        return candidates[best], float(distances[nearest[first[best]]])
+
+
+    def __match_centroids(self, encoding, tolerance, rows=None):
+        """Compares a probe against the centroid of each user and only returns
+        a match if it is clearly nearer to one user than to any other.
+
+        :param encoding: The 128-d encoding of the face to be matched
+        :type encoding: numpy.ndarray
+        :param tolerance: The largest distance that counts as a match
+        :type tolerance: float
+        :param rows: The rows of the store picked out by the index, whose
+            users' centroids are the only ones compared against, or None to
+            compare against every user
+        :type rows: numpy.ndarray
+        :return: The matching username and its distance, or (None, None) if
+            the match is ambiguous
+        :rtype: tuple
+        """
+        names, centroids, squared_norms = self.__store.get_centroids()
+        if rows is not None:
+            # Marking the users that own the candidates in a mask, which is
+            # much quicker than np.unique for a few thousand rows
+            owners = np.zeros(len(names), dtype=bool)
+            owners[self.__store.get_centroid_rows()[rows]] = True
+            users = np.flatnonzero(owners)
+            names = names[users]
+            centroids = centroids[users]
+            squared_norms = squared_norms[users]
+        if len(names) == 0:
+            return None, None
+
+        probe = np.asarray(encoding, dtype=np.float32)
+        squared = squared_norms - 2 * (centroids @ probe) + probe @ probe
+        distances = np.sqrt(np.maximum(squared, 0))
+
+        if len(distances) == 1:
+            best, second = 0, None
+        else:
+            best, second = np.argpartition(distances, 1)[:2]
+        if distances[best] > tolerance:
+            return None, None
+        if second is not None and distances[second] - distances[best] < self.__centroid_margin:
+            return None, None
+        return names[best], float(distances[best])
+
+
+    def distances(self, encoding, rows=None):
+        """Computes the euclidean distance from an encoding to the known
+        encodings.\n
+        This uses the expansion |a - b|^2 = |a|^2 - 2a.b + |b|^2 with the squared
+        norms of the known encodings computed ahead of time.
+
+        :param encoding: The 128-d encoding of the face to be matched
+        :type encoding: numpy.ndarray
+        :param rows: The rows of the store to compare against, or None to
+            compare against every known encoding
+        :type rows: numpy.ndarray
+        :return: An array with the distance to each known encoding compared
+            against
+        :rtype: numpy.ndarray
+        """
+        probe = np.asarray(encoding, dtype=np.float32)
+        known = self.__store.get_encodings()
+        squared_norms = self.__store.get_squared_norms()
+        if rows is not None:
+            known = known[rows]
+            squared_norms = squared_norms[rows]
+        squared = squared_norms - 2 * (known @ probe) + probe @ probe
+        # Rounding errors can make the distance of a near identical encoding
+        # slightly negative
+        np.maximum(squared, 0, out=squared)
+        return np.sqrt(squared, out=squared)
@@ -0,0 +1,129 @@
+import logging, threading
+from concurrent.futures import ProcessPoolExecutor
+from face_recognition_util import FaceRecognitionUtil
+from image_codec import decode_image
+
+_worker_fru = None
+"""The facial recognition util used by each worker process"""
+
+
+class PoolBusyError(Exception):
+    """Raised when a face job is submitted while the pool's queue is full"""
+
+
+class FaceRecognitionPool:
+    """A class to run facial recognition jobs in a pool of worker processes so
+    that they do not hold up the socket server.\n
+    The number of jobs that can be queued or running at once is bounded. When
+    the queue is full new jobs are turned away straight away rather than
+    waiting, and a caller only waits a limited time for its job to finish.\n
+    Images are passed to the workers still encoded as JPEG or PNG and decoded
+    there, so that only the compressed bytes are copied between processes.
+
+    :param workers: The number of worker processes, which defaults to the
+        number of CPUs
+    :type workers: int
+    :param max_pending: The most jobs that can be queued or running at once
+    :type max_pending: int
+    :param timeout: The number of seconds to wait for a job to finish
+    :type timeout: float
+    """
+
+    def __init__(self, workers=None, max_pending=8, timeout=30):
+        """Constructor method
+        """
+        self.__executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker)
+        self.__slots = threading.BoundedSemaphore(max_pending)
+        self.__timeout = timeout
+
+
+    def find_match(self, image):
+        """Determines which user an image belongs to in a worker process.
+
+        :param image: The image of the user's face, encoded as a JPEG or PNG
+        :type image: bytes
+        :raises PoolBusyError: If the pool's queue is full
+        :raises concurrent.futures.TimeoutError: If the job doesn't finish in
+            time
+        :raises ValueError: If the image can't be decoded
+        :return: The username of the match and its distance, or (None, None)
+        :rtype: tuple
+        """
+        return self.submit(_find_match, image).result(self.__timeout)
+
+
+    def encode_image(self, image):
+        """Computes the encoding of the face in an image in a worker process.
+
+        :param image: The image of the user's face, encoded as a JPEG or PNG
+        :type image: bytes
+        :raises PoolBusyError: If the pool's queue is full
+        :raises concurrent.futures.TimeoutError: If the job doesn't finish in
+            time
+        :raises ValueError: If the image can't be decoded
+        :return: The encoding of the face found in the image
+        :rtype: list
+        """
+        return self.submit(_encode_image, image).result(self.__timeout)
+
+
+    def submit(self, function, *args):
+        """Queues a job for the worker processes if there is room for it.
+
+        :param function: A module level function to run in a worker
+        :type function: function
+        :raises PoolBusyError: If the pool's queue is full
+        :return: The future result of the job
+        :rtype: concurrent.futures.Future
+        """
+        if not self.__slots.acquire(blocking=False):
+            logging.warning("face recognition queue is full")
+            raise PoolBusyError("Face recognition queue is full")
+
+        try:
+            future = self.__executor.submit(function, *args)
+        except Exception:
+            self.__slots.release()
+            raise
+        # Freeing the slot once the job has finished, even if nobody waited
+        # for it
+        future.add_done_callback(lambda f: self.__slots.release())
+        return future
+
+
+    def shutdown(self):
+        """Stops the worker processes once their current jobs have finished.
+        """
+        self.__executor.shutdown(wait=True)
+
+
+def _init_worker():
+    """Loads the known faces once when a worker process starts.
+    """
+    global _worker_fru
+    _worker_fru = FaceRecognitionUtil()
+    _worker_fru.load_encodings()
+
+
+def _find_match(image):
+    """Runs in a worker process to determine which user an image belongs to.
+
+    :param image: The image of the user's face, encoded as a JPEG or PNG
+    :type image: bytes
+    :return: The username of the match and its distance, or (None, None)
+    :rtype: tuple
+    """
+    return _worker_fru.find_match(decode_image(image))
+
+
+def _encode_image(image):
+    """Runs in a worker process to compute the encoding of the face in an
+    image.
+
+    :param image: The image of the user's face, encoded as a JPEG or PNG
+    :type image: bytes
+    :return: The encoding of the face found in the image
+    :rtype: list
+    """
+    return _worker_fru.encode_image(decode_image(image))
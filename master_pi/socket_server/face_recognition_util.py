@@ -1,25 +1,98 @@
 ## Acknowledgement
 ## This code is adapted from:
 ## https://www.pyimagesearch.com/2018/06/18/face-recognition-with-opencv-python-and-deep-learning/
-import cv2, face_recognition, imutils, pickle, logging, os
+import cv2, face_recognition, logging, os, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from imutils import paths
+from face_encoding_store import FaceEncodingStore
+from face_index import FaceIndex
+from face_matcher import FaceMatcher
+from probe_preprocessor import ProbePreprocessor
+
+_worker_preprocessor = None
+"""The preprocessor used by encode_image_file in each worker process"""
 
 class FaceRecognitionUtil:
     __DATASET_PATH = "./socket_server/dataset"
-    __ENCODINGS_PATH = "./socket_server/encodings.pickle"
+    __ENCODINGS_PATH = "./socket_server/encodings.bin"
+    __LEGACY_ENCODINGS_PATH = "./socket_server/encodings.pickle"
+    __INDEX_PATH = "./socket_server/encodings.index.npz"
     __DETECTION_METHOD = "hog"
+    __MAX_IMAGES_PER_USER = 5
+    """The number of images of each user's face that are kept"""
+
+    def __init__(self, detection_width=240, largest_face_only=True):
+        """Constructor method
+
+        :param detection_width: The width that login images are scaled down to
+            for face detection, or None to detect at full resolution
+        :type detection_width: int
+        :param largest_face_only: Whether only the largest face in a login
+            image is matched
+        :type largest_face_only: boolean
+        """
+        self.__preprocessor = ProbePreprocessor(
+            detection_width, largest_face_only, self.__DETECTION_METHOD)
+        # Enrollment images are detected at full resolution and should only
+        # contain the user being enrolled
+        self.__enrollment_preprocessor = ProbePreprocessor(
+            None, True, self.__DETECTION_METHOD)
+        self.__store = FaceEncodingStore(
+            self.__ENCODINGS_PATH, self.__LEGACY_ENCODINGS_PATH)
+        self.__index = FaceIndex(self.__INDEX_PATH)
+        self.__matcher = FaceMatcher(self.__store, self.__index)
+
+    def load_encodings(self):
+        """Loads the known face encodings into memory so that they do not have
+        to be read from disk on every login, along with the index over them if
+        one has been built.
+        """
+        self.__store.load()
+        self.__index.reload_if_changed()
+
+    def build_index(self):
+        """Builds an approximate nearest neighbour index over the known face
+        encodings and saves it next to them. Once built the index is kept up to
+        date as faces are added.
+        """
+        logging.info("build_index() called")
+
+        # Holding the lock so that a face added by a server while the index is
+        # being built can't be left out of it
+        with self.__store.lock():
+            self.__store.reload_if_changed()
+            if len(self.__store) == 0:
+                logging.warning("no encodings to index")
+                return
+            self.__index.build(
+                self.__store.get_encodings(), self.__store.get_signature())
+            self.__index.save()
 
-    def add_face(self, username, image):
+    def add_face(self, username, image, encodings=None):
         """Saves an image to the dataset in the folder that corresponds to that
-        user's username
+        user's username and adds it to that user's encodings.\n
+        Each user keeps several images, with the oldest being removed once there
+        are too many. Only the new image is encoded, the rest of the known
+        encodings are left as they are.
 
         :param username: The user's username
         :type username: string
         :param image: The image of the user's face to be sent
         :type image: numpy.ndarray
+        :param encodings: The encoding of the face in the image if it has
+            already been computed
+        :type encodings: list
         """
         logging.info("add_face() called")
 
+        # Encoding only the new face, which is not kept if there is no face in
+        # it
+        if encodings is None:
+            encodings = self.encode_image(image)
+        if len(encodings) == 0:
+            logging.warning("no face found in image for {}".format(username))
+            return
+
         # Folder to store user images
         folder = self.__DATASET_PATH + "/{}".format(username)
 
@@ -28,111 +101,205 @@ class FaceRecognitionUtil:
             os.makedirs(folder)
             logging.info("created folder {}".format(folder))
 
-        # Saving
-        img_name = "{}/face.jpg".format(folder)
+        # Saving, named by time so that the user's images sort oldest first
+        img_name = "{}/face_{}.jpg".format(folder, time.time_ns())
         cv2.imwrite(img_name, image)
         logging.info("created file {}".format(img_name))
 
-    def encode_faces(self):
-        """Scans all the faces in the dataset and encodes them into a .pickles
-        file to be accessed later.
+        # Removing the user's oldest images
+        images = sorted(paths.list_images(folder))
+        for old_image in images[:-self.__MAX_IMAGES_PER_USER]:
+            os.remove(old_image)
+            logging.info("removed file {}".format(old_image))
+
+        # Adding the new face to the user's encodings, while holding the lock
+        # as other server processes may be adding faces too
+        with self.__store.lock():
+            self.__store.reload_if_changed()
+            self.__index.reload_if_changed()
+            indexed = self.__index.is_ready(
+                len(self.__store), self.__store.get_signature())
+            kept = self.__store.add_user_encodings(
+                username, encodings, self.__MAX_IMAGES_PER_USER)
+            self.__store.save()
+
+            # Updating the index in place of rebuilding it if one is being used
+            if indexed:
+                self.__index.keep(kept)
+                self.__index.add(self.__store.get_encodings()[kept.sum():],
+                                 self.__store.get_signature())
+                self.__index.save()
+
+    def encode_image(self, image):
+        """Detects the largest face in an image of a user and computes its
+        facial embedding.
+
+        :param image: An image in OpenCV (BGR) ordering
+        :type image: numpy.ndarray
+        :return: The encoding of the face found in the image, or an empty list
+            if there is no face
+        :rtype: list
+        """
+        # convert the input image from BGR (OpenCV ordering) to dlib ordering
+        # (RGB) and detect the (x, y)-coordinates of the bounding box
+        # corresponding to the face in the input image
+        rgb, boxes = self.__enrollment_preprocessor.prepare(image)
+
+        # compute the facial embedding for the face
+        return face_recognition.face_encodings(rgb, boxes)
+
+    def encode_faces(self, workers=None):
+        """Scans all the faces in the dataset and encodes them into the
+        encodings file to be accessed later.\n
+        This rebuilds every encoding from scratch and is slow for a large
+        dataset, so it is meant to be run offline rather than by the server.
+        The images are spread across a pool of worker processes and their
+        encodings are written to the encodings file in whatever order they
+        finish.
+
+        :param workers: The number of worker processes, which defaults to the
+            number of CPUs. With 1 worker the images are encoded in this
+            process.
+        :type workers: int
         """
         logging.info("encode_faces() called")
 
         # grab the paths to the input images in our dataset
         imagePaths = list(paths.list_images(self.__DATASET_PATH))
-        # initialize the list of known encodings and known names
-        knownEncodings = []
-        knownNames = []
 
-        # loop over the image paths
-        for (i, imagePath) in enumerate(imagePaths):
-            # extract the person name from the image path
-            logging.info("processing image {}/{}".format(i + 1, len(imagePaths)))
-            name = imagePath.split(os.path.sep)[-2]
+        # the encodings are written to the encodings file as they are produced
+        # rather than being collected in memory first
+        start_time = time.perf_counter()
+        if workers == 1 or len(imagePaths) <= 1:
+            _init_encoding_worker(self.__DETECTION_METHOD)
+            results = ((path, encode_image_file(path)) for path in imagePaths)
+            self.__store.write(self.__name_encodings(results, len(imagePaths)))
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_encoding_worker,
+                    initargs=(self.__DETECTION_METHOD,)) as executor:
+                futures = {
+                    executor.submit(encode_image_file, path): path
+                    for path in imagePaths
+                }
+                results = ((futures[future], future.result())
+                           for future in as_completed(futures))
+                self.__store.write(self.__name_encodings(results, len(imagePaths)))
 
-            # load the input image and convert it from RGB (OpenCV ordering)
-            # to dlib ordering (RGB)
-            image = cv2.imread(imagePath)
-            rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        elapsed = time.perf_counter() - start_time
+        logging.info("encoded {} images in {:.1f}s ({:.1f} images/sec)".format(
+            len(imagePaths), elapsed, len(imagePaths) / max(elapsed, 1e-9)))
 
-            # detect the (x, y)-coordinates of the bounding boxes
-            # corresponding to each face in the input image
-            boxes = face_recognition.face_locations(rgb, model = self.__DETECTION_METHOD)
+        # the index no longer lines up with the encodings and so is rebuilt
+        if self.__index.exists():
+            self.build_index()
 
-            # compute the facial embedding for the face
-            encodings = face_recognition.face_encodings(rgb, boxes)
+    def __name_encodings(self, results, total):
+        """Pairs the encodings of each image with the name of the user it
+        belongs to as they are produced.
 
-            # loop over the encodings
-            for encoding in encodings:
-                # add each encoding + name to our set of known names and encodings
-                knownEncodings.append(encoding)
-                knownNames.append(name)
+        :param results: Pairs of an image path and the encodings found in it
+        :type results: iterable
+        :param total: The number of images being encoded
+        :type total: int
+        :return: Pairs of a username and the encodings found in one image
+        :rtype: generator
+        """
+        start_time = time.perf_counter()
+        for (i, (imagePath, encodings)) in enumerate(results):
+            # extract the person name from the image path
+            name = imagePath.split(os.path.sep)[-2]
+            elapsed = time.perf_counter() - start_time
+            logging.info("processed image {}/{} ({:.1f} images/sec)".format(
+                i + 1, total, (i + 1) / max(elapsed, 1e-9)))
+            yield name, encodings
 
-        # dump the facial encodings + names to disk
-        logging.info("serializing encodings...")
-        data = { "encodings": knownEncodings, "names": knownNames }
+    def get_store(self):
+        """Returns the store of known face encodings.
 
-        with open(self.__ENCODINGS_PATH, "wb") as f:
-            f.write(pickle.dumps(data))
+        :return: The encodings store
+        :rtype: FaceEncodingStore
+        """
+        return self.__store
 
-    def recognise_face(self, image):
+    def recognise_face(self, image, tolerance=FaceMatcher.DEFAULT_TOLERANCE):
         """Looks through the encoded dataset and determines which user the
         passed in image belongs to.
 
         :param image: The omage of the user's face to be sent
         :type image: numpy.ndarray
+        :param tolerance: The largest distance that counts as a match
+        :type tolerance: float
         :return: The username of the first match
         :rtype: string
         """
-        # load the known faces and embeddings
-        logging.info("loading encodings...")
-        data = pickle.loads(open(self.__ENCODINGS_PATH, "rb").read())
-
-        # convert the input frame from BGR to RGB then resize it to have
-        # a width of 750px (to speedup processing)
-        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        rgb = imutils.resize(image, width = 240)
-
-        # detect the (x, y)-coordinates of the bounding boxes
-        # corresponding to each face in the input frame, then compute
-        # the facial embeddings for each face
-        boxes = face_recognition.face_locations(rgb, model = self.__DETECTION_METHOD)
+        name, distance = self.find_match(image, tolerance)
+        return name
+
+    def find_match(self, image, tolerance=FaceMatcher.DEFAULT_TOLERANCE, top_k=1):
+        """Determines which user the passed in image belongs to and how close
+        the match is.
+
+        :param image: The image of the user's face
+        :type image: numpy.ndarray
+        :param tolerance: The largest distance that counts as a match
+        :type tolerance: float
+        :param top_k: The number of nearest encodings that vote on the user,
+            with 1 picking the single nearest encoding
+        :type top_k: int
+        :return: The username of the first match and its distance, where a
+            smaller distance is a more confident match, or (None, None)
+        :rtype: tuple
+        """
+        # make sure the known faces and embeddings in memory are up to date
+        # with the encodings file
+        self.__store.reload_if_changed()
+        self.__index.reload_if_changed()
+
+        # convert the input frame from BGR to RGB and detect the faces on a
+        # scaled down copy (to speedup processing), then compute the facial
+        # embeddings for each face at full resolution
+        rgb, boxes = self.__preprocessor.prepare(image)
         encodings = face_recognition.face_encodings(rgb, boxes)
-        names = []
 
-        # loop over the facial embeddings
+        # loop over the facial embeddings and return the first face that
+        # matches a known user
         for encoding in encodings:
-            # attempt to match each face in the input image to our known
-            # encodings
-            matches = face_recognition.compare_faces(data["encodings"], encoding)
-            name = "Unknown"
-
-            # check to see if we have found a match
-            if True in matches:
-                # find the indexes of all matched faces then initialize a
-                # dictionary to count the total number of times each face
-                # was matched
-                matchedIdxs = [i for (i, b) in enumerate(matches) if b]
-                counts = {}
-
-                # loop over the matched indexes and maintain a count for
-                # each recognized face face
-                for i in matchedIdxs:
-                    name = data["names"][i]
-                    counts[name] = counts.get(name, 0) + 1
-
-                # determine the recognized face with the largest number
-                # of votes (note: in the event of an unlikely tie Python
-                # will select first entry in the dictionary)
-                name = max(counts, key = counts.get)
-
-            # update the list of names
-            names.append(name)
-
-        # loop over the recognized faces
-        for name in names:
-            # print to console, identified person
-            logging.info("Person found: {}".format(name))
-            return name
+            name, distance = self.__matcher.match(encoding, tolerance, top_k)
+            if name is not None:
+                # print to console, identified person
+                logging.info("Person found: {} (distance {:.3f})".format(name, distance))
+                return name, distance
         logging.info("No match found")
+        return None, None
+
+
+def _init_encoding_worker(detection_method):
+    """Creates the preprocessor that encode_image_file uses once when a worker
+    process starts, rather than once for every image.
+
+    :param detection_method: The face detection model, either "hog" or "cnn"
+    :type detection_method: string
+    """
+    global _worker_preprocessor
+    # Enrollment images are detected at full resolution and should only
+    # contain the user being enrolled
+    _worker_preprocessor = ProbePreprocessor(None, True, detection_method)
+
+
+def encode_image_file(image_path):
+    """Loads an image from the dataset and encodes the faces in it.\n
+    This is a module level function so that it can be sent to worker
+    processes, which must have been started with _init_encoding_worker.
+
+    :param image_path: The path to the image
+    :type image_path: string
+    :return: The encoding of each face found in the image
+    :rtype: list
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        logging.warning("could not read {}".format(image_path))
+        return []
+    rgb, boxes = _worker_preprocessor.prepare(image)
+    return face_recognition.face_encodings(rgb, boxes)
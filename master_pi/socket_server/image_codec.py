@@ -0,0 +1,17 @@
+import cv2
+import numpy as np
+
+
+def decode_image(data):
+    """Decodes an image that was sent by an Agent Pi as a JPEG or PNG.
+
+    :param data: The encoded image
+    :type data: bytes
+    :raises ValueError: If the data isn't an image that OpenCV can decode
+    :return: The image in OpenCV (BGR) ordering
+    :rtype: numpy.ndarray
+    """
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Received data is not a valid image")
+    return image
@@ -0,0 +1,137 @@
+import asyncio, logging
+
+
+class PositionBuffer:
+    """A class to collect the positions that cars stream to the server and
+    save only the latest position of each car every so often.\n
+    Cars may send their position many times a second, and saving every one
+    would mean a database write for each. Instead each position replaces the
+    car's last one in memory, and every interval the positions of the cars
+    that have moved are saved together in one batched update. A position that
+    is older than the one already held, such as one sent before the car
+    reconnected, is ignored. If saving fails the positions are kept to be
+    saved with the next batch.\n
+    The buffer is only used from the event loop, so it needs no locking.
+
+    :param save: Coroutine function that is called with the latest position
+        of each car, a dict of car id to a tuple of its latitude and longitude
+        in millionths of a degree and its Unix time, and saves them
+    :type save: function
+    :param interval: The seconds between saves
+    :type interval: float
+    """
+
+    def __init__(self, save, interval):
+        """Constructor method
+        """
+        self.__save = save
+        self.__interval = interval
+        self.__positions = {}
+        self.__saver = None
+        self.__received = 0
+        self.__coalesced = 0
+        self.__saved = 0
+        self.__failed = 0
+
+
+    def start(self):
+        """Starts saving the positions every interval.
+        """
+        self.__saver = asyncio.get_running_loop().create_task(
+            self.__save_periodically())
+
+
+    async def stop(self):
+        """Stops saving the positions every interval and saves the ones that
+        haven't been saved yet.
+        """
+        if self.__saver is not None:
+            self.__saver.cancel()
+            try:
+                await self.__saver
+            except asyncio.CancelledError:
+                pass
+            self.__saver = None
+        await self.flush()
+
+
+    def record(self, car_id, latitude, longitude, timestamp):
+        """Keeps a car's position until the next save, replacing the position
+        it last sent unless that one is newer.
+
+        :param car_id: The id of the car
+        :type car_id: int
+        :param latitude: The car's latitude in millionths of a degree
+        :type latitude: int
+        :param longitude: The car's longitude in millionths of a degree
+        :type longitude: int
+        :param timestamp: The Unix time that the car was there
+        :type timestamp: int
+        """
+        self.__received += 1
+        last = self.__positions.get(car_id)
+        if last is not None:
+            self.__coalesced += 1
+            if last[2] > timestamp:
+                return
+        self.__positions[car_id] = (latitude, longitude, timestamp)
+
+
+    async def flush(self):
+        """Saves the latest position of every car that has sent one since the
+        last save.
+
+        :return: The number of cars whose positions were saved
+        :rtype: int
+        """
+        positions, self.__positions = self.__positions, {}
+        if not positions:
+            return 0
+        try:
+            await self.__save(positions)
+        except Exception:
+            self.__failed += 1
+            logging.exception("Error saving the positions of {} cars".format(
+                len(positions)))
+            # Keeping the positions for the next save, unless the cars have
+            # sent newer ones since
+            for car_id, position in positions.items():
+                last = self.__positions.get(car_id)
+                if last is None or last[2] < position[2]:
+                    self.__positions[car_id] = position
+            return 0
+        self.__saved += len(positions)
+        return len(positions)
+
+
+    async def __save_periodically(self):
+        """Saves the positions every interval until the buffer is stopped.
+        """
+        while True:
+            await asyncio.sleep(self.__interval)
+            await self.flush()
+
+
+    def get_positions(self):
+        """Returns the positions that haven't been saved yet.
+
+        :return: The latitude, longitude and Unix time of each car, by its id
+        :rtype: dict
+        """
+        return self.__positions
+
+
+    def get_stats(self):
+        """Returns counts of the positions that cars have sent.
+
+        :return: The number of positions received, the number that replaced
+            one that hadn't been saved yet, the number saved and the number of
+            saves that failed
+        :rtype: dict
+        """
+        return {
+            "received": self.__received,
+            "coalesced": self.__coalesced,
+            "saved": self.__saved,
+            "failed": self.__failed
+        }
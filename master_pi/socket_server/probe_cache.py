@@ -0,0 +1,122 @@
+import hashlib, threading, time
+from collections import OrderedDict
+import numpy as np
+
+
+class ProbeCache:
+    """A class to remember the result of recognising recently sent login
+    images (probes), so that an image that is sent again is not recognised
+    again.\n
+    Results are looked up by a hash of the image's contents. The least recently
+    used result is dropped once the cache is full, results expire after a time
+    limit and every result is dropped when the known encodings change.
+
+    :param max_size: The most results that are remembered
+    :type max_size: int
+    :param ttl: The number of seconds a result is remembered for
+    :type ttl: float
+    """
+
+    def __init__(self, max_size=256, ttl=60):
+        """Constructor method
+        """
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__entries = OrderedDict()
+        self.__generation = None
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+
+    def key(self, image):
+        """Computes the key that an image's result is remembered under.
+
+        :param image: The image of the user's face
+        :type image: numpy.ndarray
+        :return: A hash of the image's shape, type and pixels
+        :rtype: bytes
+        """
+        image = np.ascontiguousarray(image)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("{}{}".format(image.shape, image.dtype).encode())
+        digest.update(image.data)
+        return digest.digest()
+
+
+    def get(self, key, generation):
+        """Looks up a remembered result.
+
+        :param key: The key of the image
+        :type key: bytes
+        :param generation: Identifies the current version of the known
+            encodings, and if it has changed every result is dropped
+        :type generation: object
+        :return: The remembered result, or None if there isn't one
+        :rtype: object
+        """
+        with self.__lock:
+            self.__check_generation(generation)
+            entry = self.__entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                del self.__entries[key]
+                entry = None
+            if entry is None:
+                self.__misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return entry[0]
+
+
+    def put(self, key, generation, result):
+        """Remembers the result for an image.
+
+        :param key: The key of the image
+        :type key: bytes
+        :param generation: The version of the known encodings the result was
+            found with
+        :type generation: object
+        :param result: The result to remember
+        :type result: object
+        """
+        with self.__lock:
+            self.__check_generation(generation)
+            self.__entries[key] = (result, time.monotonic() + self.__ttl)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+
+    def clear(self):
+        """Drops every remembered result.
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+
+    def get_stats(self):
+        """Returns how well the cache is performing.
+
+        :return: The number of hits, misses and remembered results
+        :rtype: dict
+        """
+        with self.__lock:
+            return {
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "size": len(self.__entries)
+            }
+
+
+    def __check_generation(self, generation):
+        """Drops every result if the known encodings have changed. The lock
+        must be held when this is called.
+
+        :param generation: The current version of the known encodings
+        :type generation: object
+        """
+        if generation != self.__generation:
+            self.__entries.clear()
+            self.__generation = generation
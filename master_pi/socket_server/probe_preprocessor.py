@@ -0,0 +1,76 @@
+import cv2, face_recognition, imutils
+
+
+class ProbePreprocessor:
+    """A class to prepare a login image (a probe) for facial recognition.\n
+    The image is converted to RGB once. Faces are detected on a copy that has
+    been scaled down to a target width, which is where most of the time is
+    spent, and the boxes that are found are mapped back onto the full size
+    image so that the embeddings are computed at full resolution.
+
+    :param detection_width: The width that images are scaled down to for face
+        detection, or None to detect at full resolution
+    :type detection_width: int
+    :param largest_face_only: Whether only the largest face in the image is
+        kept
+    :type largest_face_only: boolean
+    :param detection_method: The face detection model, either "hog" or "cnn"
+    :type detection_method: string
+    """
+
+    def __init__(self, detection_width=240, largest_face_only=True,
+                 detection_method="hog"):
+        """Constructor method
+        """
+        self.__detection_width = detection_width
+        self.__largest_face_only = largest_face_only
+        self.__detection_method = detection_method
+
+
+    def prepare(self, image):
+        """Converts an image to RGB and finds the faces in it.
+
+        :param image: An image in OpenCV (BGR) ordering
+        :type image: numpy.ndarray
+        :return: The full size RGB image and the (top, right, bottom, left)
+            boxes of the faces in it
+        :rtype: tuple
+        """
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        height, width = rgb.shape[:2]
+
+        # Only scaling down, as scaling up would slow detection down
+        if self.__detection_width is not None and width > self.__detection_width:
+            small = imutils.resize(rgb, width=self.__detection_width)
+        else:
+            small = rgb
+        scale = width / small.shape[1]
+
+        boxes = face_recognition.face_locations(small, model=self.__detection_method)
+        boxes = [self.__scale_box(box, scale, width, height) for box in boxes]
+
+        if self.__largest_face_only and len(boxes) > 1:
+            boxes = [max(boxes, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))]
+
+        return rgb, boxes
+
+
+    def __scale_box(self, box, scale, width, height):
+        """Maps a box found on the scaled down image onto the full size image.
+
+        :param box: The (top, right, bottom, left) box of a face
+        :type box: tuple
+        :param scale: How many times larger the full size image is
+        :type scale: float
+        :param width: The width of the full size image
+        :type width: int
+        :param height: The height of the full size image
+        :type height: int
+        :return: The (top, right, bottom, left) box on the full size image
+        :rtype: tuple
+        """
+        top, right, bottom, left = box
+        return (max(0, int(round(top * scale))),
+                min(width, int(round(right * scale))),
+                min(height, int(round(bottom * scale))),
+                max(0, int(round(left * scale))))
@@ -0,0 +1,568 @@
+import asyncio, json, socket, struct
+
+HEADER = struct.Struct("!BI")
+"""The header sent before every message: its type and the length of its
+payload in bytes"""
+MAX_PAYLOAD = 16 * 1024 * 1024
+"""The largest payload that is accepted, so that a bad header can't make the
+server allocate an unbounded buffer"""
+
+TEXT = 1
+"""A utf-8 string, such as an instruction or an acknowledgement"""
+JSON = 2
+"""A utf-8 JSON document"""
+IMAGE = 3
+"""An image encoded as a JPEG or PNG"""
+REQUEST = 4
+"""A command along with its request id, details and any image, see
+encode_request"""
+RESPONSE = 5
+"""The reply to a request, starting with the request's id"""
+PING = 6
+"""A heartbeat sent by an idle Agent Pi to show that it is still there"""
+PONG = 7
+"""The reply to a heartbeat"""
+COMMAND = 8
+"""A command given by its opcode along with its request id, details and any
+image, see encode_command"""
+REGISTER = 9
+"""Sent by an Agent Pi once it has connected, giving the id of its car so
+that events can be pushed to it"""
+EVENT = 10
+"""An event pushed to an Agent Pi, such as its booking being cancelled, see
+encode_event"""
+ACK = 11
+"""Sent by an Agent Pi once it has handled an event, holding the event's id,
+see decode_ack"""
+TELEMETRY = 12
+"""The position of an Agent Pi's car, sent often and without a response, see
+decode_telemetry"""
+
+LOGIN = 1
+"""The opcode of logging in with a username and password"""
+LOGIN_WITH_FACE = 2
+"""The opcode of logging in with an image of the user's face"""
+LOGIN_WITH_BLUETOOTH = 3
+"""The opcode of logging in with a registered Bluetooth device"""
+CHANGE_LOCK_STATUS = 4
+"""The opcode of unlocking or returning a car"""
+CHANGE_CAR_LOCATION = 5
+"""The opcode of updating a car's location"""
+ADD_FACE = 6
+"""The opcode of adding an image of a user's face"""
+ADD_BLUETOOTH = 7
+"""The opcode of registering a user's Bluetooth device"""
+OPCODES = {
+    "Login": LOGIN,
+    "Login With Face": LOGIN_WITH_FACE,
+    "Login With Bluetooth": LOGIN_WITH_BLUETOOTH,
+    "Change Lock Status": CHANGE_LOCK_STATUS,
+    "Change Car Location": CHANGE_CAR_LOCATION,
+    "Add Face": ADD_FACE,
+    "Add Bluetooth": ADD_BLUETOOTH
+}
+"""The opcode of each command by its name"""
+
+REQUEST_HEADER = struct.Struct("!IHI")
+"""The start of a request's payload: its id, the length of the command's name
+and the length of its JSON details. The name, the details and then any image
+follow"""
+COMMAND_HEADER = struct.Struct("!IBI")
+"""The start of a command's payload: its request id, its opcode and the length
+of its JSON details. The details and then any image follow"""
+RESPONSE_HEADER = struct.Struct("!I")
+"""The start of a response's payload: the id of the request it answers. The
+body of the response follows"""
+REGISTER_PAYLOAD = struct.Struct("!I")
+"""The payload of a registration: the id of the Agent Pi's car"""
+EVENT_HEADER = struct.Struct("!I")
+"""The start of an event's payload: its id. The event follows as a JSON
+document"""
+ACK_PAYLOAD = struct.Struct("!I")
+"""The payload of an acknowledgement: the id of the event that was handled"""
+TELEMETRY_PAYLOAD = struct.Struct("!IiiI")
+"""The payload of a position: the id of the car, its latitude and longitude in
+millionths of a degree and the Unix time in seconds that it was there"""
+LOCATION_SCALE = 1000000
+"""The number of units of a position's latitude and longitude in a degree"""
+
+
+class FrameError(Exception):
+    """Raised when a message doesn't follow the framing protocol"""
+
+
+def encode_header(message_type, length):
+    """Creates the header for a message.
+
+    :param message_type: The type of the message
+    :type message_type: int
+    :param length: The length of the message's payload in bytes
+    :type length: int
+    :raises FrameError: If the payload is too large to send
+    :return: The header
+    :rtype: bytes
+    """
+    if length > MAX_PAYLOAD:
+        raise FrameError("Payload of {} bytes is too large".format(length))
+    return HEADER.pack(message_type, length)
+
+
+def set_keepalive(sock, idle, interval, count):
+    """Turns on TCP keepalive for a socket, so that a peer that has gone away
+    without closing the connection is noticed by the operating system even
+    while nothing is being sent.
+
+    :param sock: The socket
+    :type sock: socket
+    :param idle: Seconds without any traffic before the first probe is sent
+    :type idle: int
+    :param interval: Seconds between probes
+    :type interval: int
+    :param count: The number of unanswered probes before the connection is
+        dropped
+    :type count: int
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # These options aren't available on every platform, in which case the
+    # operating system's defaults are used
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, "TCP_KEEPCNT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+
+
+def encode_request(request_id, command, message=None, image=b""):
+    """Creates the payload of a request, so that a command is sent in a single
+    message.
+
+    :param request_id: The id that the response will carry
+    :type request_id: int
+    :param command: The name of the command, such as "Login"
+    :type command: string
+    :param message: The details of the request
+    :type message: dict
+    :param image: An image encoded as a JPEG or PNG to send with the request
+    :type image: bytes
+    :return: The payload
+    :rtype: bytes
+    """
+    command = command.encode()
+    document = json.dumps(message).encode() if message is not None else b""
+    return b"".join([
+        REQUEST_HEADER.pack(request_id, len(command), len(document)),
+        command,
+        document,
+        image])
+
+
+def decode_request(payload):
+    """Splits the payload of a request into its parts.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload is too short for the lengths it holds
+        or its command or details can't be decoded
+    :return: The request id, command, details (an empty dict if there are
+        none) and image (empty if there isn't one)
+    :rtype: tuple
+    """
+    if len(payload) < REQUEST_HEADER.size:
+        raise FrameError("Request is too short")
+    request_id, command_length, document_length = \
+        REQUEST_HEADER.unpack_from(payload)
+    start = REQUEST_HEADER.size
+    if len(payload) < start + command_length + document_length:
+        raise FrameError("Request is too short")
+
+    view = memoryview(payload)
+    try:
+        command = str(view[start:start + command_length], "utf-8")
+    except ValueError as error:
+        raise FrameError("Request could not be decoded: {}".format(error))
+    message, image = decode_details(view, start + command_length, document_length)
+    return request_id, command, message, image
+
+
+def encode_command(request_id, opcode, message=None, image=b""):
+    """Creates the payload of a command, which is a request that names its
+    command by opcode instead of by name.
+
+    :param request_id: The id that the response will carry
+    :type request_id: int
+    :param opcode: The opcode of the command, such as LOGIN
+    :type opcode: int
+    :param message: The details of the request
+    :type message: dict
+    :param image: An image encoded as a JPEG or PNG to send with the request
+    :type image: bytes
+    :return: The payload
+    :rtype: bytes
+    """
+    document = json.dumps(message).encode() if message is not None else b""
+    return b"".join([
+        COMMAND_HEADER.pack(request_id, opcode, len(document)),
+        document,
+        image])
+
+
+def decode_command(payload):
+    """Splits the payload of a command into its parts.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload is too short for the length it holds
+        or its details can't be decoded
+    :return: The request id, opcode, details (an empty dict if there are none)
+        and image (empty if there isn't one)
+    :rtype: tuple
+    """
+    if len(payload) < COMMAND_HEADER.size:
+        raise FrameError("Command is too short")
+    request_id, opcode, document_length = COMMAND_HEADER.unpack_from(payload)
+    if len(payload) < COMMAND_HEADER.size + document_length:
+        raise FrameError("Command is too short")
+    message, image = decode_details(
+        memoryview(payload), COMMAND_HEADER.size, document_length)
+    return request_id, opcode, message, image
+
+
+def decode_details(view, start, document_length):
+    """Decodes the JSON details and image that end a request or command.
+
+    :param view: The payload
+    :type view: memoryview
+    :param start: Where the details start in the payload
+    :type start: int
+    :param document_length: The length of the details
+    :type document_length: int
+    :raises FrameError: If the details can't be decoded
+    :return: The details (an empty dict if there are none) and the image
+        (empty if there isn't one)
+    :rtype: tuple
+    """
+    try:
+        document = view[start:start + document_length]
+        message = json.loads(bytes(document)) if document_length else {}
+    except ValueError as error:
+        raise FrameError("Request could not be decoded: {}".format(error))
+    return message, bytes(view[start + document_length:])
+
+
+def encode_response(request_id, body):
+    """Creates the payload of a response.
+
+    :param request_id: The id of the request that is answered
+    :type request_id: int
+    :param body: The body of the response
+    :type body: bytes
+    :return: The payload
+    :rtype: bytes
+    """
+    return RESPONSE_HEADER.pack(request_id) + body
+
+
+def decode_response(payload):
+    """Splits the payload of a response into the id of the request it answers
+    and its body.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload is too short
+    :return: The request id and body
+    :rtype: tuple
+    """
+    if len(payload) < RESPONSE_HEADER.size:
+        raise FrameError("Response is too short")
+    return (RESPONSE_HEADER.unpack_from(payload)[0],
+            bytes(payload[RESPONSE_HEADER.size:]))
+
+
+def decode_register(payload):
+    """Reads the id of the car from the payload of a registration.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload isn't the right size
+    :return: The car's id
+    :rtype: int
+    """
+    if len(payload) != REGISTER_PAYLOAD.size:
+        raise FrameError("Registration is the wrong size")
+    return REGISTER_PAYLOAD.unpack(payload)[0]
+
+
+def encode_event(event_id, event):
+    """Creates the payload of an event to push to an Agent Pi.
+
+    :param event_id: The id of the event
+    :type event_id: int
+    :param event: The event, holding its type and details
+    :type event: dict
+    :return: The payload
+    :rtype: bytes
+    """
+    return EVENT_HEADER.pack(event_id) + json.dumps(event).encode()
+
+
+def decode_ack(payload):
+    """Reads the id of the event that an acknowledgement is for.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload isn't the right size
+    :return: The event's id
+    :rtype: int
+    """
+    if len(payload) != ACK_PAYLOAD.size:
+        raise FrameError("Acknowledgement is the wrong size")
+    return ACK_PAYLOAD.unpack(payload)[0]
+
+
+def decode_telemetry(payload):
+    """Reads the position of a car from the payload of a position.
+
+    :param payload: The payload
+    :type payload: bytes
+    :raises FrameError: If the payload isn't the right size or the latitude
+        or longitude is out of range
+    :return: The car's id, its latitude and longitude in millionths of a
+        degree and the Unix time that it was there
+    :rtype: tuple
+    """
+    if len(payload) != TELEMETRY_PAYLOAD.size:
+        raise FrameError("Position is the wrong size")
+    car_id, latitude, longitude, timestamp = TELEMETRY_PAYLOAD.unpack(payload)
+    if (abs(latitude) > 90 * LOCATION_SCALE
+            or abs(longitude) > 180 * LOCATION_SCALE):
+        raise FrameError("Position is out of range")
+    return car_id, latitude, longitude, timestamp
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """An asyncio protocol that splits the data received from an Agent Pi
+    into messages (frames).\n
+    Every frame is a fixed size header holding the message's type and the
+    length of its payload, followed by exactly that many bytes of payload. The
+    header is received into a buffer that is reused for every frame and the
+    payload straight into a buffer of exactly its size, so frames of any size
+    are received without scanning for delimiters or joining chunks.\n
+    Received frames are queued for the Connection that reads them, and reading
+    from the socket is paused while too many frames are queued.
+
+    :param client_connected: Coroutine function that is called with this
+        protocol once an Agent Pi connects
+    :type client_connected: function
+    :param max_queued: The most received frames that are queued before reading
+        is paused
+    :type max_queued: int
+    """
+
+    def __init__(self, client_connected, max_queued=8):
+        """Constructor method
+        """
+        self.__client_connected = client_connected
+        self.__max_queued = max_queued
+        self.__transport = None
+        self.__task = None
+        self.__frames = asyncio.Queue()
+        self.__paused = False
+        self.__can_write = asyncio.Event()
+        self.__can_write.set()
+        self.__closed = asyncio.get_running_loop().create_future()
+        self.__last_received = asyncio.get_running_loop().time()
+
+        self.__header = bytearray(HEADER.size)
+        self.__expect_header()
+
+
+    def connection_made(self, transport):
+        """Starts serving the Agent Pi that has connected.
+
+        :param transport: The transport for the Agent Pi's socket
+        :type transport: asyncio.Transport
+        """
+        self.__transport = transport
+        self.__last_received = asyncio.get_running_loop().time()
+        self.__task = asyncio.get_running_loop().create_task(
+            self.__client_connected(self))
+
+
+    def get_buffer(self, sizehint):
+        """Returns the part of the current frame that is still to be received,
+        for the socket to be read into.
+
+        :param sizehint: The number of bytes that the transport suggests
+        :type sizehint: int
+        :return: The unfilled part of the current buffer
+        :rtype: memoryview
+        """
+        return self.__view[self.__received:]
+
+
+    def buffer_updated(self, nbytes):
+        """Handles bytes that have been received into the current buffer,
+        moving on to the payload once the header is complete and queueing the
+        frame once the payload is complete.
+
+        :param nbytes: The number of bytes received
+        :type nbytes: int
+        """
+        self.__received += nbytes
+        self.__last_received = asyncio.get_running_loop().time()
+        if self.__received < len(self.__view):
+            return
+
+        if self.__message_type is None:
+            message_type, length = HEADER.unpack(self.__header)
+            if length > MAX_PAYLOAD:
+                self.__frames.put_nowait(FrameError(
+                    "Payload of {} bytes is too large".format(length)))
+                self.__expect_header()
+                self.__transport.close()
+                return
+            self.__message_type = message_type
+            self.__payload = bytearray(length)
+            self.__view = memoryview(self.__payload)
+            self.__received = 0
+            if length > 0:
+                return
+
+        self.__frames.put_nowait((self.__message_type, self.__payload))
+        self.__expect_header()
+        if self.__frames.qsize() >= self.__max_queued and not self.__paused:
+            self.__paused = True
+            self.__transport.pause_reading()
+
+
+    def eof_received(self):
+        """Lets the transport close once the Agent Pi has finished sending.
+        """
+        return False
+
+
+    def connection_lost(self, exc):
+        """Wakes up anything waiting on the connection once it has closed.
+
+        :param exc: The error that closed the connection, or None if it closed
+            normally
+        :type exc: Exception
+        """
+        if exc is not None:
+            # Such as a keepalive probe going unanswered
+            self.__frames.put_nowait(exc)
+        elif self.__message_type is not None or self.__received > 0:
+            # The Agent Pi went away part of the way through a frame
+            self.__frames.put_nowait(
+                ConnectionResetError("Connection closed mid-frame"))
+        self.__frames.put_nowait(None)
+        self.__can_write.set()
+        if not self.__closed.done():
+            self.__closed.set_result(None)
+
+
+    def pause_writing(self):
+        """Makes writers wait while the transport's write buffer is full.
+        """
+        self.__can_write.clear()
+
+
+    def resume_writing(self):
+        """Lets writers continue once the transport's write buffer has drained.
+        """
+        self.__can_write.set()
+
+
+    async def read_frame(self):
+        """Waits for the next frame from the Agent Pi.
+
+        :raises FrameError: If the Agent Pi sent an invalid frame
+        :raises ConnectionResetError: If the Agent Pi disconnected part of the
+            way through a frame
+        :return: The message type and payload, or None if the Agent Pi has
+            disconnected
+        :rtype: tuple
+        """
+        frame = await self.__frames.get()
+        if frame is None:
+            # Leaving the end of the stream for any later reads
+            self.__frames.put_nowait(None)
+        elif isinstance(frame, Exception):
+            raise frame
+
+        if self.__paused and self.__frames.qsize() < self.__max_queued:
+            self.__paused = False
+            self.__transport.resume_reading()
+        return frame
+
+
+    async def write_frame(self, message_type, payload):
+        """Sends a frame to the Agent Pi, waiting if its buffer is full.
+
+        :param message_type: The type of the message
+        :type message_type: int
+        :param payload: The message's payload
+        :type payload: bytes
+        :raises ConnectionResetError: If the connection has closed
+        """
+        if self.__transport.is_closing():
+            raise ConnectionResetError("Connection is closed")
+        self.__transport.writelines(
+            [encode_header(message_type, len(payload)), payload])
+        await self.__can_write.wait()
+
+
+    async def close(self):
+        """Closes the connection and waits for it to finish closing.
+        """
+        if self.__transport is not None:
+            self.__transport.close()
+            await self.__closed
+
+
+    async def abort(self):
+        """Closes the connection straight away, throwing away anything still
+        waiting to be sent, as a peer that has gone away will never receive
+        it.
+        """
+        if self.__transport is not None:
+            self.__transport.abort()
+            await self.__closed
+
+
+    def get_idle_time(self):
+        """Returns how long it has been since anything was received from the
+        Agent Pi.
+
+        :return: The idle time in seconds
+        :rtype: float
+        """
+        return asyncio.get_running_loop().time() - self.__last_received
+
+
+    def get_transport(self):
+        """Returns the transport for the Agent Pi's socket.
+
+        :return: The transport
+        :rtype: asyncio.Transport
+        """
+        return self.__transport
+
+
+    def get_task(self):
+        """Returns the task that is serving the Agent Pi.
+
+        :return: The task
+        :rtype: asyncio.Task
+        """
+        return self.__task
+
+
+    def __expect_header(self):
+        """Gets ready to receive the header of the next frame.
+        """
+        self.__message_type = None
+        self.__payload = None
+        self.__view = memoryview(self.__header)
+        self.__received = 0
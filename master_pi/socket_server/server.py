@@ -1,86 +1,574 @@
-import json, pickle, requests, socket
+import asyncio, functools, json, logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from connection import Connection
+from dispatcher import Dispatcher, UnknownCommandError
+from event_bus import ACKNOWLEDGED, DISCONNECTED, NO_ACK, EventBus
+from face_recognition_pool import FaceRecognitionPool, PoolBusyError
 from face_recognition_util import FaceRecognitionUtil
+from image_codec import decode_image
+from position_buffer import PositionBuffer
+from probe_cache import ProbeCache
+from protocol import (ACK, ADD_BLUETOOTH, ADD_FACE, CHANGE_CAR_LOCATION,
+    CHANGE_LOCK_STATUS, COMMAND, FrameError, FrameProtocol, LOCATION_SCALE,
+    LOGIN, LOGIN_WITH_BLUETOOTH, LOGIN_WITH_FACE, OPCODES, PING, REGISTER,
+    REQUEST, TELEMETRY, decode_ack, decode_command, decode_register,
+    decode_request, decode_telemetry, set_keepalive)
+from services import LocalServices
 
 
 class Server:
-    """A class to represent a TCP socket server for a client to interact with
-    and for the other code to interface with
+    """A class to represent a TCP socket server for Agent Pis to interact with
+    and for the other code to interface with.\n
+    Every Agent Pi that connects is served at the same time on an asyncio event
+    loop, with the state of each connection kept in its own Connection. Work
+    that blocks, such as the Flask app's services and facial recognition, is
+    run in threads or worker processes so that it doesn't hold up the other
+    cars.\n
+    Each command is run by the handler registered for it with the server's
+    dispatcher, and further commands can be added with register_handler.\n
+    Agent Pis register the id of their car once they connect, so that events
+    such as a booking being cancelled can be pushed to the car over its
+    connection, see push_event. An event can be pushed to many cars at once
+    and each car's acknowledgement waited for, see push_event_to_cars. Events
+    from the Flask app are received on an EventBus.\n
+    Cars can stream their position in small messages that aren't answered.
+    Only the latest position of each car is kept, in a PositionBuffer, and
+    they are saved together every location interval.
+
+    :param host: The IP address that the server will listen on
+    :type host: string
+    :param port: The port that the server will listen on
+    :type port: int
+    :param services: Runs the commands that are handled by the Flask app,
+        either in this process (LocalServices, the default) or through its API
+        (HttpServices)
+    :type services: LocalServices
+    :param idle_timeout: Seconds without hearing from an Agent Pi, not even a
+        heartbeat, before its connection is closed
+    :type idle_timeout: float
+    :param ssl_context: The TLS settings that Agent Pis connect with, see
+        tls.create_server_context, or None to connect over plain TCP
+    :type ssl_context: ssl.SSLContext
+    :param reuse_port: Whether other processes may listen on the same port,
+        in which case the operating system shares new connections between
+        them
+    :type reuse_port: bool
+    :param face_workers: The number of processes that faces are recognised
+        in, which defaults to the number of CPUs
+    :type face_workers: int
+    :param events_folder: The folder to listen for events from the Flask app
+        in, see EventBus, or None to not listen for them
+    :type events_folder: string
+    :param location_interval: The seconds between saving the latest position
+        that each car has streamed
+    :type location_interval: float
     """
     __HOST = ""
-    """The IP address that the server will listen on"""
+    """The IP address that the server will listen on by default"""
     __PORT = 65000
-    """The port that the server will listen on"""
-    __server = None
-    """A socket object for the server"""
-    __client = None
-    """A socket object for the client"""
+    """The port that the server will listen on by default"""
+    __BACKLOG = 512
+    """The most connections that can be waiting to be accepted"""
+    __BLOCKING_THREADS = 64
+    """The number of threads that blocking calls are run in"""
+    __MAX_IN_FLIGHT = 16
+    """The most requests from one Agent Pi that are run at the same time
+    before the server stops reading more of its requests"""
+    __IDLE_TIMEOUT = 90
+    """The seconds an Agent Pi can be silent for by default, three of its
+    heartbeats"""
+    __REAP_INTERVAL = 5
+    """The most seconds between checks for idle connections"""
+    __KEEPALIVE_IDLE = 30
+    """The seconds without traffic before TCP keepalive probes are sent"""
+    __KEEPALIVE_INTERVAL = 10
+    """The seconds between TCP keepalive probes"""
+    __KEEPALIVE_COUNT = 3
+    """The unanswered TCP keepalive probes before a connection is dropped"""
+    __TLS_HANDSHAKE_TIMEOUT = 10
+    """The seconds an Agent Pi has to finish the TLS handshake"""
+    __LOCATION_INTERVAL = 5
+    """The seconds between saving the cars' positions by default"""
     __fru = FaceRecognitionUtil()
     """Used to call all the facial recognition functions"""
-
-
-    def start_socket_server(self):
+    __probe_cache = ProbeCache()
+    """Remembers the users matched to recently sent login images"""
+    __HANDLERS = {
+        LOGIN: "login",
+        LOGIN_WITH_FACE: "login_with_face",
+        LOGIN_WITH_BLUETOOTH: "login_with_bluetooth",
+        CHANGE_LOCK_STATUS: "change_lock_status",
+        CHANGE_CAR_LOCATION: "change_car_location",
+        ADD_FACE: "add_face",
+        ADD_BLUETOOTH: "add_bluetooth"
+    }
+    """The name of the method that handles each command's opcode"""
+
+
+    def __init__(self, host=__HOST, port=__PORT, services=None,
+                 idle_timeout=__IDLE_TIMEOUT, ssl_context=None,
+                 reuse_port=False, face_workers=None, events_folder=None,
+                 location_interval=__LOCATION_INTERVAL):
+        """Constructor method
+        """
+        self.__host = host
+        self.__port = port
+        self.__services = services if services is not None else LocalServices()
+        self.__idle_timeout = idle_timeout
+        self.__ssl_context = ssl_context
+        self.__reuse_port = reuse_port
+        self.__face_workers = face_workers
+        self.__events_folder = events_folder
+        self.__event_bus = None
+        self.__positions = PositionBuffer(
+            self.__save_positions, location_interval)
+        self.__server = None
+        self.__reaper = None
+        self.__reaped = 0
+        self.__lost = 0
+        self.__pool = None
+        self.__executor = None
+        self.__connections = set()
+        self.__requests = set()
+        self.__cars = {}
+        self.__event_id = 0
+        self.__acks = {}
+        self.__enrollment_lock = asyncio.Lock()
+        self.__dispatcher = Dispatcher()
+        for name, opcode in OPCODES.items():
+            self.__dispatcher.register(
+                opcode, name, getattr(self, self.__HANDLERS[opcode]))
+
+
+    async def start_socket_server(self):
         """Starts the server and makes it listen on the specified ip and port.
 
-        :return: A list containing the host ip and the port that the application
-            is listening on
-        :rtype: list
+        :return: A tuple containing the host ip and the port that the
+            application is listening on
+        :rtype: tuple
         """
-        address = (self.__HOST, self.__PORT)
-        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__server.bind(address)
-        self.__server.listen()
-
-
-    def stop_socket_server(self):
-        """Stops the server from listening on the IP and port.
+        # Loading the known faces once so that logins are matched from memory
+        self.__fru.load_encodings()
+        self.__pool = FaceRecognitionPool(self.__face_workers)
+        self.__executor = ThreadPoolExecutor(
+            max_workers=self.__BLOCKING_THREADS)
+        await self.__run_blocking(self.__services.open)
+
+        options = {}
+        if self.__reuse_port:
+            options["reuse_port"] = True
+        if self.__ssl_context is not None:
+            options["ssl"] = self.__ssl_context
+            options["ssl_handshake_timeout"] = self.__TLS_HANDSHAKE_TIMEOUT
+        loop = asyncio.get_running_loop()
+        self.__server = await loop.create_server(
+            lambda: FrameProtocol(self.handle_connection),
+            self.__host,
+            self.__port,
+            backlog=self.__BACKLOG,
+            **options)
+        self.__reaper = loop.create_task(self.__reap_idle_connections())
+        self.__positions.start()
+        if self.__events_folder is not None:
+            self.__event_bus = EventBus(
+                self.__events_folder, self.push_event, self.push_event_to_cars)
+            await self.__event_bus.open()
+        return self.__server.sockets[0].getsockname()
+
+
+    async def serve_forever(self):
+        """Serves Agent Pis until the server is stopped or cancelled.
         """
-        self.__server.shutdown(socket.SHUT_RDWR)
-        self.__server.close()
+        await self.__server.serve_forever()
 
 
-    def wait_for_connection(self):
-        """Wait for and Agent Pi to connect to the server and assigns it to
-        private variable.
+    async def stop_socket_server(self, drain_timeout=0):
+        """Stops the server from listening on the IP and port and disconnects
+        every Agent Pi.\n
+        Requests that have already started can be given time to finish and be
+        answered first, so that a car isn't left not knowing whether it was
+        unlocked. Agent Pis then reconnect, to another server process if
+        there is one.
 
-        :return: A list containing the Agent Pi's IP and port that is being used
-            to communicate
-        :rtype: list
+        :param drain_timeout: The most seconds to wait for requests that have
+            started to finish
+        :type drain_timeout: float
         """
-        self.__client, address = self.__server.accept()
-        return address
+        self.__server.close()
+        self.__reaper.cancel()
+        if self.__event_bus is not None:
+            self.__event_bus.close()
+        if drain_timeout and self.__requests:
+            logging.info("Waiting for {} requests to finish".format(
+                len(self.__requests)))
+            await asyncio.wait(set(self.__requests), timeout=drain_timeout)
+        for connection in list(self.__connections):
+            await connection.close()
+        await self.__server.wait_closed()
+        # Saving the positions the cars sent before they were disconnected
+        await self.__positions.stop()
+        self.__services.close()
+        self.__executor.shutdown(wait=False)
+        self.__pool.shutdown()
+
+
+    async def handle_connection(self, protocol):
+        """Serves one Agent Pi from when it connects until it disconnects.
+
+        :param protocol: The protocol that frames from the Agent Pi are read
+            from
+        :type protocol: FrameProtocol
+        """
+        connection = Connection(protocol)
+        self.__connections.add(connection)
+        sock = protocol.get_transport().get_extra_info("socket")
+        if sock is not None:
+            set_keepalive(sock, self.__KEEPALIVE_IDLE,
+                          self.__KEEPALIVE_INTERVAL, self.__KEEPALIVE_COUNT)
+        logging.info("Connected to Agent Pi on {} ({} connected)".format(
+            connection.get_address(), len(self.__connections)))
 
+        try:
+            await self.operations(connection)
+        except (ConnectionError, TimeoutError):
+            self.__lost += 1
+            logging.warning("Lost connection to Agent Pi on {}".format(
+                connection.get_address()))
+        except FrameError as error:
+            logging.warning("Invalid message from Agent Pi on {}: {}".format(
+                connection.get_address(), error))
+        except Exception:
+            # Only this Agent Pi is disconnected so the other cars are still
+            # served
+            logging.exception("Error serving Agent Pi on {}".format(
+                connection.get_address()))
+        finally:
+            self.__connections.discard(connection)
+            car_id = connection.get_car_id()
+            if self.__cars.get(car_id) is connection:
+                del self.__cars[car_id]
+            # Not waiting any longer for events the car hadn't acknowledged
+            for waiting_connection, acknowledged in self.__acks.values():
+                if waiting_connection is connection and not acknowledged.done():
+                    acknowledged.set_exception(
+                        ConnectionResetError("Agent Pi disconnected"))
+            await connection.close()
+
+
+    async def operations(self, connection):
+        """Answers the requests of an Agent Pi until it disconnects.\n
+        Each request holds the command that the Agent Pi wants to run, by its
+        opcode or by its name, along with its details in a single message, and
+        is answered with a single response carrying the request's id. Requests
+        are run at the same time and answered in the order they finish, so a
+        slow face login doesn't hold up a car's lock or location updates.
+        Heartbeats that an idle Agent Pi sends are answered straight away, a
+        registration records which car the Agent Pi corresponds to, an
+        acknowledgement of an event is passed to whatever is waiting for it
+        and a car's position is kept until the positions are next saved. An
+        Agent Pi may only send the position of the car it has registered as.
+
+        :param connection: The connection to the Agent Pi
+        :type connection: Connection
+        :raises FrameError: If the Agent Pi sends an unexpected message
+        """
+        in_flight = asyncio.Semaphore(self.__MAX_IN_FLIGHT)
+        tasks = set()
+        try:
+            while True:
+                frame = await connection.receive_frame()
+                if frame is None:
+                    logging.warning("Agent Pi on {} disconnected".format(
+                        connection.get_address()))
+                    # Letting requests that have started finish, so that a
+                    # face being added isn't left half saved
+                    await asyncio.gather(*tasks)
+                    return
+
+                message_type, payload = frame
+                if message_type in (COMMAND, REQUEST):
+                    if message_type == COMMAND:
+                        request = decode_command(payload)
+                    else:
+                        request = decode_request(payload)
+                    # Waiting for a free slot so that one car can't queue up
+                    # unlimited work
+                    await in_flight.acquire()
+                    task = asyncio.create_task(
+                        self.__answer(connection, in_flight, *request))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    self.__requests.add(task)
+                    task.add_done_callback(self.__requests.discard)
+                elif message_type == PING:
+                    await connection.send_pong()
+                elif message_type == REGISTER:
+                    self.__register_car(connection, decode_register(payload))
+                elif message_type == ACK:
+                    self.__acknowledge(connection, decode_ack(payload))
+                elif message_type == TELEMETRY:
+                    self.__record_position(connection, payload)
+                else:
+                    raise FrameError("Unexpected message of type {}".format(
+                        message_type))
+        finally:
+            # Nothing can be sent back to an Agent Pi that has misbehaved
+            for task in tasks:
+                task.cancel()
+
+
+    async def __answer(self, connection, in_flight, request_id, command,
+                       message, image):
+        """Runs one request from an Agent Pi and sends back its response.\n
+        If the request fails the Agent Pi is disconnected, as it would
+        otherwise be left waiting for a response that never comes.
+
+        :param connection: The connection to the Agent Pi
+        :type connection: Connection
+        :param in_flight: The Agent Pi's slots for running requests, one of
+            which is released once the request is answered
+        :type in_flight: asyncio.Semaphore
+        :param request_id: The id of the request
+        :type request_id: int
+        :param command: The opcode of the command, or its name
+        :type command: int
+        :param message: The details of the command
+        :type message: dict
+        :param image: An image sent with the command
+        :type image: bytes
+        """
+        try:
+            response = await self.handle_request(command, message, image)
+            await connection.send_response(request_id, response)
+        except ConnectionError:
+            pass
+        except Exception:
+            logging.exception("Error answering {} from Agent Pi on {}".format(
+                command, connection.get_address()))
+            await connection.close()
+        finally:
+            in_flight.release()
+
+
+    def __record_position(self, connection, payload):
+        """Keeps the position that a car has sent until the positions are next
+        saved.
+
+        :param connection: The connection to the Agent Pi
+        :type connection: Connection
+        :param payload: The payload of the position
+        :type payload: bytes
+        :raises FrameError: If the position is invalid, the Agent Pi hasn't
+            registered or the position is for a car other than the one it
+            registered as
+        """
+        car_id, latitude, longitude, timestamp = decode_telemetry(payload)
+        registered = connection.get_car_id()
+        if registered is None:
+            raise FrameError("Position for car {} before registering".format(
+                car_id))
+        if car_id != registered:
+            raise FrameError("Position for car {} from car {}".format(
+                car_id, registered))
+        self.__positions.record(car_id, latitude, longitude, timestamp)
+
+
+    def __register_car(self, connection, car_id):
+        """Records which car an Agent Pi corresponds to, so that events can be
+        pushed to it. A car that has reconnected replaces its old connection,
+        which is left to be closed once it is found to be idle.
+
+        :param connection: The connection to the Agent Pi
+        :type connection: Connection
+        :param car_id: The id of the car
+        :type car_id: int
+        """
+        old_car_id = connection.get_car_id()
+        if self.__cars.get(old_car_id) is connection:
+            del self.__cars[old_car_id]
+        connection.set_car_id(car_id)
+        self.__cars[car_id] = connection
+        logging.info("Agent Pi on {} registered as car {}".format(
+            connection.get_address(), car_id))
+
+
+    async def push_event(self, car_id, event):
+        """Pushes an event to a car's Agent Pi, if it is connected to this
+        server.
+
+        :param car_id: The id of the car
+        :type car_id: int
+        :param event: The event, holding its type, such as
+            "booking_cancelled", and its details
+        :type event: dict
+        :return: Whether the event was sent to the car
+        :rtype: bool
+        """
+        connection = self.__cars.get(car_id)
+        if connection is None:
+            return False
+        self.__event_id += 1
+        try:
+            await connection.send_event(self.__event_id, event)
+        except ConnectionError:
+            return False
+        logging.info("Pushed {} to car {}".format(event.get("type"), car_id))
+        return True
+
+
+    async def push_event_to_cars(self, car_ids, event, timeout):
+        """Pushes an event to several cars at once and waits for each of them
+        to acknowledge it, such as when an admin locks every car at the end of
+        the day.\n
+        The event is sent to every car at the same time and they share one
+        deadline, so the time taken doesn't grow with the number of cars. Cars
+        that aren't connected to this server are left out of the results.
+
+        :param car_ids: The ids of the cars
+        :type car_ids: list
+        :param event: The event, holding its type and details
+        :type event: dict
+        :param timeout: The most seconds to wait for the cars to acknowledge
+            the event
+        :type timeout: float
+        :return: For the id of each car that is connected, ACKNOWLEDGED,
+            NO_ACK if it didn't acknowledge the event in time or DISCONNECTED
+            if its connection was lost first
+        :rtype: dict
+        """
+        deadline = asyncio.get_running_loop().time() + timeout
+        car_ids = [car_id for car_id in dict.fromkeys(car_ids)
+                   if car_id in self.__cars]
+        results = await asyncio.gather(*[
+            self.__push_and_wait(self.__cars[car_id], event, deadline)
+            for car_id in car_ids])
+        logging.info("Pushed {} to {} cars, {} acknowledged".format(
+            event.get("type"), len(car_ids), results.count(ACKNOWLEDGED)))
+        return dict(zip(car_ids, results))
+
+
+    async def __push_and_wait(self, connection, event, deadline):
+        """Pushes an event to a car and waits for it to acknowledge the event.
+
+        :param connection: The connection to the car's Agent Pi
+        :type connection: Connection
+        :param event: The event, holding its type and details
+        :type event: dict
+        :param deadline: The event loop's time by which the car must have
+            acknowledged the event
+        :type deadline: float
+        :return: ACKNOWLEDGED, NO_ACK or DISCONNECTED
+        :rtype: string
+        """
+        loop = asyncio.get_running_loop()
+        self.__event_id += 1
+        event_id = self.__event_id
+        acknowledged = loop.create_future()
+        self.__acks[event_id] = (connection, acknowledged)
+        try:
+            # The car's buffer may be full, so sending counts towards the
+            # deadline too
+            await asyncio.wait_for(connection.send_event(event_id, event),
+                                   max(0, deadline - loop.time()))
+            await asyncio.wait_for(acknowledged, max(0, deadline - loop.time()))
+            return ACKNOWLEDGED
+        except asyncio.TimeoutError:
+            return NO_ACK
+        except ConnectionError:
+            return DISCONNECTED
+        finally:
+            del self.__acks[event_id]
+
+
+    def __acknowledge(self, connection, event_id):
+        """Passes an Agent Pi's acknowledgement of an event to whatever is
+        waiting for it. Acknowledgements of events that nothing is waiting for
+        any more are ignored.
+
+        :param connection: The connection to the Agent Pi
+        :type connection: Connection
+        :param event_id: The id of the event
+        :type event_id: int
+        """
+        waiting_connection, acknowledged = self.__acks.get(event_id, (None, None))
+        if waiting_connection is connection and not acknowledged.done():
+            acknowledged.set_result(None)
 
-    def wait_for_instruction(self):
-        """Wait for the Agent Pi to indicate what it would like to do.
 
-        :return: The message that was sent by the Agent Pi
+    async def __reap_idle_connections(self):
+        """Closes the connections of Agent Pis that haven't been heard from,
+        not even a heartbeat, for longer than the idle timeout, such as a car
+        that has gone out of range without closing its connection. Closing the
+        connection frees everything that was held for it.
+        """
+        interval = min(self.__REAP_INTERVAL, self.__idle_timeout / 2)
+        while True:
+            await asyncio.sleep(interval)
+            for connection in list(self.__connections):
+                if connection.get_idle_time() > self.__idle_timeout:
+                    self.__reaped += 1
+                    logging.warning(
+                        "Closing idle connection to Agent Pi on {} ({} reaped)".format(
+                            connection.get_address(), self.__reaped))
+                    await connection.abort()
+
+
+    async def handle_request(self, command, message, image=None):
+        """Runs the handler for a command sent by an Agent Pi.
+
+        :param command: The opcode of the command, such as LOGIN, or its name,
+            such as "Login"
+        :type command: int
+        :param message: The details of the command
+        :type message: dict
+        :param image: An image sent with the command
+        :type image: bytes
+        :return: The response to send to the Agent Pi
         :rtype: string
         """
-        data = self.__client.recv(4096)
-        message = data.decode()
-        return message
+        try:
+            return await self.__dispatcher.dispatch(command, message, image)
+        except UnknownCommandError:
+            logging.info("Invalid instruction: {}".format(command))
+            return json.dumps({
+                "message": "Unknown command: {}".format(command)
+            })
 
 
-    def login(self):
-        """Authenticates user via the Flask APi.\n
-        This method waits for a response from the Agent Pi, sends this
-        information to the Flask API and returns the response to the Agent Pi
-        after encoding it.
+    def register_handler(self, opcode, name, handler):
+        """Adds a command that Agent Pis can send, or replaces the handler of
+        an existing one.
+
+        :param opcode: The command's opcode
+        :type opcode: int
+        :param name: The command's name
+        :type name: string
+        :param handler: The coroutine function that runs the command, taking
+            its details and any image and returning the response to send
+        :type handler: function
         """
-        # Indicating to Agent Pi that the method has begun
-        self.__client.sendall("OK".encode())
+        self.__dispatcher.register(opcode, name, handler)
+
 
-        # Getting message from Agent Pi
-        data = self.__client.recv(4096)
-        message = json.loads(data.decode())
+    async def login(self, message, image=None):
+        """Authenticates user via the Flask app's services.\n
+        This method passes the username and password from the Agent Pi to the
+        Flask app and returns its response to the Agent Pi.
 
+        :param message: The username and password sent by the Agent Pi
+        :type message: dict
+        :param image: An image sent by the Agent Pi, which isn't used
+        :type image: bytes
+        :return: The response to send to the Agent Pi
+        :rtype: string
+        """
         try:
-            # Sending login info to API
-            api_response = requests.post(
-                'http://localhost:5000/api/login',
-                json=message).text
+            # Sending login info to the Flask app
+            api_response = await self.__run_blocking(
+                self.__services.login, message)
         except:
-            # If connection to API fails then send a generic error message
+            # If the call to the Flask app fails then send a generic error message
             api_response = json.dumps({
                 "user": None,
                 "message": {
@@ -88,128 +576,148 @@ class Server:
                 }})
 
         # Returning response to Agent Pi
-        self.__client.sendall(api_response.encode())
+        return api_response
 
 
-    def add_face(self):
+    async def add_face(self, message, image=None):
         """Receive an image from the Agent Pi and add it to the dataset.\n
-        This method receives the image and username from the Agent Pi, encodes it
-        and adds it to the dataset. It sends an 'ok' response when the process
-        has completed.
+        This method takes the username and the image, as a JPEG or PNG, sent by
+        the Agent Pi, encodes only that image in a worker process and saves it
+        to the dataset. It responds 'ok' when the process has completed, 'busy'
+        if the image couldn't be encoded in time and should be sent again, or
+        'invalid' if the image couldn't be decoded.
+
+        :param message: The details sent by the Agent Pi, holding the username
+        :type message: dict
+        :param image: The image of the user's face, encoded as a JPEG or PNG
+        :type image: bytes
+        :return: The response to send to the Agent Pi
+        :rtype: string
         """
-        # Indicating to Agent Pi that the method has begun
-        self.__client.sendall("OK".encode())
-
-        # Receive username and image from Agent Pi
-        message = self.receive_image_from_client()
         username = message['username']
-        image = message['image']
 
-        # Saving and encoding images
-        self.__fru.add_face(username, image)
-        self.__fru.encode_faces()
+        try:
+            # Encoding the new image and saving it, one car at a time so that
+            # the encodings file isn't written to by two cars at once
+            encodings = await self.__run_blocking(
+                self.__pool.encode_image, image)
+            decoded = await self.__run_blocking(decode_image, image)
+            async with self.__enrollment_lock:
+                await self.__run_blocking(
+                    self.__fru.add_face, username, decoded, encodings)
+            response = "OK"
+        except (PoolBusyError, TimeoutError):
+            logging.warning("face could not be added, asking Agent Pi to retry")
+            response = "BUSY"
+        except ValueError:
+            logging.warning("face could not be added, the image is invalid")
+            response = "INVALID"
 
         # Letting Agent Pi know that the process has completed
-        self.__client.send("OK".encode())
+        return response
 
 
-    def login_with_face(self):
+    async def login_with_face(self, message, image=None):
         """Receive an image from the Agent Pi and checks whether it matches a
         user in the dataset.\n
-        This method receives the image from the Agent Pi and checks whether it
-        matches a user in the dataset, it returns this information to the Agent
-        Pi, via sockets, as a dict.
+        This method takes the image, as a JPEG or PNG, sent by the Agent Pi and
+        checks whether it matches a user in the dataset, it returns this
+        information to the Agent Pi as a dict along with the distance of the
+        match, where a smaller distance means a more confident match.\n
+        The image is matched in a worker process. If the workers are too busy
+        or take too long the response says so, and the Agent Pi can try again.
+        An image that has recently been matched, such as one that is resent
+        after a timeout, is answered from the probe cache.
+
+        :param message: The details sent by the Agent Pi, which aren't used
+        :type message: dict
+        :param image: The image of the user's face that is matched, encoded
+            as a JPEG or PNG
+        :type image: bytes
+        :return: The response to send to the Agent Pi
+        :rtype: string
         """
-        # Indicating to Agent Pi that the method has begun
-        self.__client.sendall("OK".encode())
-
-        # Receive image from Agent Pi
-        image = self.receive_image_from_client()
-        # Getting the matching user
-        username = self.__fru.recognise_face(image)
-        response = json.dumps({
-            "username": username
-        })
-
-        self.__client.send(response.encode())
-
-
-    def receive_image_from_client(self):
-        """Receive an image from the Agent Pi via sockets.\n
-        This method receives the image from the Agent Pi in chunks as the image
-        is too large to be sent in one go.
+        try:
+            if not image:
+                raise ValueError("No image was sent")
+            # Getting the matching user, unless this image has been matched
+            # since the known faces last changed
+            key = self.__probe_cache.key(np.frombuffer(image, dtype=np.uint8))
+            generation = self.__fru.get_store().get_file_signature()
+            match = self.__probe_cache.get(key, generation)
+            if match is None:
+                match = await self.__run_blocking(
+                    self.__pool.find_match, image)
+                self.__probe_cache.put(key, generation, match)
+            logging.info("probe cache: {hits} hits, {misses} misses".format(
+                **self.__probe_cache.get_stats()))
+
+            username, distance = match
+            response = json.dumps({
+                "username": username,
+                "distance": distance
+            })
+        except (PoolBusyError, TimeoutError):
+            logging.warning("face could not be matched, asking Agent Pi to retry")
+            response = json.dumps({
+                "username": None,
+                "distance": None,
+                "busy": True,
+                "message": "The server is busy, please try again."
+            })
+        except ValueError:
+            logging.warning("face could not be matched, the image is invalid")
+            response = json.dumps({
+                "username": None,
+                "distance": None,
+                "message": "The image could not be read."
+            })
 
-        :return: The image that has been received
-        :rtype: numpy.ndarray
-        """
-        # Receiving image as a pickle, which is a very large string and thus is
-        # the data is broken up and received in a loop
-        data = []
-        receiving = True
-        while receiving:
-            packet = self.__client.recv(4096)
-            try:
-                # If the terminating string has been found in one of the packets
-                # then stop the loop and append whatever information is in that
-                # packet (besides the terminating string).
-                end_index = packet.index(b"\x80\x03X\x08\x00\x00\x00ENDIMAGEq\x00.")
-                data.append(packet[0:end_index])
-                receiving = False
-            except ValueError:
-                # The terminating string is not in the packet and should be add-
-                # ed to the data
-                data.append(packet)
+        return response
 
-        return pickle.loads(b"".join(data))
 
+    async def add_bluetooth(self, message, image=None):
+        """Update the users bluetooth mac address via the Flask app's services.
 
-    def add_bluetooth(self):
-        """Update the users bluetooth mac address via Flask API.
+        :param message: The details sent by the Agent Pi
+        :type message: dict
+        :param image: An image sent by the Agent Pi, which isn't used
+        :type image: bytes
+        :return: The response to send to the Agent Pi
+        :rtype: string
         """
-
-        # Indicating to Agent Pi that the method has begun
-        self.__client.sendall("OK".encode())
-
-        # Getting message from Agent Pi
-        data = self.__client.recv(4096)
-        message = json.loads(data.decode())
-
-        # Send mac address info to API to be processed
         try:
-            # Sending location info to API
-            api_response = requests.post(
-                'http://localhost:5000/api/register-bluetooth',
-                json=message).text
+            # Sending the MAC address to the Flask app
+            api_response = await self.__run_blocking(
+                self.__services.register_bluetooth, message)
         except:
-            # If connection to API fails then send a generic error message
+            # If the call to the Flask app fails then send a generic error message
             api_response = json.dumps({
                 "message": "A server error occurred."
             })
 
         # Returning response to Agent Pi
-        self.__client.sendall(api_response.encode())
+        return api_response
 
 
-    def login_with_bluetooth(self):
-        """Authenticates users bluetooth device via the Flask APi.\n
-        This method waits for a response from the Agent Pi, sends this
-        information to the Flask API and returns the response to the Agent Pi
-        after encoding it.
-        """
-        # Indicating to Agent Pi that the method has begun
-        self.__client.sendall("OK".encode())
-
-        # Getting message from Agent Pi
-        data = self.__client.recv(4096)
-        message = json.loads(data.decode())
+    async def login_with_bluetooth(self, message, image=None):
+        """Authenticates users bluetooth device via the Flask app's services.\n
+        This method passes the MAC address from the Agent Pi to the Flask app
+        and returns its response to the Agent Pi.
 
+        :param message: The details sent by the Agent Pi
+        :type message: dict
+        :param image: An image sent by the Agent Pi, which isn't used
+        :type image: bytes
+        :return: The response to send to the Agent Pi
+        :rtype: string
+        """
         try:
-            # Sending login info to API
-            api_response = requests.post(
-                'http://localhost:5000/api/login-bluetooth',
-                json=message).text
+            # Sending login info to the Flask app
+            api_response = await self.__run_blocking(
+                self.__services.login_bluetooth, message)
         except:
-            # If connection to API fails then send a generic error message
+            # If the call to the Flask app fails then send a generic error message
             api_response = json.dumps({
                 "user": None,
                 "message": {
@@ -217,81 +725,180 @@ class Server:
                 }})
 
         # Returning response to Agent Pi
-        self.__client.sendall(api_response.encode())
+        return api_response
 
 
-    def change_lock_status(self):
-        """Makes a call on the API to unlock or return a car.\n
+    async def change_lock_status(self, message, image=None):
+        """Makes a call on the Flask app to unlock or return a car.\n
         This method recieves the ID of a car, the username of the of the user
         that is sending the requet and what method is to be called.
-        It then makes a request to the API to unlock or return the car
-        corresponding to that ID. It then sends the response from the API to the
-        Agent Pi via TCP sockets.
+        It then asks the Flask app to unlock or return the car corresponding to
+        that ID and sends its response to the Agent Pi.
+
+        :param message: The details sent by the Agent Pi
+        :type message: dict
+        :param image: An image sent by the Agent Pi, which isn't used
+        :type image: bytes
+        :return: The response to send to the Agent Pi
+        :rtype: string
         """
-        # Indicating to Agent Pi that the method has begun
-        self.__client.sendall("OK".encode())
-
-        # Getting message from Agent Pi
-        data = self.__client.recv(4096)
-        message = json.loads(data.decode())
-
         try:
-            # Sending login info to API
-            api_response = requests.post(
-                'http://localhost:5000/api/' + message['method'],
-                json=message).text
+            # Unlocking or returning the car through the Flask app
+            service = {
+                "unlock": self.__services.unlock_car,
+                "return": self.__services.return_car
+            }[message['method']]
+            api_response = await self.__run_blocking(service, message)
         except:
-            # If connection to API fails then send a generic error message
+            # If the call to the Flask app fails then send a generic error message
             api_response = json.dumps({
                 "message": "A server error occurred."
             })
 
         # Returning response to Agent Pi
-        self.__client.sendall(api_response.encode())
+        return api_response
 
 
-    def change_car_location(self):
-        """Makes a call on the API to update a cars location.\n
+    async def change_car_location(self, message, image=None):
+        """Makes a call on the Flask app to update a cars location.\n
         This method receives the ID of a car and location is to be set.
-        It then makes a request to the API to update the cars location
-        corresponding to that ID. It then sends the response from the API to the
-        Agent Pi via TCP sockets.
+        It then asks the Flask app to update the cars location corresponding to
+        that ID and sends its response to the Agent Pi.
+
+        :param message: The details sent by the Agent Pi
+        :type message: dict
+        :param image: An image sent by the Agent Pi, which isn't used
+        :type image: bytes
+        :return: The response to send to the Agent Pi
+        :rtype: string
         """
-        # Indicating to Agent Pi that the method has begun
-        self.__client.sendall("OK".encode())
-
-        # Getting message from Agent Pi
-        data = self.__client.recv(4096)
-        message = json.loads(data.decode())
-
         try:
-            # Sending location info to API
-            api_response = requests.post(
-                'http://localhost:5000/api/setlocation',
-                json=message).text
+            # Sending location info to the Flask app
+            api_response = await self.__run_blocking(
+                self.__services.change_car_location, message)
         except:
-            # If connection to API fails then send a generic error message
+            # If the call to the Flask app fails then send a generic error message
             api_response = json.dumps({
                 "message": "A server error occurred."
             })
 
         # Returning response to Agent Pi
-        self.__client.sendall(api_response.encode())
+        return api_response
+
+
+    async def __save_positions(self, positions):
+        """Saves the latest position of each car through the Flask app, as
+        the cars' locations in a single batched update.
+
+        :param positions: The latitude and longitude in millionths of a degree
+            and the Unix time of each car, by its id
+        :type positions: dict
+        """
+        locations = [{
+            "car_id": car_id,
+            "location": "{:.6f},{:.6f}".format(
+                latitude / LOCATION_SCALE, longitude / LOCATION_SCALE)
+        } for car_id, (latitude, longitude, timestamp) in positions.items()]
+        await self.__run_blocking(
+            self.__services.change_car_locations, { "locations": locations })
+        logging.info("Saved the positions of {} cars".format(len(locations)))
+
+
+    async def __run_blocking(self, function, *args, **kwargs):
+        """Runs a function that blocks in one of the server's threads so that
+        the other Agent Pis are still served while it runs.
+
+        :param function: The function to run
+        :type function: function
+        :return: The function's return value
+        :rtype: object
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.__executor, functools.partial(function, *args, **kwargs))
 
 
     def get_server(self):
-        """Returns the server socket object.
+        """Returns the asyncio server object.
 
-        :return: The server socket
-        :rtype: socket
+        :return: The server
+        :rtype: asyncio.Server
         """
         return self.__server
 
 
-    def get_client(self):
-        """Returns the client socket object.
+    def get_connection_stats(self):
+        """Returns counts of the connections to Agent Pis.
+
+        :return: The number of Agent Pis connected, the number of those that
+            have registered their car, the number of connections closed for
+            being idle and the number lost to errors, such as TCP keepalive
+            probes going unanswered
+        :rtype: dict
+        """
+        return {
+            "connected": len(self.__connections),
+            "cars": len(self.__cars),
+            "reaped": self.__reaped,
+            "lost": self.__lost
+        }
+
+
+    def get_handler_stats(self):
+        """Returns how the handler of each command has performed.
+
+        :return: For the name of each command, the number of times it has run,
+            the number that raised an error, and the total and longest time
+            taken in seconds
+        :rtype: dict
+        """
+        return self.__dispatcher.get_stats()
+
+
+    def get_connections(self):
+        """Returns the connections to the Agent Pis that are connected.
+
+        :return: The open connections
+        :rtype: set
+        """
+        return self.__connections
+
+
+    def get_cars(self):
+        """Returns the connections to the Agent Pis that have registered, by
+        the id of their car.
+
+        :return: The connection of each car
+        :rtype: dict
+        """
+        return self.__cars
+
+
+    def get_event_bus(self):
+        """Returns the event bus that events from the Flask app are received
+        on.
+
+        :return: The event bus, or None if the server doesn't listen for
+            events
+        :rtype: EventBus
+        """
+        return self.__event_bus
+
+
+    def get_position_buffer(self):
+        """Returns the buffer that the positions cars stream are kept in until
+        they are saved.
+
+        :return: The position buffer
+        :rtype: PositionBuffer
+        """
+        return self.__positions
+
+
+    def get_probe_cache(self):
+        """Returns the cache of recently matched login images.
 
-        :return: The client socket
-        :rtype: socket
+        :return: The probe cache
+        :rtype: ProbeCache
         """
-        return self.__client
+        return self.__probe_cache
@@ -0,0 +1,354 @@
+import json, random, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class LocalServices:
+    """Runs the commands of Agent Pis by calling the Flask app's services in
+    this process under an app context, see app.services.\n
+    This saves a connection to the API, an HTTP request to parse and the JSON
+    to re-encode for every command. The methods block on the database and so
+    should be run in a thread.
+
+    :param app: The Flask app to run the services in, or None to create one
+        when the services are opened
+    :type app: flask.Flask
+    """
+
+    def __init__(self, app=None):
+        """Constructor method
+        """
+        self.__app = app
+        self.__user = None
+        self.__car = None
+
+
+    def open(self):
+        """Creates the Flask app, connecting to the database, if one wasn't
+        given.
+        """
+        # Importing the app here so that the server can be run with
+        # HttpServices without the Flask app's dependencies installed
+        from app import create_app
+        from app.services import car, user
+        if self.__app is None:
+            self.__app = create_app()
+        self.__user = user
+        self.__car = car
+
+
+    def close(self):
+        """Nothing is held open between commands, as each one runs in its own
+        app context.
+        """
+
+
+    def login(self, message):
+        """Checks a user's username and password.
+
+        :param message: The username and password
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__call(self.__user.login, message)
+
+
+    def login_bluetooth(self, message):
+        """Logs in the user that a Bluetooth device is registered to.
+
+        :param message: The MAC address of the device
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__call(self.__user.login_bluetooth, message)
+
+
+    def register_bluetooth(self, message):
+        """Registers a Bluetooth device to a user.
+
+        :param message: The username and MAC address
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__call(self.__user.register_bluetooth, message)
+
+
+    def unlock_car(self, message):
+        """Unlocks a car for the user that has booked it.
+
+        :param message: The username and car id
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__call(self.__car.unlock_car, message)
+
+
+    def return_car(self, message):
+        """Locks a car that a user has finished with.
+
+        :param message: The username and car id
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__call(self.__car.return_car, message)
+
+
+    def change_car_location(self, message):
+        """Updates a car's location.
+
+        :param message: The car id and location
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__call(self.__car.change_car_location, message)
+
+
+    def change_car_locations(self, message):
+        """Updates the locations of many cars at once.
+
+        :param message: The id and location of each car
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__call(self.__car.change_car_locations, message)
+
+
+    def __call(self, service, message):
+        """Runs a service in its own app context, so that each thread gets its
+        own database session.
+
+        :param service: The service function to run
+        :type service: function
+        :param message: The request body to pass to it
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        with self.__app.app_context():
+            response, status = service(message)
+        return json.dumps(response)
+
+
+class JitteredRetry(Retry):
+    """Retries failed connections to the API, waiting a random time of up to
+    the exponential backoff before each retry so that cars whose calls failed
+    together don't all retry at the same moment.
+    """
+
+    def get_backoff_time(self):
+        """Picks how long to wait before the next retry.
+
+        :return: The time to wait in seconds
+        :rtype: float
+        """
+        return random.uniform(0, super().get_backoff_time())
+
+
+class HttpServices:
+    """Runs the commands of Agent Pis by sending them to the Flask API over
+    HTTP, for when the API runs on a different machine to the socket server.\n
+    Every call goes through one shared session whose pool keeps connections
+    to the API alive between commands, so that each command doesn't open a new
+    connection. Calls that can't connect are retried a bounded number of times
+    and every call has a timeout, so a slow or missing API can't hold a thread
+    forever. Calls that reached the API aren't retried, as unlocking or
+    returning a car twice isn't safe.
+
+    :param url: The URL that the API's endpoints are under
+    :type url: string
+    :param pool_size: The most connections to the API that are kept open,
+        which should be at least the number of threads calling it
+    :type pool_size: int
+    :param connect_timeout: Seconds to wait to connect to the API
+    :type connect_timeout: float
+    :param read_timeout: Seconds to wait for the API to respond
+    :type read_timeout: float
+    :param retries: The most times a call that couldn't connect is retried
+    :type retries: int
+    :param backoff: The backoff factor for the time waited between retries
+    :type backoff: float
+    """
+    __URL = "http://localhost:5000/api/"
+    """The URL of the API by default"""
+    __POOL_SIZE = 64
+    """The most connections that are kept open by default, one per thread
+    that the server runs blocking calls in"""
+    __CONNECT_TIMEOUT = 3.05
+    """The seconds to wait to connect to the API by default"""
+    __READ_TIMEOUT = 10
+    """The seconds to wait for the API to respond by default"""
+    __RETRIES = 3
+    """The most times a call is retried by default"""
+    __BACKOFF = 0.2
+    """The backoff factor between retries by default"""
+
+
+    def __init__(self, url=__URL, pool_size=__POOL_SIZE,
+                 connect_timeout=__CONNECT_TIMEOUT, read_timeout=__READ_TIMEOUT,
+                 retries=__RETRIES, backoff=__BACKOFF):
+        """Constructor method
+        """
+        self.__url = url if url.endswith("/") else url + "/"
+        self.__pool_size = pool_size
+        self.__timeout = (connect_timeout, read_timeout)
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__session = None
+
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the services from the API section of config.ini, using the
+        defaults for any value that isn't set.
+
+        :param config: The API section of the config
+        :type config: configparser.SectionProxy
+        :return: The services
+        :rtype: HttpServices
+        """
+        return cls(
+            url=config.get("URL", fallback=cls.__URL),
+            pool_size=config.getint("POOL_SIZE", fallback=cls.__POOL_SIZE),
+            connect_timeout=config.getfloat(
+                "CONNECT_TIMEOUT", fallback=cls.__CONNECT_TIMEOUT),
+            read_timeout=config.getfloat(
+                "READ_TIMEOUT", fallback=cls.__READ_TIMEOUT),
+            retries=config.getint("RETRIES", fallback=cls.__RETRIES),
+            backoff=config.getfloat("BACKOFF", fallback=cls.__BACKOFF))
+
+
+    def open(self):
+        """Creates the session that calls to the API share.
+        """
+        retry = JitteredRetry(
+            total=self.__retries,
+            connect=self.__retries,
+            read=0,
+            redirect=0,
+            status=0,
+            backoff_factor=self.__backoff)
+        # Blocking when every connection is in use instead of opening extra
+        # connections that would be thrown away
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.__pool_size,
+            max_retries=retry,
+            pool_block=True)
+        self.__session = requests.Session()
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+
+
+    def close(self):
+        """Closes every connection to the API.
+        """
+        if self.__session is not None:
+            self.__session.close()
+            self.__session = None
+
+
+    def get_session(self):
+        """Returns the session that calls to the API share.
+
+        :return: The session, or None if the services aren't open
+        :rtype: requests.Session
+        """
+        return self.__session
+
+
+    def login(self, message):
+        """Checks a user's username and password.
+
+        :param message: The username and password
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__post("login", message)
+
+
+    def login_bluetooth(self, message):
+        """Logs in the user that a Bluetooth device is registered to.
+
+        :param message: The MAC address of the device
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__post("login-bluetooth", message)
+
+
+    def register_bluetooth(self, message):
+        """Registers a Bluetooth device to a user.
+
+        :param message: The username and MAC address
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__post("register-bluetooth", message)
+
+
+    def unlock_car(self, message):
+        """Unlocks a car for the user that has booked it.
+
+        :param message: The username and car id
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__post("unlock", message)
+
+
+    def return_car(self, message):
+        """Locks a car that a user has finished with.
+
+        :param message: The username and car id
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__post("return", message)
+
+
+    def change_car_location(self, message):
+        """Updates a car's location.
+
+        :param message: The car id and location
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__post("setlocation", message)
+
+
+    def change_car_locations(self, message):
+        """Updates the locations of many cars at once.
+
+        :param message: The id and location of each car
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__post("setlocations", message)
+
+
+    def __post(self, endpoint, message):
+        """Sends a request to one of the API's endpoints.
+
+        :param endpoint: The endpoint's path under the API's URL
+        :type endpoint: string
+        :param message: The request body
+        :type message: dict
+        :return: The response body, as JSON
+        :rtype: string
+        """
+        return self.__session.post(
+            self.__url + endpoint, json=message, timeout=self.__timeout).text
@@ -0,0 +1,179 @@
+import logging, multiprocessing, signal, time
+from multiprocessing.connection import wait
+
+
+class Supervisor:
+    """A class to run the socket server in several worker processes and keep
+    them running.\n
+    Each worker runs its own event loop and listens on the same port with
+    SO_REUSEPORT, so the operating system shares new Agent Pis between them
+    and the work of serving them is spread across every CPU. A worker that
+    exits while the supervisor is running has crashed and is started again,
+    waiting longer each time if it keeps crashing straight away.\n
+    When the supervisor is sent SIGTERM or SIGINT it sends SIGTERM to every
+    worker, which stops accepting Agent Pis and lets requests that have
+    started finish, and waits for them to exit.
+
+    :param target: The function that each worker runs, which is called with
+        the worker's number and must return once it has been sent SIGTERM
+    :type target: function
+    :param workers: The number of worker processes
+    :type workers: int
+    :param stop_timeout: The most seconds to wait for the workers to exit once
+        they have been told to stop, after which they are killed
+    :type stop_timeout: float
+    """
+    __RESTART_DELAY = 1
+    """The seconds waited before starting a crashed worker again, which
+    doubles each time it crashes soon after starting"""
+    __MAX_RESTART_DELAY = 30
+    """The most seconds waited before starting a crashed worker again"""
+    __STABLE_TIME = 10
+    """The seconds a worker must run for before its crashes stop counting
+    against it"""
+    __POLL_INTERVAL = 0.5
+    """The most seconds between checks of whether the supervisor should stop"""
+
+
+    def __init__(self, target, workers, stop_timeout=30):
+        """Constructor method
+        """
+        self.__target = target
+        self.__workers = [None] * workers
+        self.__started = [0] * workers
+        self.__delays = [self.__RESTART_DELAY] * workers
+        self.__restart_at = [0] * workers
+        self.__stop_timeout = stop_timeout
+        self.__stopping = False
+        self.__restarts = 0
+        # Forking so that the workers start with everything already imported
+        self.__context = multiprocessing.get_context("fork")
+
+
+    def run(self):
+        """Starts the workers and restarts any that crash, until the
+        supervisor is sent SIGTERM or SIGINT, and then stops them.
+        """
+        previous_handlers = {
+            signum: signal.signal(signum, self.__stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            while not self.__stopping:
+                now = time.monotonic()
+                for number, worker in enumerate(self.__workers):
+                    if worker is None and now >= self.__restart_at[number]:
+                        self.__start_worker(number)
+
+                running = {worker.sentinel: number
+                           for number, worker in enumerate(self.__workers)
+                           if worker is not None}
+                for sentinel in wait(list(running), self.__POLL_INTERVAL):
+                    if not self.__stopping:
+                        self.__worker_exited(running[sentinel])
+        finally:
+            self.stop()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+
+    def stop(self):
+        """Tells every worker to stop and waits for them to exit, killing any
+        that take longer than the stop timeout.
+        """
+        self.__stopping = True
+        workers = [worker for worker in self.__workers if worker is not None]
+        for worker in workers:
+            worker.terminate()
+
+        deadline = time.monotonic() + self.__stop_timeout
+        for worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.is_alive():
+                logging.warning("Killing worker {} as it didn't stop in time".format(
+                    worker.pid))
+                worker.kill()
+                worker.join()
+        self.__workers = [None] * len(self.__workers)
+
+
+    def get_restarts(self):
+        """Returns the number of times a crashed worker has been started
+        again.
+
+        :return: The number of restarts
+        :rtype: int
+        """
+        return self.__restarts
+
+
+    def get_pids(self):
+        """Returns the process IDs of the workers that are running.
+
+        :return: The process IDs
+        :rtype: list
+        """
+        return [worker.pid for worker in self.__workers
+                if worker is not None and worker.is_alive()]
+
+
+    def __start_worker(self, number):
+        """Starts a worker process.
+
+        :param number: The number of the worker
+        :type number: int
+        """
+        worker = self.__context.Process(
+            target=self.__run_worker, args=(number,),
+            name="worker-{}".format(number))
+        worker.start()
+        self.__workers[number] = worker
+        self.__started[number] = time.monotonic()
+        logging.info("Started worker {} (pid {})".format(number, worker.pid))
+
+
+    def __run_worker(self, number):
+        """Runs in a worker process, putting back the signal handling that
+        was replaced in the supervisor before running the worker's target.
+
+        :param number: The number of the worker
+        :type number: int
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Leaving the supervisor to stop the workers when Ctrl+C is pressed
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.__target(number)
+
+
+    def __worker_exited(self, number):
+        """Schedules a worker that has crashed to be started again.
+
+        :param number: The number of the worker
+        :type number: int
+        """
+        worker = self.__workers[number]
+        worker.join()
+        self.__workers[number] = None
+        self.__restarts += 1
+
+        # Backing off a worker that keeps crashing as soon as it starts
+        now = time.monotonic()
+        if now - self.__started[number] >= self.__STABLE_TIME:
+            self.__delays[number] = self.__RESTART_DELAY
+        delay = self.__delays[number]
+        self.__delays[number] = min(delay * 2, self.__MAX_RESTART_DELAY)
+        self.__restart_at[number] = now + delay
+        logging.warning("Worker {} (pid {}) exited with code {}, restarting in {} seconds".format(
+            number, worker.pid, worker.exitcode, delay))
+
+
+    def __stop(self, signum, frame):
+        """Handles SIGTERM and SIGINT by stopping the supervisor's loop.
+
+        :param signum: The signal's number
+        :type signum: int
+        :param frame: The frame that was running
+        :type frame: frame
+        """
+        logging.info("Stopping workers")
+        self.__stopping = True
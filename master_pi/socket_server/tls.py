@@ -0,0 +1,110 @@
+import datetime, ipaddress, os, ssl
+
+TLS_CIPHERS = ":".join([
+    "ECDHE-ECDSA-CHACHA20-POLY1305",
+    "ECDHE-RSA-CHACHA20-POLY1305",
+    "ECDHE-ECDSA-AES128-GCM-SHA256",
+    "ECDHE-RSA-AES128-GCM-SHA256"
+])
+"""The TLS 1.2 cipher suites that are allowed, cheapest first on a Raspberry
+Pi, whose CPU has no AES instructions. Every one uses an ephemeral ECDH key
+exchange. This must match the Agent Pi's socket_client/tls.py"""
+TLS_CURVE = "prime256v1"
+"""The curve used for the ECDH key exchange in TLS 1.2"""
+
+
+def create_server_context(certfile, keyfile):
+    """Creates the TLS settings for the socket server.\n
+    Agent Pis that reconnect can resume their previous session with a session
+    ticket, skipping the key exchange and certificate checks of a full
+    handshake.
+
+    :param certfile: The path of the server's certificate
+    :type certfile: string
+    :param keyfile: The path of the certificate's private key
+    :type keyfile: string
+    :return: The TLS settings
+    :rtype: ssl.SSLContext
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS_CIPHERS)
+    context.set_ecdh_curve(TLS_CURVE)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def create_client_context(cafile):
+    """Creates the TLS settings for connecting to the socket server, as an
+    Agent Pi does.\n
+    The server's certificate is checked against the given certificate rather
+    than its host name, as Agent Pis connect to the Master Pi by IP address
+    and its certificate is usually self-signed.
+
+    :param cafile: The path of the server's certificate, or of the certificate
+        authority that signed it
+    :type cafile: string
+    :return: The TLS settings
+    :rtype: ssl.SSLContext
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    # Resuming a TLS 1.2 session skips the key exchange, while resuming a
+    # TLS 1.3 one still does it and so is hardly quicker than a full handshake
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.maximum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS_CIPHERS)
+    context.check_hostname = False
+    context.load_verify_locations(cafile)
+    return context
+
+
+def create_self_signed_cert(certfile, keyfile, host="127.0.0.1", days=365):
+    """Creates a self-signed certificate for the socket server and its private
+    key, an ECDSA key on the P-256 curve which is much cheaper to sign
+    handshakes with than an RSA key.
+
+    :param certfile: The path the certificate is written to
+    :type certfile: string
+    :param keyfile: The path the private key is written to
+    :type keyfile: string
+    :param host: The IP address or host name of the Master Pi
+    :type host: string
+    :param days: The number of days the certificate is valid for
+    :type days: int
+    """
+    # Importing here as this is only needed to set up the server
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    try:
+        alternative_name = x509.IPAddress(ipaddress.ip_address(host))
+    except ValueError:
+        alternative_name = x509.DNSName(host)
+    now = datetime.datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=days))
+            .add_extension(x509.SubjectAlternativeName([alternative_name]),
+                           critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                           critical=True)
+            .sign(key, hashes.SHA256(), default_backend()))
+
+    # Only letting the owner read the private key
+    with open(os.open(keyfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600),
+              "wb") as file:
+        file.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()))
+    with open(certfile, "wb") as file:
+        file.write(cert.public_bytes(serialization.Encoding.PEM))
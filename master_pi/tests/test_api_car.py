@@ -1,4 +1,4 @@
-import pytest, json
+import pytest, json, mock
 
 class TestApiCarEndpoints:
     def test_search(self, client):
@@ -237,6 +237,30 @@ class TestApiCarEndpoints:
         assert (get_response['cars']['location'] == location)
 
 
+    def test_change_car_locations(self, client):
+        """Testing that the locations of many cars are changed at once and
+        that cars that don't exist are skipped
+        """
+        response = client.post(
+            '/api/setlocations',
+            json={
+                "locations": [
+                    { "car_id": 1, "location": "-37.800000,144.900000" },
+                    { "car_id": 3, "location": "-37.810000,144.910000" },
+                    { "car_id": 99, "location": "-37.820000,144.920000" }
+                ]
+            }
+        )
+        expected_data = b'{"message":"Car locations updated"}\n'
+        first = json.loads(client.get('/api/cars?id=1').data)
+        third = json.loads(client.get('/api/cars?id=3').data)
+
+        assert (response.status == '200 OK')
+        assert (response.data == expected_data)
+        assert (first['cars']['location'] == "-37.800000,144.900000")
+        assert (third['cars']['location'] == "-37.810000,144.910000")
+
+
     def test_change_car_fail_invalid_id(self, client):
         """Testing that changing a car's location fails due to an invalid id
         """
@@ -441,3 +465,103 @@ class TestApiCarEndpoints:
 
         assert (response.status == '401 UNAUTHORIZED')
         assert (response.data == expected_data)
+
+
+    def test_lock_cars_success(self, client):
+        """Testing that an admin can unlock a group of cars by their ids and is
+        told which of them acknowledged it
+        """
+        with mock.patch("app.blueprints.api_car.push_event_to_cars",
+                return_value={ 1: "acknowledged", 2: "not_connected" }) as push:
+            response = client.post(
+                '/api/cars/lock',
+                json={
+                    "username": "admin",
+                    "lock": False,
+                    "car_ids": [1, 2, 99]
+                }
+            )
+        data = json.loads(response.data)
+        get_response = json.loads(client.get('/api/cars?id=2').data)
+
+        assert (response.status == '200 OK')
+        assert (data['cars'] == { "1": "acknowledged", "2": "not_connected" })
+        assert (data['summary'] == { "cars": 2, "acknowledged": 1, "not_connected": 1 })
+        assert (data['not_found'] == [99])
+        assert (get_response['cars']['is_locked'] == False)
+        push.assert_called_once_with([1, 2], "remote_unlock", 5)
+
+
+    def test_lock_cars_region(self, client):
+        """Testing that cars are chosen by the area they are in
+        """
+        with mock.patch("app.blueprints.api_car.push_event_to_cars",
+                return_value={ 1: "acknowledged" }) as push:
+            response = client.post(
+                '/api/cars/lock',
+                json={
+                    "username": "admin",
+                    "lock": True,
+                    "region": {
+                        "min_latitude": -37.81,
+                        "min_longitude": 144.96,
+                        "max_latitude": -37.80,
+                        "max_longitude": 144.97
+                    },
+                    "timeout": 2
+                }
+            )
+
+        assert (response.status == '200 OK')
+        push.assert_called_once_with([1], "remote_lock", 2)
+
+
+    def test_lock_cars_fail_invalid_role(self, client):
+        """Testing that locking a group of cars fails when the user requesting
+        it is not an admin
+        """
+        response = client.post(
+            '/api/cars/lock',
+            json={
+                "username": "dummy",
+                "lock": True,
+                "car_ids": [1]
+            }
+        )
+        expected_data = b'{"message":{"user":["User is not an admin."]}}\n'
+
+        assert (response.status == '401 UNAUTHORIZED')
+        assert (response.data == expected_data)
+
+
+    def test_lock_cars_fail_unknown_user(self, client):
+        """Testing that locking a group of cars fails when the user requesting
+        it does not exist
+        """
+        response = client.post(
+            '/api/cars/lock',
+            json={
+                "username": "nobody",
+                "lock": True,
+                "car_ids": [1]
+            }
+        )
+        expected_data = b'{"message":{"user":["User does not exist."]}}\n'
+
+        assert (response.status == '404 NOT FOUND')
+        assert (response.data == expected_data)
+
+
+    def test_lock_cars_fail_no_cars(self, client):
+        """Testing that locking a group of cars fails when neither their ids
+        nor a region are given
+        """
+        response = client.post(
+            '/api/cars/lock',
+            json={
+                "username": "admin",
+                "lock": True
+            }
+        )
+
+        assert (response.status == '400 BAD REQUEST')
@@ -0,0 +1,115 @@
+import asyncio, json, pytest, mock
+from socket_server.connection import Connection
+from socket_server.protocol import (FrameProtocol, HEADER, IMAGE, JSON,
+    RESPONSE, TEXT, decode_response)
+# The connection module raises the error from the protocol module on the path
+from protocol import FrameError
+
+def make_connection(*frames):
+    """Creates a connection that receives the given frames and then sees the
+    Agent Pi disconnect. Must be called while the event loop is running.
+    """
+    protocol = FrameProtocol(mock.AsyncMock(), max_queued=100)
+    transport = mock.Mock()
+    transport.is_closing.return_value = False
+    transport.get_extra_info.return_value = ("127.0.0.1", 50000)
+    protocol.connection_made(transport)
+
+    data = b"".join(HEADER.pack(message_type, len(payload)) + payload
+                    for message_type, payload in frames)
+    while data:
+        buffer = protocol.get_buffer(-1)
+        nbytes = min(len(buffer), len(data))
+        buffer[:nbytes] = data[:nbytes]
+        protocol.buffer_updated(nbytes)
+        data = data[nbytes:]
+    protocol.connection_lost(None)
+    return Connection(protocol), transport
+
+class TestConnection:
+    def test_receive_frame(self):
+        """Tests that messages of any type are read until the Agent Pi
+        disconnects
+        """
+        async def run():
+            connection, transport = make_connection((TEXT, b"Login"))
+            return [await connection.receive_frame(),
+                    await connection.receive_frame()]
+
+        assert(asyncio.run(run()) == [(TEXT, b"Login"), None])
+
+    def test_receive_json(self):
+        """Tests that a JSON message is decoded
+        """
+        async def run():
+            connection, transport = make_connection(
+                (JSON, json.dumps({ "car_id": 1 }).encode()))
+            return await connection.receive_json()
+
+        assert(asyncio.run(run()) == { "car_id": 1 })
+
+    def test_receive_image(self):
+        """Tests that an image is received whole in one message and left
+        encoded
+        """
+        image = bytes(range(256)) * 20
+
+        async def run():
+            connection, transport = make_connection((IMAGE, image))
+            return await connection.receive_image()
+
+        assert(asyncio.run(run()) == image)
+
+    def test_receive_wrong_type(self):
+        """Tests that a message of the wrong type is rejected
+        """
+        async def run():
+            connection, transport = make_connection((TEXT, b"Login"))
+            await connection.receive_json()
+
+        with pytest.raises(FrameError):
+            asyncio.run(run())
+
+    def test_receive_disconnected(self):
+        """Tests that an Agent Pi disconnecting while a message is expected is
+        reported
+        """
+        async def run():
+            connection, transport = make_connection()
+            await connection.receive_json()
+
+        with pytest.raises(ConnectionResetError):
+            asyncio.run(run())
+
+    def test_send_text(self):
+        """Tests that a string is sent as a text message
+        """
+        async def run():
+            connection, transport = make_connection()
+            await connection.send_text("OK")
+            return transport
+
+        transport = asyncio.run(run())
+        transport.writelines.assert_called_with([HEADER.pack(TEXT, 2), b"OK"])
+
+    def test_send_response(self):
+        """Tests that a response is sent with the id of its request
+        """
+        async def run():
+            connection, transport = make_connection()
+            await connection.send_response(7, '{"message": "OK"}')
+            return transport
+
+        transport = asyncio.run(run())
+        header, payload = transport.writelines.call_args[0][0]
+        assert(HEADER.unpack(header)[0] == RESPONSE)
+        assert(decode_response(payload) == (7, b'{"message": "OK"}'))
+
+    def test_get_address(self):
+        """Tests that the Agent Pi's address is kept with its connection
+        """
+        async def run():
+            connection, transport = make_connection()
+            return connection.get_address()
+
+        assert(asyncio.run(run()) == ("127.0.0.1", 50000))
@@ -0,0 +1,53 @@
+import asyncio, pytest, mock
+from socket_server.dispatcher import Dispatcher, UnknownCommandError
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher()
+    dispatcher.register(1, "Login", mock.AsyncMock(return_value='{"user": "test"}'))
+    return dispatcher
+
+class TestDispatcher:
+    def test_dispatch(self, dispatcher):
+        """Tests that a command can be run by its opcode or its name
+        """
+        assert(asyncio.run(dispatcher.dispatch(1, {})) == '{"user": "test"}')
+        assert(asyncio.run(dispatcher.dispatch("Login", {})) == '{"user": "test"}')
+        assert(dispatcher.get_opcode("Login") == 1)
+        assert(dispatcher.get_name(1) == "Login")
+        assert(dispatcher.get_stats()["Login"]["calls"] == 2)
+
+    def test_unknown_command(self, dispatcher):
+        """Tests that a command without a handler is refused
+        """
+        assert(dispatcher.get_opcode("Fly") is None)
+        assert(dispatcher.get_opcode(2) is None)
+        with pytest.raises(UnknownCommandError):
+            asyncio.run(dispatcher.dispatch(2, {}))
+
+    def test_error_counted(self, dispatcher):
+        """Tests that a handler's errors are counted and passed on, and that the
+        time it took is still recorded
+        """
+        async def fail(message, image):
+            await asyncio.sleep(0.01)
+            raise ValueError("Bad details")
+        dispatcher.register(2, "Add Face", fail)
+
+        with pytest.raises(ValueError):
+            asyncio.run(dispatcher.dispatch(2, {}))
+
+        stats = dispatcher.get_stats()["Add Face"]
+        assert(stats["calls"] == 1 and stats["errors"] == 1)
+        assert(stats["max_time"] >= 0.01)
+        assert(stats["total_time"] == stats["max_time"])
+
+    def test_register_replaces(self, dispatcher):
+        """Tests that registering an opcode again replaces its handler and name
+        """
+        dispatcher.register(1, "Login With Password",
+                            mock.AsyncMock(return_value='{"user": "other"}'))
+
+        assert(dispatcher.get_opcode("Login") is None)
+        assert(asyncio.run(dispatcher.dispatch("Login With Password", {})) ==
+               '{"user": "other"}')
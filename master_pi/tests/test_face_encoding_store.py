@@ -0,0 +1,190 @@
+import os, pickle, pytest
+import numpy as np
+from socket_server.face_encoding_store import FaceEncodingStore
+
+def write_encodings(path, encodings, names):
+    store = FaceEncodingStore(path)
+    store.set_encodings(encodings, names)
+    store.save()
+
+@pytest.fixture
+def encodings_path(tmp_path):
+    path = str(tmp_path / "encodings.bin")
+    write_encodings(path, [np.zeros(128), np.ones(128)], ["alice", "bob"])
+    return path
+
+class TestFaceEncodingStore:
+    def test_load(self, encodings_path):
+        """Tests that the encodings are loaded into one contiguous float32
+        matrix with a parallel array of names
+        """
+        store = FaceEncodingStore(encodings_path)
+        store.load()
+
+        encodings = store.get_encodings()
+        assert(encodings.shape == (2, 128))
+        assert(encodings.dtype == np.float32)
+        assert(encodings.flags["C_CONTIGUOUS"])
+        assert(list(store.get_names()) == ["alice", "bob"])
+
+    def test_load_missing_file(self, tmp_path):
+        """Tests that a missing encodings file leaves the store empty
+        """
+        store = FaceEncodingStore(str(tmp_path / "missing.bin"))
+        store.load()
+
+        assert(len(store) == 0)
+        assert(store.get_encodings().shape == (0, 128))
+
+    def test_reload_if_changed(self, encodings_path):
+        """Tests that the file is only read again after it has been changed
+        """
+        store = FaceEncodingStore(encodings_path)
+        store.load()
+        assert(store.reload_if_changed() is False)
+
+        write_encodings(encodings_path, [np.zeros(128)], ["carol"])
+        os.utime(encodings_path, ns=(0, 0))
+
+        assert(store.reload_if_changed() is True)
+        assert(list(store.get_names()) == ["carol"])
+
+    def test_replace_user(self, encodings_path):
+        """Tests that replacing one user's encodings leaves every other user's
+        encodings in place and is written back to disk
+        """
+        store = FaceEncodingStore(encodings_path)
+        store.load()
+        store.replace_user("alice", [np.full(128, 2.0), np.full(128, 3.0)])
+        store.save()
+        assert(store.reload_if_changed() is False)
+
+        reloaded = FaceEncodingStore(encodings_path)
+        reloaded.load()
+        assert(list(reloaded.get_names()) == ["bob", "alice", "alice"])
+        assert(reloaded.get_encodings()[2][0] == 3.0)
+
+    def test_write(self, encodings_path):
+        """Tests that encodings written as they are produced can be loaded
+        back, and are loaded into the store
+        """
+        rows = (row for row in [
+            ("alice", [np.zeros(128), np.ones(128)]),
+            ("bob", []),
+            ("carol", [np.full(128, 2.0)])
+        ])
+        store = FaceEncodingStore(encodings_path)
+        store.write(rows)
+        assert(list(store.get_names()) == ["alice", "alice", "carol"])
+
+        store = FaceEncodingStore(encodings_path)
+        store.load()
+        assert(list(store.get_names()) == ["alice", "alice", "carol"])
+        assert((store.get_encodings()[2] == 2.0).all())
+
+    def test_write_failure_keeps_file(self, tmp_path, encodings_path):
+        """Tests that the old file is kept if producing the encodings fails
+        """
+        def rows():
+            yield "carol", [np.zeros(128)]
+            raise RuntimeError("worker failed")
+
+        store = FaceEncodingStore(encodings_path)
+        with pytest.raises(RuntimeError):
+            store.write(rows())
+
+        store.load()
+        assert(list(store.get_names()) == ["alice", "bob"])
+        assert(os.listdir(str(tmp_path)) == ["encodings.bin"])
+
+    def test_load_is_memory_mapped(self, encodings_path):
+        """Tests that the encodings matrix is mapped from the file rather than
+        copied into memory
+        """
+        store = FaceEncodingStore(encodings_path)
+        store.load()
+
+        encodings = store.get_encodings()
+        while not isinstance(encodings, np.memmap) and encodings.base is not None:
+            encodings = encodings.base
+        assert(isinstance(encodings, np.memmap))
+
+    def test_save_is_atomic(self, tmp_path, encodings_path):
+        """Tests that saving replaces the file in one step and leaves no
+        temporary file behind
+        """
+        write_encodings(encodings_path, [np.ones(128)], ["carol"])
+
+        assert(os.listdir(str(tmp_path)) == ["encodings.bin"])
+
+    def test_save_empty(self, tmp_path):
+        """Tests that a store with no encodings can be saved and loaded
+        """
+        path = str(tmp_path / "encodings.bin")
+        write_encodings(path, [], [])
+
+        store = FaceEncodingStore(path)
+        store.load()
+        assert(len(store) == 0)
+
+    def test_load_invalid_file(self, tmp_path):
+        """Tests that a file that isn't an encodings file is rejected
+        """
+        path = str(tmp_path / "encodings.bin")
+        with open(path, "wb") as f:
+            f.write(pickle.dumps({ "encodings": [], "names": [] }).ljust(64, b"\0"))
+
+        with pytest.raises(ValueError):
+            FaceEncodingStore(path).load()
+
+    def test_migrate_pickle(self, tmp_path):
+        """Tests that a pickled encodings file is migrated when there is no
+        encodings file yet
+        """
+        path = str(tmp_path / "encodings.bin")
+        legacy_path = str(tmp_path / "encodings.pickle")
+        with open(legacy_path, "wb") as f:
+            f.write(pickle.dumps({
+                "encodings": [np.zeros(128), np.ones(128)],
+                "names": ["alice", "bob"]
+            }))
+
+        store = FaceEncodingStore(path, legacy_path)
+        store.load()
+
+        assert(os.path.exists(path))
+        assert(list(store.get_names()) == ["alice", "bob"])
+        assert(store.reload_if_changed() is False)
+
+    def test_add_user_encodings(self, encodings_path):
+        """Tests that adding encodings to a user keeps only that user's newest
+        encodings up to the limit
+        """
+        store = FaceEncodingStore(encodings_path)
+        store.load()
+        store.add_user_encodings("alice", [np.full(128, 2.0)], 2)
+        store.add_user_encodings("alice", [np.full(128, 3.0)], 2)
+
+        names = list(store.get_names())
+        assert(names == ["bob", "alice", "alice"])
+        assert(store.get_encodings()[1][0] == 2.0)
+        assert(store.get_encodings()[2][0] == 3.0)
+
+    def test_get_centroids(self, encodings_path):
+        """Tests that the centroid of each user is the mean of their encodings
+        and is recomputed when the encodings change
+        """
+        store = FaceEncodingStore(encodings_path)
+        store.load()
+        store.add_user_encodings("bob", [np.full(128, 3.0)], 5)
+
+        names, centroids, squared_norms = store.get_centroids()
+        assert(list(names) == ["alice", "bob"])
+        assert(np.allclose(centroids[1], 2.0))
+        assert(squared_norms[1] == pytest.approx(4.0 * 128))
+        assert(list(names[store.get_centroid_rows()])
+               == list(store.get_names()))
+
+        store.replace_user("bob", [])
+        names, centroids, squared_norms = store.get_centroids()
+        assert(list(names) == ["alice"])
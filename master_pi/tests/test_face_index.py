@@ -0,0 +1,126 @@
+import os, pytest
+import numpy as np
+from socket_server.face_encoding_store import FaceEncodingStore
+from socket_server.face_index import FaceIndex
+from socket_server.face_matcher import FaceMatcher
+
+USERS = 1000
+FACES_PER_USER = 3
+
+@pytest.fixture
+def gallery():
+    rng = np.random.default_rng(1)
+    centres = rng.normal(0, 0.1, (USERS, 128))
+    encodings = np.repeat(centres, FACES_PER_USER, axis=0)
+    encodings += rng.normal(0, 0.02, encodings.shape)
+    names = ["user{}".format(i // FACES_PER_USER) for i in range(len(encodings))]
+    probes = centres + rng.normal(0, 0.02, centres.shape)
+    return encodings, names, probes
+
+@pytest.fixture
+def store(tmp_path, gallery):
+    encodings, names, probes = gallery
+    store = FaceEncodingStore(str(tmp_path / "encodings.pickle"))
+    store.set_encodings(encodings, names)
+    return store
+
+class TestFaceIndex:
+    def test_candidates(self, tmp_path, store):
+        """Tests that a probe is only compared against part of the gallery
+        """
+        index = FaceIndex(str(tmp_path / "index.npz"), n_probe=4)
+        index.build(store.get_encodings(), store.get_signature())
+
+        candidates = index.candidates(store.get_encodings()[0])
+
+        assert(0 in candidates)
+        assert(len(candidates) < len(store))
+
+    def test_recall(self, tmp_path, store, gallery):
+        """Tests that searching the index finds the same users as comparing
+        against every encoding
+        """
+        encodings, names, probes = gallery
+        index = FaceIndex(str(tmp_path / "index.npz"))
+        index.build(store.get_encodings(), store.get_signature())
+        matcher = FaceMatcher(store, index)
+
+        agreed = 0
+        for probe in probes:
+            exact = matcher.match(probe, exact=True)
+            approximate = matcher.match(probe)
+            agreed += exact[0] == approximate[0]
+
+        assert(agreed / len(probes) >= 0.95)
+
+    def test_save_and_load(self, tmp_path, store):
+        """Tests that a saved index leaves no temporary file behind and is
+        loaded with the same lists
+        """
+        path = str(tmp_path / "index.npz")
+        index = FaceIndex(path)
+        index.build(store.get_encodings(), store.get_signature())
+        index.save()
+        assert(not [name for name in os.listdir(str(tmp_path))
+                    if name.endswith(".tmp")])
+
+        loaded = FaceIndex(path)
+        assert(loaded.is_ready(len(store), store.get_signature()) is False)
+        loaded.load()
+
+        probe = store.get_encodings()[10]
+        assert(loaded.is_ready(len(store), store.get_signature()))
+        assert(np.array_equal(loaded.candidates(probe), index.candidates(probe)))
+
+    def test_incremental_update(self, tmp_path, store):
+        """Tests that replacing a user's encodings keeps the index lined up with
+        the store and finds the new encodings
+        """
+        index = FaceIndex(str(tmp_path / "index.npz"))
+        index.build(store.get_encodings(), store.get_signature())
+        new_encoding = np.full(128, 0.05)
+
+        kept = store.replace_user("user0", [new_encoding])
+        index.keep(kept)
+        index.add(store.get_encodings()[kept.sum():], store.get_signature())
+
+        assert(index.is_ready(len(store), store.get_signature()))
+        assert(len(store) - 1 in index.candidates(new_encoding))
+        name, distance = FaceMatcher(store, index).match(new_encoding)
+        assert(name == "user0")
+
+    def test_matcher_falls_back_to_exact(self, tmp_path, store):
+        """Tests that an index that doesn't line up with the store is not used
+        """
+        index = FaceIndex(str(tmp_path / "index.npz"))
+        index.build(store.get_encodings(), store.get_signature())
+        store.replace_user("user0", [np.full(128, 0.05)])
+
+        name, distance = FaceMatcher(store, index).match(np.full(128, 0.05))
+
+        assert(index.is_ready(len(store), store.get_signature()) is False)
+        assert(name == "user0")
+
+    def test_store_rewritten_with_same_size(self, tmp_path, store):
+        """Tests that an index isn't used once another process has rewritten
+        the encodings file with the same number of encodings
+        """
+        store.save()
+        index = FaceIndex(str(tmp_path / "index.npz"))
+        index.build(store.get_encodings(), store.get_signature())
+        index.save()
+        assert(index.is_ready(len(store), store.get_signature()))
+
+        # Another process replaces a user's faces with as many new ones
+        other = FaceEncodingStore(store.get_path())
+        other.load()
+        new_encodings = [np.full(128, 0.05)] * FACES_PER_USER
+        other.replace_user("user0", new_encodings)
+        other.save()
+        store.reload_if_changed()
+        index.reload_if_changed()
+
+        name, distance = FaceMatcher(store, index).match(np.full(128, 0.05))
+
+        assert(index.is_ready(len(store), store.get_signature()) is False)
+        assert(name == "user0")
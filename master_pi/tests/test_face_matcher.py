@@ -0,0 +1,117 @@
+import pytest, mock
+import numpy as np
+from socket_server.face_encoding_store import FaceEncodingStore
+from socket_server.face_matcher import FaceMatcher
+
+@pytest.fixture
+def store(tmp_path):
+    store = FaceEncodingStore(str(tmp_path / "encodings.pickle"))
+    encodings = np.zeros((4, 128))
+    encodings[1][0] = 0.5
+    encodings[2][0] = 0.55
+    encodings[3][0] = 2.0
+    store.set_encodings(encodings, ["alice", "bob", "bob", "carol"])
+    return store
+
+class TestFaceMatcher:
+    def test_distances(self, store):
+        """Tests that the vectorised distances match a direct computation
+        """
+        probe = np.random.rand(128)
+        expected = np.linalg.norm(store.get_encodings() - probe, axis=1)
+
+        distances = FaceMatcher(store).distances(probe)
+
+        assert(np.allclose(distances, expected, atol=1e-4))
+
+    def test_match_nearest(self, store):
+        """Tests that the user with the nearest encoding is matched along with
+        the distance to it
+        """
+        probe = np.zeros(128)
+        probe[0] = 0.2
+
+        name, distance = FaceMatcher(store).match(probe)
+
+        assert(name == "alice")
+        assert(distance == pytest.approx(0.2, abs=1e-4))
+
+    def test_match_top_k_voting(self, store):
+        """Tests that with voting the user with the most nearby encodings is
+        matched even if another user has the single nearest encoding
+        """
+        probe = np.zeros(128)
+        probe[0] = 0.2
+
+        matcher = FaceMatcher(store, centroid_margin=None)
+        name, distance = matcher.match(probe, top_k=3)
+
+        assert(name == "bob")
+        assert(distance == pytest.approx(0.3, abs=1e-4))
+
+    def test_match_outside_tolerance(self, store):
+        """Tests that no user is matched if every encoding is too far away
+        """
+        probe = np.full(128, 5.0)
+
+        assert(FaceMatcher(store).match(probe) == (None, None))
+        assert(FaceMatcher(store).match(probe, top_k=3) == (None, None))
+
+    def test_match_tolerance(self, store):
+        """Tests that the tolerance decides what distance counts as a match
+        """
+        probe = np.zeros(128)
+        probe[0] = 1.25
+
+        assert(FaceMatcher(store).match(probe, tolerance=0.6)[0] is None)
+        assert(FaceMatcher(store).match(probe, tolerance=1.0)[0] == "bob")
+
+    def test_match_empty_store(self, tmp_path):
+        """Tests that matching against an empty store finds no user
+        """
+        store = FaceEncodingStore(str(tmp_path / "encodings.pickle"))
+
+        assert(FaceMatcher(store).match(np.zeros(128)) == (None, None))
+
+    def test_match_centroid(self, store):
+        """Tests that a probe clearly nearest to one user's centroid is matched
+        on the centroid
+        """
+        probe = np.zeros(128)
+        probe[0] = 0.5
+
+        name, distance = FaceMatcher(store).match(probe)
+
+        assert(name == "bob")
+        assert(distance == pytest.approx(0.025, abs=1e-4))
+
+    def test_match_ambiguous_centroid_falls_back(self, store):
+        """Tests that a probe about as near to two users' centroids is matched
+        against their individual encodings
+        """
+        probe = np.zeros(128)
+        probe[0] = 0.25
+
+        name, distance = FaceMatcher(store, centroid_margin=0.1).match(probe)
+
+        assert(name == "alice")
+        assert(distance == pytest.approx(0.25, abs=1e-4))
+
+    def test_match_centroid_narrowed_by_index(self, store):
+        """Tests that with an index only the centroids of the users that own
+        the index's candidates are compared against
+        """
+        probe = np.zeros(128)
+        probe[0] = 0.3
+        index = mock.Mock()
+        index.is_ready.return_value = True
+        index.candidates.return_value = np.array([1, 2])
+
+        # Alice's centroid is nearly as near, but isn't one of the candidates
+        name, distance = FaceMatcher(store, index, centroid_margin=0.1).match(probe)
+
+        assert(name == "bob")
+        assert(distance == pytest.approx(0.225, abs=1e-4))
+        # Without the index the centroids are too close to call
+        name, distance = FaceMatcher(store, centroid_margin=0.1).match(probe)
+        assert(distance == pytest.approx(0.2, abs=1e-4))
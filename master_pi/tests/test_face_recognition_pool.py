@@ -0,0 +1,28 @@
+import pytest, time
+from socket_server.face_recognition_pool import FaceRecognitionPool, PoolBusyError
+
+@pytest.fixture
+def pool():
+    pool = FaceRecognitionPool(workers=1, max_pending=2, timeout=0.1)
+    yield pool
+    pool.shutdown()
+
+class TestFaceRecognitionPool:
+    def test_submit(self, pool):
+        """Tests that a job is run in a worker process
+        """
+        assert(pool.submit(abs, -3).result(10) == 3)
+
+    def test_full_queue_is_busy(self, pool):
+        """Tests that jobs are turned away once the queue is full and accepted
+        again once a job has finished
+        """
+        first = pool.submit(time.sleep, 0.5)
+        pool.submit(time.sleep, 0)
+
+        with pytest.raises(PoolBusyError):
+            pool.submit(time.sleep, 0)
+
+        first.result(10)
+        time.sleep(0.1)
+        pool.submit(time.sleep, 0).result(10)
@@ -1,5 +1,6 @@
 import pytest, mock
-from mock import mock_open
+import numpy as np
+from socket_server.face_encoding_store import FaceEncodingStore
 from socket_server.face_recognition_util import FaceRecognitionUtil
 
 @pytest.fixture
@@ -7,25 +8,96 @@ def fru():
     fru = FaceRecognitionUtil()
     return fru
 
+@pytest.fixture
+def tmp_fru(tmp_path):
+    # Writing the encodings and index somewhere other than the real ones
+    with mock.patch.object(FaceRecognitionUtil, '_FaceRecognitionUtil__ENCODINGS_PATH',
+                           str(tmp_path / "encodings.bin")), \
+         mock.patch.object(FaceRecognitionUtil, '_FaceRecognitionUtil__INDEX_PATH',
+                           str(tmp_path / "encodings.index.npz")):
+        yield FaceRecognitionUtil()
+
 class TestFaceRecognitionUtil:
+    @mock.patch('face_encoding_store.FaceEncodingStore.save')
+    @mock.patch('socket_server.face_recognition_util.FaceRecognitionUtil.encode_image')
     @mock.patch('socket_server.face_recognition_util.cv2.imwrite')
-    def test_add_face(self, mock_cv2, fru):
+    def test_add_face(self, mock_cv2, mock_encode, mock_save, fru):
         """Tests to make sure that images are being saved in the correct
         directory
         """
         username = "test"
-        save_path = "./socket_server/dataset/" + username + "/face.jpg"
+        save_folder = "./socket_server/dataset/" + username + "/"
         mock_image = "mock_image"
+        mock_encode.return_value = [np.zeros(128)]
 
         fru.add_face(username, mock_image)
 
-        mock_cv2.assert_called_with(save_path, mock_image)
-        
-    @mock.patch("builtins.open", new_callable=mock_open, read_data="data")
-    def test_encode_faces(self, mock_file, fru):
+        save_path, image = mock_cv2.call_args[0]
+        assert(save_path.startswith(save_folder + "face_"))
+        assert(save_path.endswith(".jpg"))
+        assert(image == mock_image)
+
+    @mock.patch('face_encoding_store.FaceEncodingStore.save')
+    @mock.patch('socket_server.face_recognition_util.FaceRecognitionUtil.encode_image')
+    @mock.patch('socket_server.face_recognition_util.cv2.imwrite')
+    def test_add_face_without_face(self, mock_cv2, mock_encode, mock_save, fru):
+        """Tests that an image without a face is not saved or encoded
+        """
+        mock_encode.return_value = []
+
+        fru.add_face("test", "mock_image")
+
+        mock_cv2.assert_not_called()
+        mock_save.assert_not_called()
+
+    @mock.patch('face_encoding_store.FaceEncodingStore.save')
+    @mock.patch('socket_server.face_recognition_util.FaceRecognitionUtil.encode_image')
+    @mock.patch('socket_server.face_recognition_util.cv2.imwrite')
+    def test_add_face_encodes_new_image_only(self, mock_cv2, mock_encode, mock_save, fru):
+        """Tests that adding a face encodes only the new image and adds it to
+        that user's encodings without touching anyone else's
+        """
+        fru.get_store().set_encodings([np.ones(128), np.ones(128)], ["other", "test"])
+        mock_encode.return_value = [np.zeros(128)]
+
+        fru.add_face("test", "mock_image")
+
+        mock_encode.assert_called_once_with("mock_image")
+        mock_save.assert_called()
+        names = list(fru.get_store().get_names())
+        assert(names == ["other", "test", "test"])
+        assert(not fru.get_store().get_encodings()[2].any())
+
+    @mock.patch('socket_server.face_recognition_util.paths.list_images')
+    def test_encode_faces(self, mock_list, tmp_fru):
         """Tests to make sure that the encoded faces are being saved to the
-        correct directory
+        encodings file
         """
-        fru.encode_faces()
+        mock_list.return_value = []
+
+        tmp_fru.encode_faces()
+
+        store = tmp_fru.get_store()
+        assert(store.get_path().endswith("encodings.bin"))
+        assert(store.get_signature() == store.get_file_signature())
+        assert(len(store) == 0)
+
+    @mock.patch('socket_server.face_recognition_util.encode_image_file')
+    @mock.patch('socket_server.face_recognition_util.paths.list_images')
+    def test_encode_faces_collects_every_image(self, mock_list, mock_encode, tmp_fru):
+        """Tests that the encodings of every image in the dataset are stored
+        under the name of the folder the image is in
+        """
+        mock_list.return_value = [
+            "./socket_server/dataset/alice/face.jpg",
+            "./socket_server/dataset/bob/face.jpg"
+        ]
+        mock_encode.return_value = [np.zeros(128)]
+
+        tmp_fru.encode_faces(workers=1)
 
-        mock_file.assert_called_with("./socket_server/encodings.pickle", "wb")
+        assert(mock_encode.call_count == 2)
+        assert(sorted(tmp_fru.get_store().get_names()) == ["alice", "bob"])
+        store = FaceEncodingStore(tmp_fru.get_store().get_path())
+        store.load()
+        assert(sorted(store.get_names()) == ["alice", "bob"])
@@ -0,0 +1,22 @@
+import cv2, pytest
+import numpy as np
+from socket_server.image_codec import decode_image
+
+class TestImageCodec:
+    @pytest.mark.parametrize("image_format", [".jpg", ".png"])
+    def test_decode_image(self, image_format):
+        """Tests that JPEG and PNG images sent by an Agent Pi are decoded
+        """
+        image = np.full((48, 64, 3), 128, dtype=np.uint8)
+        success, data = cv2.imencode(image_format, image)
+
+        decoded = decode_image(bytearray(data.tobytes()))
+
+        assert(decoded.shape == image.shape)
+        assert(np.abs(decoded.astype(int) - 128).max() <= 2)
+
+    def test_decode_invalid_image(self):
+        """Tests that data that isn't an image is rejected
+        """
+        with pytest.raises(ValueError):
+            decode_image(b"not an image")
@@ -0,0 +1,84 @@
+import asyncio, pytest, mock
+from socket_server.position_buffer import PositionBuffer
+
+@pytest.fixture
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+class TestPositionBuffer:
+    def test_latest_position_saved(self, event_loop):
+        """Tests that only the latest position of each car is saved, and that
+        a position older than the one held is ignored
+        """
+        save = mock.AsyncMock()
+        positions = PositionBuffer(save, 60)
+        positions.record(1, -37808880, 144965179, 100)
+        positions.record(1, -37808900, 144965200, 101)
+        positions.record(1, -37808000, 144965000, 99)
+        positions.record(2, -37810219, 144961395, 100)
+
+        # Code to be tested
+        saved = event_loop.run_until_complete(positions.flush())
+
+        assert(saved == 2)
+        save.assert_awaited_once_with({
+            1: (-37808900, 144965200, 101),
+            2: (-37810219, 144961395, 100)
+        })
+        assert(positions.get_positions() == {})
+        assert(positions.get_stats() == {
+            "received": 4,
+            "coalesced": 2,
+            "saved": 2,
+            "failed": 0
+        })
+
+        # Checking nothing is saved when no car has moved
+        assert(event_loop.run_until_complete(positions.flush()) == 0)
+        assert(save.await_count == 1)
+
+    def test_failed_save_kept(self, event_loop):
+        """Tests that positions that couldn't be saved are kept for the next
+        save unless newer ones have arrived
+        """
+        async def save(batch):
+            # A car sends a newer position while the save is running
+            positions.record(2, 3, 3, 200)
+            raise ConnectionError("API unavailable")
+        positions = PositionBuffer(save, 60)
+        positions.record(1, 1, 1, 100)
+        positions.record(2, 2, 2, 100)
+
+        # Code to be tested
+        saved = event_loop.run_until_complete(positions.flush())
+
+        assert(saved == 0)
+        assert(positions.get_positions() == {
+            1: (1, 1, 100),
+            2: (3, 3, 200)
+        })
+        assert(positions.get_stats()["failed"] == 1)
+
+    def test_saved_periodically(self, event_loop):
+        """Tests that positions are saved every interval and once more when
+        the buffer is stopped
+        """
+        save = mock.AsyncMock()
+        positions = PositionBuffer(save, 0.05)
+
+        async def stream():
+            positions.start()
+            positions.record(1, 1, 1, 100)
+            await asyncio.sleep(0.2)
+            positions.record(1, 2, 2, 101)
+            await positions.stop()
+
+        # Code to be tested
+        event_loop.run_until_complete(stream())
+
+        assert(save.await_args_list == [
+            mock.call({ 1: (1, 1, 100) }),
+            mock.call({ 1: (2, 2, 101) })
+        ])
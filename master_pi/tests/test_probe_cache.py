@@ -0,0 +1,68 @@
+import pytest, mock
+import numpy as np
+from socket_server.probe_cache import ProbeCache
+
+@pytest.fixture
+def image():
+    return np.zeros((4, 4, 3), dtype=np.uint8)
+
+class TestProbeCache:
+    def test_key(self, image):
+        """Tests that images with the same contents share a key and images
+        with different contents don't
+        """
+        cache = ProbeCache()
+        other = image.copy()
+        other[0][0][0] = 1
+
+        assert(cache.key(image) == cache.key(image.copy()))
+        assert(cache.key(image) != cache.key(other))
+        assert(cache.key(image) != cache.key(image.reshape(8, 2, 3)))
+
+    def test_hit_and_miss(self, image):
+        """Tests that a remembered result is returned and counted as a hit
+        """
+        cache = ProbeCache()
+        key = cache.key(image)
+
+        assert(cache.get(key, 1) is None)
+        cache.put(key, 1, ("test", 0.25))
+        assert(cache.get(key, 1) == ("test", 0.25))
+        assert(cache.get_stats() == { "hits": 1, "misses": 1, "size": 1 })
+
+    def test_generation_change_invalidates(self, image):
+        """Tests that every result is dropped when the encodings change
+        """
+        cache = ProbeCache()
+        key = cache.key(image)
+        cache.put(key, 1, ("test", 0.25))
+
+        assert(cache.get(key, 2) is None)
+        assert(cache.get_stats()["size"] == 0)
+
+    def test_least_recently_used_is_dropped(self):
+        """Tests that the least recently used result is dropped once the cache
+        is full
+        """
+        cache = ProbeCache(max_size=2)
+        cache.put(b"a", 1, "a")
+        cache.put(b"b", 1, "b")
+        cache.get(b"a", 1)
+        cache.put(b"c", 1, "c")
+
+        assert(cache.get(b"a", 1) == "a")
+        assert(cache.get(b"b", 1) is None)
+        assert(cache.get(b"c", 1) == "c")
+
+    @mock.patch('socket_server.probe_cache.time.monotonic')
+    def test_expiry(self, mock_time, image):
+        """Tests that a result is forgotten once it has expired
+        """
+        cache = ProbeCache(ttl=60)
+        mock_time.return_value = 0
+        cache.put(b"a", 1, "a")
+
+        mock_time.return_value = 59
+        assert(cache.get(b"a", 1) == "a")
+        mock_time.return_value = 61
+        assert(cache.get(b"a", 1) is None)
@@ -0,0 +1,50 @@
+import pytest, mock
+import numpy as np
+from socket_server.probe_preprocessor import ProbePreprocessor
+
+@pytest.fixture
+def image():
+    return np.zeros((480, 640, 3), dtype=np.uint8)
+
+class TestProbePreprocessor:
+    @mock.patch('socket_server.probe_preprocessor.face_recognition.face_locations')
+    def test_detects_on_scaled_down_image(self, mock_locations, image):
+        """Tests that faces are detected on an image scaled down to the
+        detection width and the boxes are mapped back to full resolution
+        """
+        mock_locations.return_value = [(30, 100, 90, 40)]
+        preprocessor = ProbePreprocessor(detection_width=160)
+
+        rgb, boxes = preprocessor.prepare(image)
+
+        detected_on = mock_locations.call_args[0][0]
+        assert(detected_on.shape[:2] == (120, 160))
+        assert(rgb.shape == image.shape)
+        assert(boxes == [(120, 400, 360, 160)])
+
+    @mock.patch('socket_server.probe_preprocessor.face_recognition.face_locations')
+    def test_small_image_is_not_scaled_up(self, mock_locations, image):
+        """Tests that an image narrower than the detection width is detected at
+        its own size
+        """
+        mock_locations.return_value = [(30, 100, 90, 40)]
+        preprocessor = ProbePreprocessor(detection_width=1000)
+
+        rgb, boxes = preprocessor.prepare(image)
+
+        assert(mock_locations.call_args[0][0].shape == image.shape)
+        assert(boxes == [(30, 100, 90, 40)])
+
+    @mock.patch('socket_server.probe_preprocessor.face_recognition.face_locations')
+    def test_largest_face_only(self, mock_locations, image):
+        """Tests that only the largest face is kept unless every face is asked
+        for
+        """
+        mock_locations.return_value = [(0, 20, 20, 0), (10, 100, 90, 20)]
+
+        rgb, boxes = ProbePreprocessor(detection_width=None).prepare(image)
+        assert(boxes == [(10, 100, 90, 20)])
+
+        rgb, boxes = ProbePreprocessor(detection_width=None,
+                                       largest_face_only=False).prepare(image)
+        assert(len(boxes) == 2)
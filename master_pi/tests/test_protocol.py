@@ -0,0 +1,226 @@
+import asyncio, pytest, mock
+from socket_server.protocol import (ACK_PAYLOAD, ADD_FACE, FrameError,
+    FrameProtocol, HEADER, IMAGE, JSON, MAX_PAYLOAD, REGISTER_PAYLOAD,
+    TELEMETRY_PAYLOAD, TEXT, decode_ack, decode_command, decode_register,
+    decode_request, decode_response, decode_telemetry, encode_command,
+    encode_header, encode_request, encode_response)
+
+def frame(message_type, payload):
+    return HEADER.pack(message_type, len(payload)) + payload
+
+def feed(protocol, data, chunk_size):
+    """Passes data to the protocol the way the transport does, receiving at
+    most chunk_size bytes into each buffer it asks for
+    """
+    position = 0
+    while position < len(data):
+        buffer = protocol.get_buffer(-1)
+        nbytes = min(len(buffer), chunk_size, len(data) - position)
+        buffer[:nbytes] = data[position:position + nbytes]
+        protocol.buffer_updated(nbytes)
+        position += nbytes
+
+def connect(max_queued=8):
+    """Creates a protocol that is connected to a mocked transport
+    """
+    protocol = FrameProtocol(mock.AsyncMock(), max_queued=max_queued)
+    transport = mock.Mock()
+    transport.is_closing.return_value = False
+    protocol.connection_made(transport)
+    return protocol, transport
+
+async def read_all(protocol):
+    frames = []
+    frame = await protocol.read_frame()
+    while frame is not None:
+        frames.append((frame[0], bytes(frame[1])))
+        frame = await protocol.read_frame()
+    return frames
+
+class TestFrameProtocol:
+    @pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+    def test_frames_split_anywhere(self, chunk_size):
+        """Tests that frames are received whole however the data is split into
+        packets
+        """
+        frames = [(TEXT, b"Login"), (JSON, b'{"username": "test"}'),
+                  (TEXT, b""), (IMAGE, bytes(range(256)) * 40)]
+
+        async def run():
+            protocol, transport = connect(max_queued=100)
+            feed(protocol, b"".join(frame(*f) for f in frames), chunk_size)
+            protocol.connection_lost(None)
+            return await read_all(protocol)
+
+        assert(asyncio.run(run()) == frames)
+
+    def test_payload_received_in_place(self):
+        """Tests that the payload is received into one buffer of exactly its
+        size
+        """
+        async def run():
+            protocol, transport = connect()
+            feed(protocol, HEADER.pack(IMAGE, 5000), 4096)
+            buffer = protocol.get_buffer(-1)
+            feed(protocol, bytes(5000), 4096)
+            return len(buffer), (await protocol.read_frame())[1]
+
+        size, payload = asyncio.run(run())
+        assert(size == 5000)
+        assert(len(payload) == 5000)
+
+    def test_too_large(self):
+        """Tests that a header for a payload over the limit is rejected without
+        allocating it
+        """
+        async def run():
+            protocol, transport = connect()
+            feed(protocol, HEADER.pack(IMAGE, MAX_PAYLOAD + 1), 4096)
+            transport.close.assert_called()
+            protocol.connection_lost(None)
+            await protocol.read_frame()
+
+        with pytest.raises(FrameError):
+            asyncio.run(run())
+
+    def test_disconnected_mid_frame(self):
+        """Tests that an Agent Pi disconnecting part of the way through a frame
+        is reported rather than treated as a clean disconnect
+        """
+        async def run():
+            protocol, transport = connect()
+            feed(protocol, frame(JSON, b"{}")[:4], 4096)
+            protocol.connection_lost(None)
+            await protocol.read_frame()
+
+        with pytest.raises(ConnectionResetError):
+            asyncio.run(run())
+
+    def test_connection_lost_with_error(self):
+        """Tests that a connection dropped by an error, such as keepalive
+        probes going unanswered, is reported rather than treated as a clean
+        disconnect
+        """
+        async def run():
+            protocol, transport = connect()
+            protocol.connection_lost(TimeoutError("Keepalive timed out"))
+            await protocol.read_frame()
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(run())
+
+    def test_idle_time(self):
+        """Tests that the idle time counts from when anything was last
+        received
+        """
+        async def run():
+            protocol, transport = connect()
+            await asyncio.sleep(0.05)
+            before = protocol.get_idle_time()
+            feed(protocol, frame(TEXT, b"x")[:2], 4096)
+            return before, protocol.get_idle_time()
+
+        before, after = asyncio.run(run())
+        assert(before >= 0.05)
+        assert(after < before)
+
+    def test_pauses_when_queue_is_full(self):
+        """Tests that reading from the socket is paused while too many frames
+        are queued and resumed once they have been read
+        """
+        async def run():
+            protocol, transport = connect(max_queued=2)
+            feed(protocol, frame(TEXT, b"a") + frame(TEXT, b"b"), 4096)
+            transport.pause_reading.assert_called_once()
+            await protocol.read_frame()
+            transport.resume_reading.assert_called_once()
+
+        asyncio.run(run())
+
+    def test_write_frame(self):
+        """Tests that a frame is written as its header followed by its payload
+        """
+        async def run():
+            protocol, transport = connect()
+            await protocol.write_frame(JSON, b"{}")
+            return transport
+
+        transport = asyncio.run(run())
+        transport.writelines.assert_called_with([HEADER.pack(JSON, 2), b"{}"])
+
+    def test_encode_header_too_large(self):
+        """Tests that a payload over the limit can't be sent
+        """
+        with pytest.raises(FrameError):
+            encode_header(IMAGE, MAX_PAYLOAD + 1)
+
+class TestRequests:
+    def test_request(self):
+        """Tests that a command, its details and an image are sent in one
+        request and split back apart
+        """
+        payload = encode_request(
+            42, "Add Face", { "username": "test" }, b"\xff\xd8image")
+
+        request_id, command, message, image = decode_request(payload)
+
+        assert(request_id == 42)
+        assert(command == "Add Face")
+        assert(message == { "username": "test" })
+        assert(image == b"\xff\xd8image")
+
+    def test_request_without_details(self):
+        """Tests that a request doesn't need details or an image
+        """
+        assert(decode_request(encode_request(1, "Login With Face")) ==
+               (1, "Login With Face", {}, b""))
+
+    def test_request_too_short(self):
+        """Tests that a request shorter than the lengths in it is rejected
+        """
+        payload = encode_request(1, "Login", { "username": "test" })
+
+        with pytest.raises(FrameError):
+            decode_request(payload[:-3])
+
+    def test_command(self):
+        """Tests that a command sent by its opcode is split back apart
+        """
+        payload = encode_command(
+            42, ADD_FACE, { "username": "test" }, b"\xff\xd8image")
+
+        assert(decode_command(payload) ==
+               (42, ADD_FACE, { "username": "test" }, b"\xff\xd8image"))
+        with pytest.raises(FrameError):
+            decode_command(payload[:8])
+
+    def test_response(self):
+        """Tests that a response carries the id of its request
+        """
+        assert(decode_response(encode_response(9, b"OK")) == (9, b"OK"))
+
+    def test_register(self):
+        """Tests that the id of an Agent Pi's car is read from its
+        registration
+        """
+        assert(decode_register(REGISTER_PAYLOAD.pack(12)) == 12)
+        with pytest.raises(FrameError):
+            decode_register(b"\x00\x0c")
+
+    def test_ack(self):
+        """Tests that the id of the event an Agent Pi acknowledged is read
+        """
+        assert(decode_ack(ACK_PAYLOAD.pack(7)) == 7)
+        with pytest.raises(FrameError):
+            decode_ack(b"\x00\x07")
+
+    def test_telemetry(self):
+        """Tests that a car's position is read in millionths of a degree and
+        that a position that is out of range is rejected
+        """
+        payload = TELEMETRY_PAYLOAD.pack(3, -37808880, 144965179, 1600000000)
+        assert(decode_telemetry(payload) == (3, -37808880, 144965179, 1600000000))
+        with pytest.raises(FrameError):
+            decode_telemetry(payload[:12])
+        with pytest.raises(FrameError):
+            decode_telemetry(TELEMETRY_PAYLOAD.pack(3, 91000000, 0, 1600000000))
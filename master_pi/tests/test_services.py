@@ -0,0 +1,120 @@
+import configparser, flask, json, pytest, mock
+from socket_server.services import HttpServices, JitteredRetry, LocalServices
+
+@pytest.fixture
+def local_services():
+    services = LocalServices(flask.Flask(__name__))
+    services.open()
+    return services
+
+class TestLocalServices:
+    @mock.patch('app.services.car.unlock_car')
+    def test_unlock_car(self, mock_unlock_car, local_services):
+        """Tests that a command is run by the Flask app's service under an app
+        context and its response is encoded as JSON
+        """
+        def unlock_car(message):
+            assert(flask.has_app_context())
+            return { "message": "Car has been unlocked" }, 200
+        mock_unlock_car.side_effect = unlock_car
+
+        # Code to be tested
+        response = local_services.unlock_car({
+            "username": "test",
+            "car_id": 1
+        })
+
+        mock_unlock_car.assert_called_once_with({
+            "username": "test",
+            "car_id": 1
+        })
+        assert(json.loads(response) == { "message": "Car has been unlocked" })
+
+    @mock.patch('app.services.user.login')
+    def test_error_response(self, mock_login, local_services):
+        """Tests that an error from a service is passed back like the API's
+        response would be
+        """
+        mock_login.return_value = ({
+            "message": { "user": ["User does not exist."] },
+            "user": None
+        }, 404)
+
+        # Code to be tested
+        response = local_services.login({
+            "username": "nobody",
+            "password": "dummy"
+        })
+
+        assert(json.loads(response)["message"]["user"] == ["User does not exist."])
+
+class TestHttpServices:
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_url(self, mock_post):
+        """Tests that a command is sent to its endpoint under the given URL
+        """
+        mock_post.return_value.text = '{"message": "Car location updated"}'
+        services = HttpServices("http://10.0.0.2:5000/api")
+        services.open()
+
+        # Code to be tested
+        response = services.change_car_location({
+            "car_id": 1,
+            "location": "-37.80,144.96"
+        })
+
+        assert(mock_post.call_args[0][0] == "http://10.0.0.2:5000/api/setlocation")
+        assert(mock_post.call_args[1]["timeout"] == (3.05, 10))
+        assert(response == '{"message": "Car location updated"}')
+
+    def test_from_config(self):
+        """Tests that the API's URL and the session's settings are read from
+        config.ini, with defaults for the values that aren't set
+        """
+        config = configparser.ConfigParser()
+        config.read_string("""
+            [API]
+            URL = http://10.0.0.2:5000/api/
+            POOL_SIZE = 8
+            RETRIES = 2
+            """)
+        services = HttpServices.from_config(config["API"])
+
+        # Code to be tested
+        services.open()
+
+        adapter = services.get_session().get_adapter("http://10.0.0.2:5000/api/")
+        assert(adapter._pool_maxsize == 8)
+        assert(adapter.max_retries.connect == 2)
+        assert(adapter.max_retries.read == 0)
+        services.close()
+
+    def test_connection_reused(self):
+        """Tests that calls share one session so that connections to the API
+        are kept alive between commands
+        """
+        services = HttpServices()
+        services.open()
+        session = services.get_session()
+
+        with mock.patch.object(session, 'post') as mock_post:
+            services.login({ "username": "test", "password": "dummy" })
+            services.unlock_car({ "username": "test", "car_id": 1 })
+
+        assert(mock_post.call_count == 2)
+        assert(services.get_session() is session)
+        services.close()
+
+    def test_retry_jitter(self):
+        """Tests that the time waited before a retry is random but never more
+        than the exponential backoff
+        """
+        retry = JitteredRetry(total=5, backoff_factor=1)
+        for i in range(4):
+            retry = retry.increment(method="POST", url="/api/login",
+                                    error=ConnectionError())
+        backoff = super(JitteredRetry, retry).get_backoff_time()
+
+        waits = [retry.get_backoff_time() for i in range(50)]
+        assert(all(0 <= wait <= backoff for wait in waits))
+        assert(len(set(waits)) > 1)
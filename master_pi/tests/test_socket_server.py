@@ -1,53 +1,148 @@
-import json, pytest, mock
+import asyncio, cv2, flask, json, pytest, mock, time
+import numpy as np
+from socket_server.connection import Connection
+from socket_server.protocol import (ACK, ACK_PAYLOAD, COMMAND, EVENT,
+    EVENT_HEADER, FrameProtocol, HEADER, LOGIN, LOGIN_WITH_FACE, PING,
+    PONG, REGISTER, REGISTER_PAYLOAD, REQUEST, RESPONSE, TELEMETRY,
+    TELEMETRY_PAYLOAD, TEXT, decode_response, encode_command, encode_request)
+# The server raises the error from the protocol module on the path
+from protocol import FrameError
 from socket_server.server import Server
+from socket_server.services import HttpServices
 
 # Fixtures specific to the socket server tests
 @pytest.fixture
-def socket_server():
-    server = Server()
-    server.start_socket_server()
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture
+def socket_server(event_loop):
+    server = Server(host="127.0.0.1", port=0, services=HttpServices())
+    event_loop.run_until_complete(server.start_socket_server())
 
     yield server
 
-    server.stop_socket_server()
+    event_loop.run_until_complete(server.stop_socket_server())
+
+def make_connection(loop, *frames):
+    """Creates a connection to an Agent Pi that sends the given frames and
+    then disconnects
+    """
+    async def create():
+        protocol = FrameProtocol(mock.AsyncMock(), max_queued=100)
+        protocol.connection_made(transport)
+        data = b"".join(HEADER.pack(message_type, len(payload)) + payload
+                        for message_type, payload in frames)
+        while data:
+            buffer = protocol.get_buffer(-1)
+            nbytes = min(len(buffer), len(data))
+            buffer[:nbytes] = data[:nbytes]
+            protocol.buffer_updated(nbytes)
+            data = data[nbytes:]
+        protocol.connection_lost(None)
+        return Connection(protocol)
+
+    transport = mock.Mock()
+    transport.is_closing.return_value = False
+    transport.get_extra_info.return_value = ("127.0.0.1", 50000)
+    return loop.run_until_complete(create()), transport
+
+def encode(image):
+    """Compresses an image the way the Agent Pi does
+    """
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+def sent(transport):
+    """Returns the payload of the last message that was sent to the Agent Pi
+    """
+    return transport.writelines.call_args[0][0][1]
+
+async def send_frame(writer, message_type, payload):
+    writer.write(HEADER.pack(message_type, len(payload)) + payload)
+    await writer.drain()
+
+async def read_frame(reader):
+    message_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return message_type, await reader.readexactly(length)
 
 class TestSocketServer:
     def test_start_socket_server(self, socket_server):
         """Tests that the server socket starts successfully
         """
-        assert(socket_server.get_server() is not None)
-        assert(socket_server.get_client() is None)
+        assert(socket_server.get_server().is_serving())
+        assert(len(socket_server.get_connections()) == 0)
+
+    def test_operations(self, socket_server, event_loop):
+        """Tests that a request calls the handler for its command and is
+        answered with a single response carrying the request's id
+        """
+        mock_login = mock.AsyncMock(return_value='{"user": "test"}')
+        socket_server.register_handler(LOGIN, "Login", mock_login)
+        connection, transport = make_connection(event_loop, (REQUEST, encode_request(
+            7, "Login", { "username": "test", "password": "dummy" })))
+
+        # Code to be tested
+        event_loop.run_until_complete(socket_server.operations(connection))
 
-    @mock.patch('socket_server.server.socket.socket.accept')
-    def test_wait_for_connection(self, mock_connection, socket_server):
-        """Tests that the server socket can be connected to successfully
+        mock_login.assert_called_once_with(
+            { "username": "test", "password": "dummy" }, b"")
+        assert(transport.writelines.call_count == 1)
+        message_type = HEADER.unpack(transport.writelines.call_args[0][0][0])[0]
+        assert(message_type == RESPONSE)
+        assert(decode_response(sent(transport)) == (7, b'{"user": "test"}'))
+
+    def test_operations_unknown_command(self, socket_server, event_loop):
+        """Tests that a request for a command that doesn't exist is answered
+        with an error
         """
-        # Setting up mock object
-        mock_connection.return_value = ("client", "127.0.0.1")
+        connection, transport = make_connection(
+            event_loop, (REQUEST, encode_request(1, "Fly")))
 
         # Code to be tested
-        address = socket_server.wait_for_connection()
+        event_loop.run_until_complete(socket_server.operations(connection))
 
-        assert(address == "127.0.0.1")
-        assert(socket_server.get_client() is not None)
+        request_id, body = decode_response(sent(transport))
+        assert(json.loads(body)["message"] == "Unknown command: Fly")
 
-    @mock.patch('socket_server.server.socket.socket.accept')
-    def test_wait_for_instruction(self, mock_connection, socket_server):
-        """Tests that the instruction sent to the server is correct
+    def test_operations_by_opcode(self, socket_server, event_loop):
+        """Tests that a command sent by its opcode runs its handler and that
+        the handler's calls and errors are counted
         """
-        # Setting up mock object
-        mock_connection.return_value = (mock_connection, "127.0.0.1")
-        mock_connection.recv.return_value = "Login".encode()
+        async def fail(message, image):
+            raise RuntimeError("Handler failed")
+        socket_server.register_handler(40, "Honk", mock.AsyncMock(
+            return_value='{"message": "Honked"}'))
+        socket_server.register_handler(41, "Flash Lights", fail)
+        connection, transport = make_connection(
+            event_loop,
+            (COMMAND, encode_command(1, 40, { "car_id": 1 })),
+            (COMMAND, encode_command(2, 41, { "car_id": 1 })))
 
         # Code to be tested
-        socket_server.wait_for_connection()
-        instruction = socket_server.wait_for_instruction()
+        event_loop.run_until_complete(socket_server.operations(connection))
 
-        assert(instruction == "Login")
+        assert(decode_response(transport.writelines.call_args_list[0][0][0][1]) ==
+            (1, b'{"message": "Honked"}'))
+        transport.close.assert_called()
+        stats = socket_server.get_handler_stats()
+        assert(stats["Honk"]["calls"] == 1 and stats["Honk"]["errors"] == 0)
+        assert(stats["Flash Lights"]["calls"] == 1)
+        assert(stats["Flash Lights"]["errors"] == 1)
 
-    @mock.patch('socket_server.server.socket.socket.accept')
-    @mock.patch('socket_server.server.requests.post')
-    def test_login(self, mock_post, mock_connection, socket_server):
+    def test_text_command_rejected(self, socket_server, event_loop):
+        """Tests that a command sent on its own, as old Agent Pis did, is
+        refused
+        """
+        connection, transport = make_connection(event_loop, (TEXT, b"Login"))
+
+        # Code to be tested
+        with pytest.raises(FrameError):
+            event_loop.run_until_complete(socket_server.operations(connection))
+
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_login(self, mock_post, socket_server, event_loop):
         """Tests that the socket calls the API endpoint for logging in and
         returns it's response correctly
         """
@@ -57,43 +152,116 @@ class TestSocketServer:
         })
 
         # Setting up mock objects
-        mock_connection.return_value = (mock_connection, "127.0.0.1")
-        mock_connection.recv.return_value = json.dumps({
-            "username": "test",
-            "password": "dummy"
-        }).encode()
-        mock_post.status_code.return_value = 200
         mock_post.return_value.text = api_response
 
         # Code to be tested
-        socket_server.wait_for_connection()
-        response = socket_server.login()
+        response = event_loop.run_until_complete(socket_server.login({
+            "username": "test",
+            "password": "dummy"
+            }))
 
-        mock_connection.sendall.assert_called_with(api_response.encode())
+        assert(response == api_response)
 
-    @mock.patch('socket_server.server.socket.socket.accept')
-    @mock.patch('socket_server.server.Server.receive_image_from_client')
     @mock.patch('socket_server.face_recognition_util.cv2.imwrite')
-    def test_add_face(self, mock_cv2, mock_image, mock_connection, socket_server):
+    @mock.patch('face_recognition_pool.FaceRecognitionPool.encode_image')
+    @mock.patch('face_encoding_store.FaceEncodingStore.save')
+    def test_add_face(self, mock_save, mock_encode, mock_cv2, socket_server, event_loop):
         """Tests to make sure that images are being saved
         """
         # Setting up mock objects
-        mock_connection.return_value = (mock_connection, "127.0.0.1")
-        mock_image.return_value = {
-            "username": "test",
-            "image": "image"
-        }
+        image = np.zeros((4, 4, 3), dtype=np.uint8)
+        mock_encode.return_value = [np.zeros(128)]
 
         # Code to be tested
-        socket_server.wait_for_connection()
-        socket_server.add_face()
+        response = event_loop.run_until_complete(socket_server.add_face(
+            { "username": "test" }, encode(image)))
 
         # Making sure that the function to save to the dataset folder is called
         mock_cv2.assert_called()
+        assert(response == "OK")
+
+    @mock.patch('face_recognition_pool.FaceRecognitionPool.find_match')
+    def test_login_with_face(self, mock_match, socket_server, event_loop):
+        """Tests that the user matched by the worker pool is sent back to the
+        Agent Pi
+        """
+        # Setting up mock objects
+        image = np.full((4, 4, 3), 2, dtype=np.uint8)
+        mock_match.return_value = ("test", 0.25)
+
+        # Code to be tested
+        response = event_loop.run_until_complete(
+            socket_server.login_with_face({}, encode(image)))
+
+        response = json.loads(response)
+        assert(response["username"] == "test")
+        assert(response["distance"] == 0.25)
+
+    @mock.patch('face_recognition_pool.FaceRecognitionPool.find_match')
+    def test_login_with_face_cached(self, mock_match, socket_server, event_loop):
+        """Tests that an image that is sent again is answered from the probe
+        cache instead of being matched again
+        """
+        # Setting up mock objects
+        image = np.zeros((4, 4, 3), dtype=np.uint8)
+        mock_match.return_value = ("test", 0.25)
+        hits = socket_server.get_probe_cache().get_stats()["hits"]
+
+        # Code to be tested
+        event_loop.run_until_complete(
+            socket_server.login_with_face({}, encode(image)))
+        response = event_loop.run_until_complete(
+            socket_server.login_with_face({}, encode(image)))
+
+        mock_match.assert_called_once()
+        assert(socket_server.get_probe_cache().get_stats()["hits"] == hits + 1)
+        response = json.loads(response)
+        assert(response["username"] == "test")
+
+    @mock.patch('face_recognition_pool.FaceRecognitionPool.submit')
+    def test_login_with_face_busy(self, mock_submit, socket_server, event_loop):
+        """Tests that the Agent Pi is told to retry when the worker pool's queue
+        is full
+        """
+        from face_recognition_pool import PoolBusyError
 
-    @mock.patch('socket_server.server.socket.socket.accept')
-    @mock.patch('socket_server.server.requests.post')
-    def test_return_car(self, mock_post, mock_connection, socket_server):
+        # Setting up mock objects
+        image = np.ones((4, 4, 3), dtype=np.uint8)
+        mock_submit.side_effect = PoolBusyError()
+
+        # Code to be tested
+        response = event_loop.run_until_complete(
+            socket_server.login_with_face({}, encode(image)))
+
+        response = json.loads(response)
+        assert(response["username"] is None)
+        assert(response["busy"] is True)
+
+    def test_login_with_face_invalid_image(self, socket_server, event_loop):
+        """Tests that the Agent Pi is told when the image it sent can't be read
+        """
+        # Code to be tested
+        response = event_loop.run_until_complete(
+            socket_server.login_with_face({}, b"not an image"))
+
+        response = json.loads(response)
+        assert(response["username"] is None)
+        assert(response["message"] == "The image could not be read.")
+
+    @pytest.mark.parametrize("image", [None, b""])
+    def test_login_with_face_no_image(self, socket_server, event_loop, image):
+        """Tests that the Agent Pi is told when it didn't send an image
+        """
+        # Code to be tested
+        response = event_loop.run_until_complete(
+            socket_server.login_with_face({}, image))
+
+        response = json.loads(response)
+        assert(response["username"] is None)
+        assert(response["message"] == "The image could not be read.")
+
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_return_car(self, mock_post, socket_server, event_loop):
         """Tests that the socket calls the API endpoint for returning a car and
         returns it's response correctly
         """
@@ -102,24 +270,21 @@ class TestSocketServer:
         })
 
         # Setting up mock objects
-        mock_connection.return_value = (mock_connection, "127.0.0.1")
-        mock_connection.recv.return_value = json.dumps({
-            "username": "test",
-            "car_id": "1",
-            "method": "return"
-        }).encode()
-        mock_post.status_code.return_value = 200
         mock_post.return_value.text = api_response
 
         # Code to be tested
-        socket_server.wait_for_connection()
-        response = socket_server.change_lock_status()
+        response = event_loop.run_until_complete(
+            socket_server.change_lock_status({
+                "username": "test",
+                "car_id": "1",
+                "method": "return"
+            }))
 
-        mock_connection.sendall.assert_called_with(api_response.encode())
+        assert(mock_post.call_args[0][0] == 'http://localhost:5000/api/return')
+        assert(response == api_response)
 
-    @mock.patch('socket_server.server.socket.socket.accept')
-    @mock.patch('socket_server.server.requests.post')
-    def test_unlock_car(self, mock_post, mock_connection, socket_server):
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_unlock_car(self, mock_post, socket_server, event_loop):
         """Tests that the socket calls the API endpoint for unlocking a car and
         returns it's response correctly
         """
@@ -128,24 +293,21 @@ class TestSocketServer:
         })
 
         # Setting up mock objects
-        mock_connection.return_value = (mock_connection, "127.0.0.1")
-        mock_connection.recv.return_value = json.dumps({
-            "username": "test",
-            "car_id": "1",
-            "method": "unlock"
-        }).encode()
-        mock_post.status_code.return_value = 200
         mock_post.return_value.text = api_response
 
         # Code to be tested
-        socket_server.wait_for_connection()
-        response = socket_server.change_lock_status()
+        response = event_loop.run_until_complete(
+            socket_server.change_lock_status({
+                "username": "test",
+                "car_id": "1",
+                "method": "unlock"
+            }))
 
-        mock_connection.sendall.assert_called_with(api_response.encode())
+        assert(mock_post.call_args[0][0] == 'http://localhost:5000/api/unlock')
+        assert(response == api_response)
 
-    @mock.patch('socket_server.server.socket.socket.accept')
-    @mock.patch('socket_server.server.requests.post')
-    def test_change_car_location(self, mock_post, mock_connection, socket_server):
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_change_car_location(self, mock_post, socket_server, event_loop):
         """Tests that the socket calls the API endpoint for changing the location
         of a car and returns it's response correctly
         """
@@ -154,16 +316,445 @@ class TestSocketServer:
         })
 
         # Setting up mock objects
-        mock_connection.return_value = (mock_connection, "127.0.0.1")
-        mock_connection.recv.return_value = json.dumps({
-            "car_id": "1",
-            "location": "return"
-        }).encode()
-        mock_post.status_code.return_value = 200
         mock_post.return_value.text = api_response
 
         # Code to be tested
-        socket_server.wait_for_connection()
-        response = socket_server.change_car_location()
+        response = event_loop.run_until_complete(
+            socket_server.change_car_location({
+                "car_id": "1",
+                "location": "return"
+            }))
+
+        assert(response == api_response)
+
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_many_cars_unlock_at_once(self, mock_post, socket_server, event_loop):
+        """Tests that many Agent Pis connected at the same time are served at
+        the same time, so that a slow API call for one car doesn't hold up the
+        others
+        """
+        cars = 50
+        api_delay = 0.2
+
+        def slow_post(url, json, timeout):
+            time.sleep(api_delay)
+            return mock.Mock(text='{"message": "Car is unlocked"}')
+        mock_post.side_effect = slow_post
+        port = socket_server.get_server().sockets[0].getsockname()[1]
+
+        async def unlock(car_id):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, REQUEST, encode_request(
+                1, "Change Lock Status", {
+                    "username": "test",
+                    "car_id": car_id,
+                    "method": "unlock"
+                }))
+            message_type, payload = await read_frame(reader)
+            writer.close()
+            return json.loads(decode_response(payload)[1])
+
+        async def unlock_every_car():
+            return await asyncio.gather(
+                *[unlock(car_id) for car_id in range(cars)])
+
+        # Code to be tested
+        start_time = time.perf_counter()
+        responses = event_loop.run_until_complete(unlock_every_car())
+        elapsed = time.perf_counter() - start_time
+
+        assert(all(response["message"] == "Car is unlocked"
+                   for response in responses))
+        assert(mock_post.call_count == cars)
+        # Served one car at a time this would take cars * api_delay seconds
+        assert(elapsed < cars * api_delay / 5)
+
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_requests_answered_as_they_finish(self, mock_post, socket_server,
+                                              event_loop):
+        """Tests that an Agent Pi can send several requests on one connection
+        and that a slow face login doesn't hold up a location update sent
+        after it
+        """
+        mock_post.return_value.text = '{"message": "Location updated"}'
+        port = socket_server.get_server().sockets[0].getsockname()[1]
+
+        async def pipeline():
+            face_checked = asyncio.Event()
+
+            async def slow_login_with_face(message, image):
+                await face_checked.wait()
+                return '{"username": "test"}'
+            socket_server.register_handler(
+                LOGIN_WITH_FACE, "Login With Face", slow_login_with_face)
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, REQUEST, encode_request(
+                1, "Login With Face", image=b"image"))
+            await send_frame(writer, REQUEST, encode_request(
+                2, "Change Car Location", {
+                    "car_id": 1,
+                    "location": "-37.80,144.96"
+                }))
+            first = decode_response((await read_frame(reader))[1])
+            face_checked.set()
+            second = decode_response((await read_frame(reader))[1])
+            writer.close()
+            return first, second
+
+        # Code to be tested
+        first, second = event_loop.run_until_complete(pipeline())
+
+        assert(first == (2, b'{"message": "Location updated"}'))
+        assert(second == (1, b'{"username": "test"}'))
+
+    def test_heartbeat(self, socket_server, event_loop):
+        """Tests that a heartbeat from an Agent Pi is answered
+        """
+        connection, transport = make_connection(event_loop, (PING, b""))
+
+        # Code to be tested
+        event_loop.run_until_complete(socket_server.operations(connection))
+
+        message_type = HEADER.unpack(transport.writelines.call_args[0][0][0])[0]
+        assert(message_type == PONG)
+
+    def test_idle_connection_reaped(self, event_loop):
+        """Tests that the connection of an Agent Pi that has gone silent is
+        closed and counted, while one sending heartbeats is kept open
+        """
+        server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                        idle_timeout=0.3)
+        event_loop.run_until_complete(server.start_socket_server())
+        port = server.get_server().sockets[0].getsockname()[1]
+
+        async def silent_and_heartbeating_cars():
+            silent_reader, silent_writer = await asyncio.open_connection(
+                "127.0.0.1", port)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            pongs = 0
+            for i in range(8):
+                await send_frame(writer, PING, b"")
+                if (await read_frame(reader))[0] == PONG:
+                    pongs += 1
+                await asyncio.sleep(0.1)
+            closed = await silent_reader.read() == b""
+            stats = server.get_connection_stats()
+            writer.close()
+            return closed, pongs, stats
+
+        # Code to be tested
+        closed, pongs, stats = event_loop.run_until_complete(
+            silent_and_heartbeating_cars())
+        event_loop.run_until_complete(server.stop_socket_server())
+
+        assert(closed)
+        assert(pongs == 8)
+        assert(stats == { "connected": 1, "cars": 0, "reaped": 1, "lost": 0 })
+
+    def test_disconnected_car_is_forgotten(self, socket_server, event_loop):
+        """Tests that an Agent Pi's connection is dropped once it disconnects
+        """
+        port = socket_server.get_server().sockets[0].getsockname()[1]
+
+        async def connect_and_disconnect():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await asyncio.sleep(0.05)
+            connected = len(socket_server.get_connections())
+            writer.close()
+            await asyncio.sleep(0.05)
+            return connected, len(socket_server.get_connections())
+
+        connected, remaining = event_loop.run_until_complete(
+            connect_and_disconnect())
+        assert(connected == 1)
+        assert(remaining == 0)
+
+    def test_drained_on_stop(self, event_loop):
+        """Tests that a request that has started when the server is stopped is
+        still answered, and that no more Agent Pis are accepted meanwhile
+        """
+        server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                        reuse_port=True)
+        event_loop.run_until_complete(server.start_socket_server())
+        port = server.get_server().sockets[0].getsockname()[1]
+
+        async def unlock_while_stopping():
+            started = asyncio.Event()
+
+            async def slow_unlock(message, image):
+                started.set()
+                await asyncio.sleep(0.2)
+                return '{"message": "Car unlocked"}'
+            server.register_handler(40, "Slow Unlock", slow_unlock)
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, COMMAND, encode_command(1, 40, {}))
+            await started.wait()
+            stopping = asyncio.ensure_future(
+                server.stop_socket_server(drain_timeout=5))
+            await asyncio.sleep(0)
+            with pytest.raises(ConnectionRefusedError):
+                await asyncio.open_connection("127.0.0.1", port)
+            response = decode_response((await read_frame(reader))[1])
+            await stopping
+            writer.close()
+            return response
+
+        # Code to be tested
+        response = event_loop.run_until_complete(unlock_while_stopping())
+
+        assert(response == (1, b'{"message": "Car unlocked"}'))
+
+    def test_push_event(self, socket_server, event_loop):
+        """Tests that an event is pushed to a car that has registered, and
+        that the car is forgotten once it disconnects
+        """
+        port = socket_server.get_server().sockets[0].getsockname()[1]
+
+        async def register_and_push():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, REGISTER, REGISTER_PAYLOAD.pack(1))
+            while 1 not in socket_server.get_cars():
+                await asyncio.sleep(0.01)
+            pushed = await socket_server.push_event(1, {
+                "type": "booking_cancelled",
+                "booking_id": 3
+            })
+            not_connected = await socket_server.push_event(2, {
+                "type": "remote_lock"
+            })
+            frame = await read_frame(reader)
+            writer.close()
+            while socket_server.get_cars():
+                await asyncio.sleep(0.01)
+            return pushed, not_connected, frame
+
+        # Code to be tested
+        pushed, not_connected, (message_type, payload) = \
+            event_loop.run_until_complete(
+                asyncio.wait_for(register_and_push(), 5))
+
+        assert(pushed)
+        assert(not not_connected)
+        assert(message_type == EVENT)
+        assert(EVENT_HEADER.unpack_from(payload)[0] == 1)
+        assert(json.loads(payload[EVENT_HEADER.size:]) == {
+            "type": "booking_cancelled",
+            "booking_id": 3
+        })
+
+    def test_event_from_flask_app(self, event_loop, tmp_path):
+        """Tests that an event sent by the Flask app is pushed to the car it is
+        for
+        """
+        from app.events import BOOKING_STARTED, push_event
+        server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                        events_folder=str(tmp_path))
+        event_loop.run_until_complete(server.start_socket_server())
+        port = server.get_server().sockets[0].getsockname()[1]
+        app = flask.Flask(__name__)
+        app.config["CAR_EVENTS_FOLDER"] = str(tmp_path)
+
+        async def book_car():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, REGISTER, REGISTER_PAYLOAD.pack(7))
+            while 7 not in server.get_cars():
+                await asyncio.sleep(0.01)
+            with app.app_context():
+                sent = push_event(7, BOOKING_STARTED, username="dummy")
+            frame = await read_frame(reader)
+            writer.close()
+            return sent, frame
+
+        # Code to be tested
+        sent, (message_type, payload) = event_loop.run_until_complete(
+            asyncio.wait_for(book_car(), 5))
+        stats = server.get_event_bus().get_stats()
+        event_loop.run_until_complete(server.stop_socket_server())
+
+        assert(sent == 1)
+        assert(message_type == EVENT)
+        assert(json.loads(payload[EVENT_HEADER.size:]) == {
+            "type": "booking_started",
+            "username": "dummy"
+        })
+        assert(stats == { "received": 1, "pushed": 1 })
+        assert(list(tmp_path.iterdir()) == [])
+
+    def test_push_event_to_cars(self, socket_server, event_loop):
+        """Tests that an event is pushed to several cars at once and that each
+        car's acknowledgement is waited for until the deadline
+        """
+        port = socket_server.get_server().sockets[0].getsockname()[1]
+
+        async def lock_cars():
+            cars = {}
+            for car_id in (1, 2, 3):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                await send_frame(writer, REGISTER, REGISTER_PAYLOAD.pack(car_id))
+                cars[car_id] = (reader, writer)
+            while len(socket_server.get_cars()) < 3:
+                await asyncio.sleep(0.01)
+
+            async def acknowledge(reader, writer):
+                message_type, payload = await read_frame(reader)
+                await send_frame(writer, ACK, payload[:EVENT_HEADER.size])
+
+            async def disconnect(reader, writer):
+                await read_frame(reader)
+                writer.close()
+
+            # Car 1 acknowledges the event, car 2 never answers, car 3
+            # disconnects and car 4 isn't connected
+            start_time = time.monotonic()
+            results, *_ = await asyncio.gather(
+                socket_server.push_event_to_cars(
+                    [1, 2, 3, 4], { "type": "remote_lock" }, 0.5),
+                acknowledge(*cars[1]),
+                disconnect(*cars[3]))
+            elapsed = time.monotonic() - start_time
+            for reader, writer in cars.values():
+                writer.close()
+            return results, elapsed
+
+        # Code to be tested
+        results, elapsed = event_loop.run_until_complete(
+            asyncio.wait_for(lock_cars(), 5))
+
+        assert(results == {
+            1: "acknowledged",
+            2: "no_ack",
+            3: "disconnected"
+        })
+        assert(0.5 <= elapsed < 1.5)
+
+    def test_lock_cars_from_flask_app(self, event_loop, tmp_path):
+        """Tests that the Flask app gets back whether each car acknowledged an
+        event pushed to several cars
+        """
+        from app.events import REMOTE_LOCK, push_event_to_cars
+        server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                        events_folder=str(tmp_path))
+        event_loop.run_until_complete(server.start_socket_server())
+        port = server.get_server().sockets[0].getsockname()[1]
+        app = flask.Flask(__name__)
+        app.config["CAR_EVENTS_FOLDER"] = str(tmp_path)
+
+        def lock_cars():
+            with app.app_context():
+                return push_event_to_cars([1, 9], REMOTE_LOCK, 2)
+
+        async def lock_while_connected():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, REGISTER, REGISTER_PAYLOAD.pack(1))
+            while 1 not in server.get_cars():
+                await asyncio.sleep(0.01)
+            locking = asyncio.get_running_loop().run_in_executor(
+                None, lock_cars)
+            message_type, payload = await read_frame(reader)
+            await send_frame(writer, ACK, payload[:ACK_PAYLOAD.size])
+            results = await locking
+            writer.close()
+            return message_type, payload, results
+
+        # Code to be tested
+        message_type, payload, results = event_loop.run_until_complete(
+            asyncio.wait_for(lock_while_connected(), 5))
+        event_loop.run_until_complete(server.stop_socket_server())
+
+        assert(message_type == EVENT)
+        assert(json.loads(payload[EVENT_HEADER.size:]) == { "type": "remote_lock" })
+        assert(results == { 1: "acknowledged", 9: "not_connected" })
+        assert(list(tmp_path.iterdir()) == [])
+
+    @mock.patch('socket_server.services.requests.Session.post')
+    def test_positions_saved_in_batches(self, mock_post, event_loop):
+        """Tests that the positions cars stream are saved in one batch with
+        only the latest position of each car
+        """
+        server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                        location_interval=60)
+        event_loop.run_until_complete(server.start_socket_server())
+        port = server.get_server().sockets[0].getsockname()[1]
+
+        async def stream():
+            first = await asyncio.open_connection("127.0.0.1", port)
+            second = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(first[1], REGISTER, REGISTER_PAYLOAD.pack(1))
+            await send_frame(second[1], REGISTER, REGISTER_PAYLOAD.pack(2))
+            for step in range(100):
+                await send_frame(first[1], TELEMETRY, TELEMETRY_PAYLOAD.pack(
+                    1, -37808880 - step, 144965179 + step, 1600000000))
+            await send_frame(second[1], TELEMETRY, TELEMETRY_PAYLOAD.pack(
+                2, -37810219, 144961395, 1600000000))
+            while server.get_position_buffer().get_stats()["received"] < 101:
+                await asyncio.sleep(0.01)
+            first[1].close()
+            second[1].close()
+
+        # Code to be tested
+        event_loop.run_until_complete(asyncio.wait_for(stream(), 5))
+        assert(mock_post.call_count == 0)
+        event_loop.run_until_complete(server.stop_socket_server())
+
+        mock_post.assert_called_once()
+        assert(mock_post.call_args[0][0] == 'http://localhost:5000/api/setlocations')
+        assert(mock_post.call_args[1]["json"] == {
+            "locations": [
+                { "car_id": 1, "location": "-37.808979,144.965278" },
+                { "car_id": 2, "location": "-37.810219,144.961395" }
+            ]
+        })
+        assert(server.get_position_buffer().get_stats() == {
+            "received": 101,
+            "coalesced": 99,
+            "saved": 2,
+            "failed": 0
+        })
+
+    def test_position_for_another_car_rejected(self, socket_server, event_loop):
+        """Tests that an Agent Pi that has registered can't move another car,
+        and is disconnected if it tries
+        """
+        port = socket_server.get_server().sockets[0].getsockname()[1]
+
+        async def stream():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, REGISTER, REGISTER_PAYLOAD.pack(1))
+            await send_frame(writer, TELEMETRY, TELEMETRY_PAYLOAD.pack(
+                1, -37808880, 144965179, 1600000000))
+            await send_frame(writer, TELEMETRY, TELEMETRY_PAYLOAD.pack(
+                2, -37810219, 144961395, 1600000000))
+            closed = await reader.read()
+            writer.close()
+            return closed
+
+        # Code to be tested
+        closed = event_loop.run_until_complete(asyncio.wait_for(stream(), 5))
+
+        assert(closed == b"")
+        assert(socket_server.get_position_buffer().get_positions() == {
+            1: (-37808880, 144965179, 1600000000)
+        })
+
+    def test_position_before_register_rejected(self, socket_server,
+                                               event_loop):
+        """Tests that an Agent Pi that hasn't registered can't move a car, and
+        is disconnected if it tries
+        """
+        port = socket_server.get_server().sockets[0].getsockname()[1]
+
+        async def stream():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await send_frame(writer, TELEMETRY, TELEMETRY_PAYLOAD.pack(
+                1, -37808880, 144965179, 1600000000))
+            closed = await reader.read()
+            writer.close()
+            return closed
+
+        # Code to be tested
+        closed = event_loop.run_until_complete(asyncio.wait_for(stream(), 5))
 
-        mock_connection.sendall.assert_called_with(api_response.encode())
+        assert(closed == b"")
+        assert(socket_server.get_position_buffer().get_positions() == {})
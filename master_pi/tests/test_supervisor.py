@@ -0,0 +1,42 @@
+import os, signal, threading, time, pytest, mock
+from socket_server.supervisor import Supervisor
+
+def crash_once(path, number):
+    """Exits as if it had crashed the first time it is run, and otherwise
+    runs until it is sent SIGTERM
+    """
+    with open(path, "a") as f:
+        f.write("{}\n".format(os.getpid()))
+    with open(path) as f:
+        if len(f.readlines()) == 1:
+            os._exit(1)
+    time.sleep(30)
+
+class TestSupervisor:
+    @mock.patch.object(Supervisor, '_Supervisor__RESTART_DELAY', 0.05)
+    def test_crashed_worker_restarted(self, tmp_path):
+        """Tests that a worker that crashes is started again, and that every
+        worker is stopped once the supervisor is sent SIGTERM
+        """
+        path = str(tmp_path / "pids")
+        supervisor = Supervisor(lambda number: crash_once(path, number), 1,
+                                stop_timeout=5)
+
+        def stop_once_restarted():
+            for i in range(100):
+                if supervisor.get_restarts() == 1 and supervisor.get_pids():
+                    break
+                time.sleep(0.05)
+            os.kill(os.getpid(), signal.SIGTERM)
+        threading.Thread(target=stop_once_restarted).start()
+
+        # Code to be tested
+        supervisor.run()
+
+        with open(path) as f:
+            pids = [int(line) for line in f]
+        assert(supervisor.get_restarts() == 1)
+        assert(len(pids) == 2)
+        assert(supervisor.get_pids() == [])
+        with pytest.raises(ProcessLookupError):
+            os.kill(pids[1], 0)
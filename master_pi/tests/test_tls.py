@@ -0,0 +1,83 @@
+import asyncio, os, socket, ssl, stat, pytest
+from socket_server.protocol import HEADER, PING, PONG
+from socket_server.server import Server
+from socket_server.services import HttpServices
+from socket_server.tls import (create_client_context, create_self_signed_cert,
+    create_server_context)
+
+@pytest.fixture
+def cert(tmp_path):
+    certfile = str(tmp_path / "cert.pem")
+    keyfile = str(tmp_path / "key.pem")
+    create_self_signed_cert(certfile, keyfile)
+    return certfile, keyfile
+
+def ping(context, port, session=None):
+    """Connects to the server over TLS, sends a heartbeat and waits for the
+    answer, returning whether the session was resumed and the session
+    """
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as raw:
+        with context.wrap_socket(raw, session=session) as sock:
+            sock.sendall(HEADER.pack(PING, 0))
+            message_type, length = HEADER.unpack(sock.recv(HEADER.size))
+            assert(message_type == PONG)
+            return sock.session_reused, sock.session
+
+class TestTls:
+    def test_self_signed_cert(self, cert):
+        """Tests that the certificate that is created can be loaded and that
+        only the owner can read its key
+        """
+        certfile, keyfile = cert
+
+        create_server_context(certfile, keyfile)
+        create_client_context(certfile)
+
+        assert(stat.S_IMODE(os.stat(keyfile).st_mode) == 0o600)
+
+    def test_session_resumed(self, cert):
+        """Tests that an Agent Pi connects over TLS and that its session is
+        resumed when it reconnects
+        """
+        certfile, keyfile = cert
+        context = create_client_context(certfile)
+        loop = asyncio.new_event_loop()
+        server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                        ssl_context=create_server_context(certfile, keyfile))
+        port = loop.run_until_complete(server.start_socket_server())[1]
+
+        async def connect_twice():
+            first = await loop.run_in_executor(None, ping, context, port)
+            return first, await loop.run_in_executor(
+                None, ping, context, port, first[1])
+
+        # Code to be tested
+        try:
+            first, second = loop.run_until_complete(connect_twice())
+        finally:
+            loop.run_until_complete(server.stop_socket_server())
+            loop.close()
+
+        assert(not first[0])
+        assert(second[0])
+
+    def test_untrusted_cert(self, cert, tmp_path):
+        """Tests that an Agent Pi refuses a server whose certificate isn't the
+        one it was given
+        """
+        certfile, keyfile = cert
+        other = str(tmp_path / "other.pem")
+        create_self_signed_cert(other, str(tmp_path / "other_key.pem"))
+        loop = asyncio.new_event_loop()
+        server = Server(host="127.0.0.1", port=0, services=HttpServices(),
+                        ssl_context=create_server_context(certfile, keyfile))
+        port = loop.run_until_complete(server.start_socket_server())[1]
+
+        # Code to be tested
+        try:
+            with pytest.raises(ssl.SSLCertVerificationError):
+                loop.run_until_complete(loop.run_in_executor(
+                    None, ping, create_client_context(other), port))
+        finally:
+            loop.run_until_complete(server.stop_socket_server())
+            loop.close()